@@ -0,0 +1,77 @@
+"""Take, inspect, verify and restore incremental backups from the command line.
+
+    python backup.py snapshot                          # back up now
+    python backup.py list
+    python backup.py verify                            # the latest snapshot; --all for every one
+    python backup.py restore 20261019T120000123456Z    # into restored/<id>/
+    python backup.py restore --at "2026-10-19 12:00"   # latest snapshot at or before a UTC time
+    python backup.py restore --latest --in-place       # over the live files
+
+Restores are written to a separate directory unless --in-place is given. Stop the
+bot before restoring in place: it keeps the database in memory and would overwrite
+the restored file on its next save.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import bot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage incremental backups of the bot's data.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('snapshot', help="Back up the current files")
+    commands.add_parser('list', help="List snapshots, oldest first")
+    verify = commands.add_parser('verify', help="Check snapshot checksums")
+    verify.add_argument('snapshot', nargs='?', help="Snapshot id (defaults to the latest)")
+    verify.add_argument('--all', action='store_true', help="Verify every snapshot")
+    restore = commands.add_parser('restore', help="Restore a snapshot")
+    restore.add_argument('snapshot', nargs='?', help="Snapshot id")
+    restore.add_argument('--at', type=datetime.fromisoformat, help="Restore the latest snapshot at or before this UTC time")
+    restore.add_argument('--latest', action='store_true', help="Restore the newest snapshot")
+    restore.add_argument('--in-place', action='store_true', help="Overwrite the live files instead of writing to restored/")
+    args = parser.parse_args()
+
+    store = bot.backups
+    try:
+        if args.command == 'snapshot':
+            result = store.snapshot()
+            if result is None:
+                print("Nothing changed since the last snapshot.")
+            else:
+                print(f"Snapshot {result['id']}: {bot.format_bytes(result['bytes_written'])} of new chunks "
+                      f"in {result['seconds'] * 1000:.0f} ms.")
+
+        elif args.command == 'list':
+            for snapshot_id in store.list_snapshots():
+                files = store.load_manifest(snapshot_id)['files']
+                print(f"{snapshot_id}  " + ", ".join(f"{name} ({bot.format_bytes(entry['size'])})"
+                                                    for name, entry in files.items()))
+
+        elif args.command == 'verify':
+            snapshot_ids = store.list_snapshots() if args.all else [store.resolve(snapshot_id=args.snapshot)]
+            damaged = 0
+            for snapshot_id in snapshot_ids:
+                problems = store.verify(snapshot_id)
+                damaged += bool(problems)
+                print(f"{snapshot_id}  {'ok' if not problems else 'DAMAGED'}")
+                for problem in problems:
+                    print(f"  {problem}")
+            sys.exit(1 if damaged else 0)
+
+        else:
+            if not (args.snapshot or args.at or args.latest):
+                parser.error("restore needs a snapshot id, --at or --latest")
+            snapshot_id = store.resolve(at=args.at, snapshot_id=args.snapshot)
+            target = '.' if args.in_place else os.path.join('restored', snapshot_id)
+            restored = store.restore(snapshot_id, target)
+            print(f"Restored {', '.join(restored)} from {snapshot_id} into {os.path.abspath(target)}.")
+
+    except bot.BackupError as e:
+        sys.exit(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
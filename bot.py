@@ -1,4 +1,9 @@
 import os
+import sys
+import io
+import gzip
+import zlib
+import csv
 import json
 import string
 import random
@@ -6,14 +11,37 @@ import uuid
 from datetime import datetime, timedelta
 import math
 import asyncio
+import heapq
+import functools
+import bisect
+import itertools
+from collections import namedtuple, OrderedDict, Counter, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+import contextvars
+from types import MappingProxyType
+import time
+import hmac
+import hashlib
+import base64
+import atexit
+import gc
+import threading
+import tracemalloc
+import mmap
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ui import Button, View, Select, TextInput, Modal
 from discord import SelectOption, ui
 from discord import app_commands
 from discord.app_commands import Choice
 import os
+import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
 
 # --- Admin Configuration ---
@@ -28,6 +56,15 @@ def is_admin():
 # --- Load Environment Variables ---
 load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+KEY_SIGNING_SECRET = os.getenv('KEY_SIGNING_SECRET')
+VALIDATION_HOST = os.getenv('VALIDATION_HOST', '127.0.0.1')
+VALIDATION_PORT = os.getenv('VALIDATION_PORT')  # Leave unset to keep the validation service off
+TRACE_FILE = os.getenv('TRACE_FILE')  # Set to record anonymized interaction traces for replay.py
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')  # Set to expose /debug/profile on the validation port
+EVENT_SINKS = os.getenv('EVENT_SINKS', '')  # e.g. "file:exports/events.jsonl,http://127.0.0.1:9000/events,unix:/run/orders.sock"
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')  # e.g. "resellers.interactions=0.1,discord.gateway=0.5"
 
 # Initialize bot with command prefix and intents
 intents = discord.Intents.default()
@@ -35,14 +72,137 @@ intents.members = True
 intents.message_content = True
 intents.guilds = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+class PartitionedCommandTree(app_commands.CommandTree):
+    """Runs each slash command and autocomplete inside its guild's partition (see Guild Partitions)."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        await enter_partition(interaction.guild_id)
+        return True
+
+class PartitionedView(View):
+    """Base for every view, so component callbacks run inside their guild's partition."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        await enter_partition(interaction.guild_id)
+        return True
+
+class PartitionedModal(ui.Modal):
+    """Base for every modal, so submissions run inside their guild's partition."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        await enter_partition(interaction.guild_id)
+        return True
+
+bot = commands.Bot(command_prefix='!', intents=intents, tree_cls=PartitionedCommandTree)
+
+# --- Logging ---
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+log = logging.getLogger('resellers')
+order_log = logging.getLogger('resellers.orders')
+ticket_log = logging.getLogger('resellers.tickets')
+catalog_log = logging.getLogger('resellers.catalog')
+interaction_log = logging.getLogger('resellers.interactions')
+validation_log = logging.getLogger('resellers.validation')
+event_log = logging.getLogger('resellers.events')
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, the record's context fields and any traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        event.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            event['exc'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep only a share of INFO and DEBUG records per logger; warnings and errors always pass.
+
+    Rates are matched on the longest logger name prefix, so "resellers.interactions=0.1"
+    thins out per-interaction timings during an incident without touching purchase logs.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return self.rates.get('', 1.0)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate(record.name)
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue records untouched, so message and traceback formatting happen on the listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def parse_log_sampling(spec: str) -> dict:
+    """Parse "logger=rate,logger=rate" into a dict, skipping malformed entries."""
+    rates = {}
+    for part in spec.split(','):
+        name, _, rate = part.strip().partition('=')
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+def setup_logging(log_file: str = LOG_FILE):
+    """Route every logger, discord.py's included, through a queue drained by a background thread.
+
+    The event loop only pays for a sampling check and a queue put; JSON encoding and
+    writing the rotated file and the console happen on the listener thread.
+    """
+    file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(name)s: %(message)s'))
+    
+    listener = QueueListener(queue.SimpleQueue(), file_handler, console_handler, respect_handler_level=True)
+    queue_handler = DeferredQueueHandler(listener.queue)
+    queue_handler.addFilter(SamplingFilter(parse_log_sampling(LOG_SAMPLING)))
+    
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL.upper())
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
+def log_fields(interaction: discord.Interaction = None, **fields) -> dict:
+    """`extra=` for a log call: the interaction's id, user and command plus any other context."""
+    if interaction is not None:
+        fields.setdefault('interaction_id', interaction.id)
+        fields.setdefault('user_id', interaction.user.id)
+        command = getattr(interaction, 'command', None)
+        if command is not None:
+            fields.setdefault('command', command.qualified_name)
+    return {'fields': fields}
+
 
 # --- Database Functions ---
 def load_database():
     """Load database from file or create it if it doesn't exist."""
     try:
         with open('database.json', 'r') as f:
-            return json.load(f)
+            data = json.load(f)
+        # Older files predate some sections
+        for section in ('users', 'products', 'tickets'):
+            data.setdefault(section, {})
+        return data
     except FileNotFoundError:
         default_data = {
     'users': {}, 
@@ -55,10 +215,32 @@ def load_database():
             json.dump(default_data, f, indent=4)
         return default_data
 
-def save_database(data):
-    """Save database to file."""
-    with open('database.json', 'w') as f:
+def write_json_atomic(path: str, data):
+    """Write JSON next to `path` and rename it over the old file.
+
+    A crash mid-write leaves the previous file intact instead of a truncated one.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
         json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def save_database(data):
+    """Save database to file.
+
+    `database` saves the current guild's partition (see Guild Partitions); any other
+    dict is written to database.json. Credit ledger entries and events recorded since
+    the last save go to their journals once the data they describe is on disk.
+    """
+    if isinstance(data, PartitionView):
+        partitions.current().save()
+    else:
+        write_json_atomic('database.json', data)
+    credit_ledger.flush()
+    if outbox is not None:
+        outbox.flush()
 
 # --- Helper Functions ---
 def get_user_data(user_id):
@@ -82,23 +264,1018 @@ def get_user_data(user_id):
         user_data['total_spent'] = 0
     return user_data
 
+# --- Admission Control ---
+# group -> (concurrent handlers, callers allowed to wait). Groups not listed use 'default'.
+ADMISSION_LIMITS = {
+    'purchase': (4, 20),
+    'menus': (16, 64),
+    'tickets': (2, 10),
+    'history': (8, 32),
+    'default': (32, 128)
+}
+ADMISSION_WAIT_SECONDS = 2.0  # Longest a queued caller waits, leaving time to reply within Discord's 3 seconds
+BUSY_MESSAGE = "⏳ The bot is busy right now, please try again in a moment."
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded, prioritised wait queue for one group of handlers.
+
+    Callers beyond the limit wait in priority order (lower runs first) until the
+    queue is full; anyone arriving after that is shed straight away. A caller
+    still queued after ADMISSION_WAIT_SECONDS is shed as well.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = []  # (priority, sequence, future)
+        self._sequence = itertools.count()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.peak_waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int = 1) -> bool:
+        """Take a slot, waiting if needed. Returns False if the caller was shed."""
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if self.waiting >= self.max_queue:
+            self.shed += 1
+            return False
+        
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(self._waiters, entry)
+        self.queued += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(future, ADMISSION_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            # wait_for cancelled the future, so release() can no longer hand it a slot
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self.shed += 1
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us just as we were cancelled, so pass it on
+                self.release()
+            raise
+        self.admitted += 1
+        return True
+
+    def release(self):
+        """Hand the slot to the highest priority waiter, or free it."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+admission_limiters = {}
+
+def get_admission_limiter(group: str) -> AdmissionLimiter:
+    if group not in admission_limiters:
+        limit, max_queue = ADMISSION_LIMITS.get(group, ADMISSION_LIMITS['default'])
+        admission_limiters[group] = AdmissionLimiter(group, limit, max_queue)
+    return admission_limiters[group]
+
+def is_staff(user) -> bool:
+    """Admins bypass admission control entirely."""
+    permissions = getattr(user, 'guild_permissions', None)
+    return user.id in ADMIN_USER_IDS or bool(permissions and permissions.administrator)
+
+def admission_controlled(group: str, priority: int = 1):
+    """Run a command or component callback under its group's admission limiter.
+
+    Works for slash commands and for View/Modal callbacks alike, since the
+    interaction is always the last positional argument discord.py passes.
+    Shed callers get a fast "busy" reply before any real work happens.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            interaction = args[-1]
+            if is_staff(interaction.user):
+                return await func(*args, **kwargs)
+            
+            limiter = get_admission_limiter(group)
+            with span('admission'):
+                admitted = await limiter.acquire(priority)
+            if not admitted:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(BUSY_MESSAGE, ephemeral=True)
+                return
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
+
+# --- Credit Ledger ---
+CREDIT_LEDGER_FILE = 'credit_ledger.jsonl'
+LEDGER_CHECKPOINT_INTERVAL = 50  # Journal entries per user between balance checkpoints
+LEDGER_PAGE_SIZE = 10
+
+# The account on the other side of the user's account for each kind of journal entry
+LEDGER_ACCOUNTS = {
+    'opening': 'treasury',
+    'grant': 'treasury',
+    'set': 'treasury',
+    'purchase': 'sales',
+    'refund': 'sales'
+}
+
+class CreditLedger:
+    """Append-only double-entry journal of every change to a user's credits.
+
+    Each entry moves an amount between two accounts (user:<id>, treasury or sales)
+    and records the user's resulting balance. Every LEDGER_CHECKPOINT_INTERVAL entries
+    a checkpoint line pins the user's balance, so it can be verified from the last
+    checkpoint plus a short tail. The byte offset of every line is indexed per user,
+    so history pages are read with seeks instead of scanning the journal.
+
+    Like outbox events, entries are held in memory until the balance they record
+    is saved and only then appended, so a crash can't leave the journal ahead of
+    database.json.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = {}           # user_id -> byte offsets of that user's lines, oldest first
+        self.last_checkpoint = {}   # user_id -> position in offsets of their latest checkpoint
+        self.next_seq = 1
+        self.size = 0               # Journal length in bytes, counting entries not yet flushed
+        self.pending = {}           # offset -> entry, for entries not yet flushed
+
+    def load(self):
+        """Index the journal's line offsets in one streaming pass."""
+        self.offsets = {}
+        self.last_checkpoint = {}
+        self.next_seq = 1
+        self.size = 0
+        self.pending = {}
+        try:
+            with open(self.path, 'rb') as f:
+                offset = f.tell()
+                for line in iter(f.readline, b''):
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._index(entry, offset)
+                        self.next_seq = entry['seq'] + 1
+                    offset = f.tell()
+                self.size = offset
+        except FileNotFoundError:
+            pass
+
+    def _index(self, entry: dict, offset: int):
+        user_offsets = self.offsets.setdefault(entry['user_id'], [])
+        if entry['type'] == 'checkpoint':
+            self.last_checkpoint[entry['user_id']] = len(user_offsets)
+        user_offsets.append(offset)
+
+    def _append(self, entry: dict):
+        entry['seq'] = self.next_seq
+        self.next_seq += 1
+        self.pending[self.size] = entry
+        self._index(entry, self.size)
+        self.size += len(json.dumps(entry).encode()) + 1
+
+    def flush(self):
+        """Append pending entries to the journal. Called right after the database is saved."""
+        if not self.pending:
+            return
+        with open(self.path, 'ab') as f:
+            f.writelines(json.dumps(entry).encode() + b'\n' for entry in self.pending.values())
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = {}
+
+    def _read(self, offset: int) -> dict:
+        if offset in self.pending:
+            return dict(self.pending[offset])
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def record(self, user_id, kind: str, delta: int, balance: int, reference=None, actor=None):
+        """Journal a credit change that left the user with `balance`."""
+        user_id = str(user_id)
+        if user_id not in self.offsets and balance - delta != 0:
+            # Users who had credits before the ledger existed start from an opening entry
+            self.record(user_id, 'opening', balance - delta, balance - delta)
+        
+        account, counter_account = f"user:{user_id}", LEDGER_ACCOUNTS[kind]
+        self._append({
+            'ts': datetime.utcnow().isoformat(),
+            'type': kind,
+            'user_id': user_id,
+            'from': counter_account if delta >= 0 else account,
+            'to': account if delta >= 0 else counter_account,
+            'amount': abs(delta),
+            'delta': delta,
+            'balance': balance,
+            'ref': reference,
+            'actor': str(actor) if actor else None
+        })
+        
+        since_checkpoint = len(self.offsets[user_id]) - 1 - self.last_checkpoint.get(user_id, -1)
+        if since_checkpoint >= LEDGER_CHECKPOINT_INTERVAL:
+            self._append({
+                'ts': datetime.utcnow().isoformat(),
+                'type': 'checkpoint',
+                'user_id': user_id,
+                'balance': balance
+            })
+
+    def history(self, user_id, page: int = 1, page_size: int = LEDGER_PAGE_SIZE):
+        """One page of a user's journal, newest first. Returns (entries, page_count)."""
+        user_offsets = self.offsets.get(str(user_id), [])
+        page_count = max(1, math.ceil(len(user_offsets) / page_size))
+        end = len(user_offsets) - (page - 1) * page_size
+        start = max(0, end - page_size)
+        return [self._read(offset) for offset in reversed(user_offsets[start:max(0, end)])], page_count
+
+    def reconstruct_balance(self, user_id):
+        """Rebuild a balance from the last checkpoint plus the entries after it, or None without history."""
+        user_id = str(user_id)
+        user_offsets = self.offsets.get(user_id)
+        if not user_offsets:
+            return None
+        start = self.last_checkpoint.get(user_id)
+        balance = self._read(user_offsets[start])['balance'] if start is not None else 0
+        for offset in user_offsets[(start + 1) if start is not None else 0:]:
+            entry = self._read(offset)
+            if entry['type'] != 'checkpoint':
+                balance += entry['delta']
+        return balance
+
+def adjust_credits(user_id, user_data: dict, delta: int, kind: str, reference=None, actor=None):
+    """Change a user's credits and journal the change in the credit ledger."""
+    user_data['credits'] += delta
+    credit_ledger.record(user_id, kind, delta, user_data['credits'], reference=reference, actor=actor)
+    publish_event('credit.changed', user_id=str(user_id), kind=kind, delta=delta, balance=user_data['credits'],
+                  ref=reference, actor=str(actor) if actor else None)
+
+# --- Bulk Credit Operations ---
+BULK_CSV_COLUMNS = ('user_id', 'credit_delta', 'discount')
+
+def parse_bulk_csv(text: str):
+    """Parse and validate a bulk credits CSV against the current database.
+
+    Columns are user_id, credit_delta and discount; either of the last two may be
+    left empty to leave that value alone. Returns (changes, errors) where each change
+    is (user_id, credit_delta, old_credits, old_discount, new_discount). Nothing is
+    applied if errors is non-empty.
+    """
+    changes = []
+    errors = []
+    seen = set()
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [column for column in BULK_CSV_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        return [], [f"Missing column(s): {', '.join(missing)}"]
+    
+    for line_number, row in enumerate(reader, start=2):
+        user_id = (row['user_id'] or '').strip()
+        delta_text = (row['credit_delta'] or '').strip()
+        discount_text = (row['discount'] or '').strip()
+        
+        if not user_id.isdigit():
+            errors.append(f"Line {line_number}: invalid user_id {user_id!r}")
+            continue
+        if user_id in seen:
+            errors.append(f"Line {line_number}: user {user_id} appears more than once")
+            continue
+        seen.add(user_id)
+        
+        try:
+            credit_delta = int(delta_text) if delta_text else 0
+            new_discount = int(discount_text) if discount_text else None
+        except ValueError:
+            errors.append(f"Line {line_number}: credit_delta and discount must be whole numbers")
+            continue
+        if new_discount is not None and not 0 <= new_discount <= 100:
+            errors.append(f"Line {line_number}: discount must be between 0 and 100")
+            continue
+        
+        existing = database['users'].get(user_id, {})
+        old_credits = existing.get('credits', 0)
+        old_discount = existing.get('discount', 0)
+        if old_credits + credit_delta < 0:
+            errors.append(f"Line {line_number}: user {user_id} would end up with {old_credits + credit_delta} credits")
+            continue
+        changes.append((user_id, credit_delta, old_credits, old_discount, new_discount))
+    
+    return changes, errors
+
+def format_bulk_diff(changes: list) -> str:
+    """Render planned bulk changes as a readable diff, one user per line."""
+    lines = []
+    for user_id, credit_delta, old_credits, old_discount, new_discount in changes:
+        parts = []
+        if credit_delta:
+            parts.append(f"credits {old_credits} -> {old_credits + credit_delta} ({credit_delta:+})")
+        if new_discount is not None and new_discount != old_discount:
+            parts.append(f"discount {old_discount}% -> {new_discount}%")
+        lines.append(f"{user_id}: {', '.join(parts) if parts else 'no change'}")
+    return "\n".join(lines) + "\n"
+
+def apply_bulk_changes(changes: list, actor=None):
+    """Apply validated bulk changes in memory, journalling credits. The caller saves once."""
+    for user_id, credit_delta, _, _, new_discount in changes:
+        user_data = get_user_data(user_id)
+        if credit_delta:
+            adjust_credits(user_id, user_data, credit_delta, 'grant', reference='bulk', actor=actor)
+        if new_discount is not None:
+            user_data['discount'] = new_discount
+
+# --- Idempotency ---
+IDEMPOTENCY_TTL_SECONDS = 60     # How long a duplicate submission gets the original result
+IDEMPOTENCY_MAX_ENTRIES = 10000  # Oldest entries are evicted beyond this
+
+class IdempotencyCache:
+    """Bounded, TTL-evicting record of recently handled purchase submissions.
+
+    The first submission for a key claims it; duplicates that arrive while it's still
+    running, or within the TTL after it finished, get the original result instead
+    of running the purchase again.
+    """
+
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, result or None while pending)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def claim(self, key):
+        """Returns (True, None) for a first submission, or (False, result) for a duplicate.
+
+        A duplicate's result is None while the original is still being processed.
+        """
+        self._evict()
+        if key in self._entries:
+            return False, self._entries[key][1]
+        self._entries[key] = (time.monotonic() + self.ttl, None)
+        return True, None
+
+    def complete(self, key, result: str):
+        """Remember what the original submission answered, for the rest of the TTL."""
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+
+    def discard(self, key):
+        """Forget a submission that failed before charging anything, so a retry can run."""
+        self._entries.pop(key, None)
+
+purchase_idempotency = IdempotencyCache()
+
+def purchase_idempotency_key(interaction: discord.Interaction, *selection, source=None):
+    """Identify a purchase submission by what it was submitted from, who sent it and what they picked.
+
+    `source` should be unique to one submission form, like a modal's custom_id, which
+    a resubmit repeats but every newly opened modal changes. Without it the menu's
+    message is used, except for persistent panels that every purchase goes through,
+    where only the interaction itself tells submissions apart.
+    """
+    if source is None:
+        message = interaction.message
+        if message is None or str(message.id) in database.get('panels', {}):
+            source = interaction.id
+        else:
+            source = message.id
+    return (source, interaction.user.id) + selection
+
+async def send_duplicate_purchase_response(interaction: discord.Interaction, result):
+    """Answer a duplicate submission with the original outcome without re-running anything."""
+    message = result or "⏳ Your purchase is already being processed."
+    if interaction.response.is_done():
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
+
+# --- Quantity Limits ---
+DEFAULT_MAX_QUANTITY = 10  # Keys per purchase for members without a configured role limit
+MAX_BULK_QUANTITY = 1000   # Hard ceiling for any role limit
+
+def get_quantity_limit(member) -> int:
+    """Largest quantity a member may buy at once, taken from their best-configured role."""
+    limits = database.get('quantity_limits', {})
+    role_limits = [limits[str(role.id)] for role in getattr(member, 'roles', []) if str(role.id) in limits]
+    return max([DEFAULT_MAX_QUANTITY] + role_limits)
+
+# --- Generated License Keys ---
+KEY_MODES = ("stocked", "generated")
+KEY_SIGNATURE_BYTES = 10  # Truncated HMAC-SHA256 tag appended to every generated key
+
+def is_generated_product(product_id: str) -> bool:
+    """Whether a product mints signed keys on demand instead of selling stocked ones."""
+    return database['products'].get(product_id, {}).get('key_mode', 'stocked') == 'generated'
+
+def _key_signature(payload: bytes) -> bytes:
+    return hmac.new(KEY_SIGNING_SECRET.encode(), payload, hashlib.sha256).digest()[:KEY_SIGNATURE_BYTES]
+
+def sign_license_key(product_id: str, duration_days: int, serial: int) -> str:
+    """Build a key that encodes product, duration and serial, signed with KEY_SIGNING_SECRET."""
+    payload = f"{product_id}:{duration_days}:{serial}".encode()
+    encoded = base64.b32encode(payload + _key_signature(payload)).decode().rstrip('=')
+    return '-'.join(encoded[i:i + 5] for i in range(0, len(encoded), 5))
+
+def verify_license_key(key: str):
+    """Check a generated key's signature.
+
+    Returns (product_id, duration_days, serial) for a genuine key, or None.
+    """
+    if not KEY_SIGNING_SECRET:
+        return None
+    encoded = key.strip().replace('-', '').upper()
+    try:
+        raw = base64.b32decode(encoded + '=' * (-len(encoded) % 8))
+    except (ValueError, TypeError):
+        return None
+    payload, signature = raw[:-KEY_SIGNATURE_BYTES], raw[-KEY_SIGNATURE_BYTES:]
+    if len(payload) == 0 or not hmac.compare_digest(signature, _key_signature(payload)):
+        return None
+    try:
+        product_id, duration_days, serial = payload.decode().split(':')
+        return product_id, int(duration_days), int(serial)
+    except ValueError:
+        return None
+
+def generate_license_keys(product_id: str, count: int) -> list:
+    """Mint a batch of signed keys, advancing the product's persisted serial counter."""
+    product = database['products'][product_id]
+    first_serial = product.get('next_serial', 1)
+    product['next_serial'] = first_serial + count
+    duration_days = catalog.products[product_id].duration_days
+    return [sign_license_key(product_id, duration_days, serial) for serial in range(first_serial, first_serial + count)]
+
+# --- Key Store ---
+KEY_STORES = ("json", "mmap")
+KEY_STORE_DIR = 'inventory'
+KEY_STORE_COMPACT_BYTES = 4 * 1024 * 1024  # Sold bytes at the front of a key file before it is rewritten
+
+class MappedKeyFile:
+    """One product's unsold keys in an append-only file, one UTF-8 key per line.
+
+    Only three cursors stay in memory: `head` is the offset of the next key to
+    sell, `tail` the end of the last key added and `count` the keys in between.
+    They live in the product's `key_file` entry, so database.json stores a few
+    numbers per product instead of every key, and keys are read through an mmap
+    only when they are sold. Once the sold front of the file passes
+    KEY_STORE_COMPACT_BYTES and half the file, the rest is copied into a new
+    generation of the file; older generations are deleted the next time the
+    product's file is opened, after the database has recorded the switch.
+    """
+
+    def __init__(self, directory: str, product_id: str, meta: dict):
+        self.directory = directory
+        self.product_id = product_id
+        self.meta = meta  # The product's key_file entry: {'file', 'head', 'tail', 'count'}
+        self.map = None
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a+b')
+        # Keys appended after the last save were never recorded, so they are not stock yet
+        if self.file.seek(0, os.SEEK_END) > meta['tail']:
+            self.file.truncate(meta['tail'])
+        for name in os.listdir(directory):
+            if name.startswith(f"{product_id}.") and name != meta['file']:
+                os.remove(os.path.join(directory, name))
+
+    @classmethod
+    def create(cls, directory: str, product_id: str, keys: list, generation: int = 1) -> dict:
+        """Write `keys` into a new file generation. Returns the key_file entry pointing at it."""
+        name = f"{product_id}.{generation}.keys"
+        content = "".join(f"{key}\n" for key in keys).encode('utf-8')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        return {'file': name, 'head': 0, 'tail': len(content), 'count': len(keys)}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, self.meta['file'])
+
+    def _mapping(self) -> mmap.mmap:
+        if self.map is None or len(self.map) < self.meta['tail']:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def append(self, keys: list):
+        content = "".join(f"{key}\n" for key in keys).encode('utf-8')
+        self.file.seek(self.meta['tail'])
+        self.file.write(content)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.meta['tail'] += len(content)
+        self.meta['count'] += len(keys)
+
+    def _read(self, count: int) -> tuple:
+        """The next `count` unsold keys and the offset after them, without consuming them."""
+        if not count or not self.meta['count']:
+            return [], self.meta['head']
+        mapping = self._mapping()
+        keys, position = [], self.meta['head']
+        while len(keys) < count and position < self.meta['tail']:
+            end = mapping.find(b"\n", position, self.meta['tail'])
+            if end < 0:
+                break
+            keys.append(mapping[position:end].decode('utf-8'))
+            position = end + 1
+        return keys, position
+
+    def peek(self, count: int = None) -> list:
+        return self._read(self.meta['count'] if count is None else count)[0]
+
+    def take(self, count: int) -> list:
+        keys, self.meta['head'] = self._read(count)
+        self.meta['count'] -= len(keys)
+        if self.meta['head'] >= KEY_STORE_COMPACT_BYTES and self.meta['head'] * 2 >= self.meta['tail']:
+            self.rewrite(self.peek())
+        return keys
+
+    def rewrite(self, keys: list):
+        """Replace the unsold keys with `keys` in a new file generation."""
+        generation = int(self.meta['file'].split('.')[-2]) + 1
+        self.meta.update(self.create(self.directory, self.product_id, keys, generation))
+        self.close()
+        self.file = open(self.path, 'a+b')
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+def uses_key_file(product_id: str) -> bool:
+    """Whether a product's stock lives in a memory-mapped key file instead of database.json."""
+    return 'key_file' in database['products'].get(product_id, {})
+
+def stock_level(product_id: str) -> int:
+    """Unsold keys of a stocked product, without reading them."""
+    product = database['products'].get(product_id, {})
+    if 'key_file' in product:
+        return product['key_file']['count']
+    return len(product.get('keys', []))
+
+def stocked_keys(product_id: str) -> list:
+    """Every unsold key of a product, e.g. for integrity checks."""
+    if uses_key_file(product_id):
+        return partitions.current().key_file(product_id).peek()
+    return database['products'].get(product_id, {}).get('keys', [])
+
+def add_stock_keys(product_id: str, keys: list):
+    product = database['products'].setdefault(product_id, {})
+    if 'key_file' in product:
+        partitions.current().key_file(product_id).append(keys)
+    else:
+        product.setdefault('keys', []).extend(keys)
+
+def set_key_store(product_id: str, store: str):
+    """Move a product's unsold keys between database.json and a key file."""
+    product = database['products'][product_id]
+    partition = partitions.current()
+    if store == 'mmap' and 'key_file' not in product:
+        product['key_file'] = MappedKeyFile.create(partition.key_store_dir, product_id, product.pop('keys', []))
+    elif store == 'json' and 'key_file' in product:
+        key_file = partition.key_file(product_id)
+        product['keys'] = key_file.peek()
+        key_file.close()
+        del partition.key_files[product_id]
+        del product['key_file']
+
+# --- Stock Reservations ---
+RESERVATION_TTL_SECONDS = 120  # How long a hold survives between picking a variant and paying (also the quantity modal's timeout)
+
+class StockReservations:
+    """Short-lived holds on product stock while a user walks through the purchase flow.
+
+    Holds are counts against a product's key list rather than specific keys, so the
+    keys themselves stay in the database until the hold is converted into a sale.
+    Each hold is tagged with the flow that placed it ('purchase' or 'cart'), so one
+    flow never replaces or spends another's hold. Expired holds are swept lazily
+    from a heap ordered by expiry time.
+    """
+
+    def __init__(self, ttl: int = RESERVATION_TTL_SECONDS):
+        self.ttl = ttl
+        self._holds = {}        # hold_id -> {'product_id', 'user_id', 'source', 'quantity', 'ttl', 'expires_at'}
+        self._expiry_heap = []  # (expires_at, hold_id)
+        self._reserved = {}     # product_id -> total quantity currently held
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, hold_id = heapq.heappop(self._expiry_heap)
+            hold = self._holds.get(hold_id)
+            if hold and hold['expires_at'] == expires_at:
+                self.release(hold_id)
+
+    def reserved(self, product_id: str, exclude_user=None, source: str = None) -> int:
+        """Number of keys held for a product, optionally ignoring one user's own holds.
+
+        With `source`, only that user's holds from the given flow are ignored.
+        """
+        self._expire()
+        total = self._reserved.get(product_id, 0)
+        if exclude_user is not None:
+            total -= sum(
+                hold['quantity'] for hold in self._holds.values()
+                if hold['product_id'] == product_id and hold['user_id'] == str(exclude_user)
+                and (source is None or hold['source'] == source)
+            )
+        return total
+
+    def available(self, product_id: str, user_id=None, source: str = None) -> int:
+        """Keys in stock that are not held by somebody else (or by the user's other flows, given `source`)."""
+        if is_generated_product(product_id):
+            # Generated products never run out, but can't be sold without a signing secret
+            return math.inf if KEY_SIGNING_SECRET else 0
+        return max(0, stock_level(product_id) - self.reserved(product_id, exclude_user=user_id, source=source))
+
+    def reserve(self, user_id, product_id: str, quantity: int, source: str = 'purchase', ttl: float = None):
+        """Place a hold on `quantity` keys for `ttl` seconds (the store's TTL by default).
+
+        Returns a hold id, or None if there isn't enough stock.
+        """
+        # A user re-picking a variant replaces their previous hold on it from the same flow
+        for hold_id, hold in list(self._holds.items()):
+            if hold['user_id'] == str(user_id) and hold['product_id'] == product_id and hold['source'] == source:
+                self.release(hold_id)
+
+        if self.available(product_id, user_id, source) < quantity:
+            return None
+
+        hold_id = uuid.uuid4().hex
+        ttl = ttl or self.ttl
+        expires_at = time.monotonic() + ttl
+        self._holds[hold_id] = {
+            'product_id': product_id,
+            'user_id': str(user_id),
+            'source': source,
+            'quantity': quantity,
+            'ttl': ttl,
+            'expires_at': expires_at
+        }
+        self._reserved[product_id] = self._reserved.get(product_id, 0) + quantity
+        heapq.heappush(self._expiry_heap, (expires_at, hold_id))
+        return hold_id
+
+    def resize(self, hold_id, quantity: int) -> bool:
+        """Change a live hold to `quantity` keys and restart its TTL.
+
+        Returns False, leaving the hold as it was, if it has expired or there
+        isn't enough stock for the new quantity.
+        """
+        hold = self.get(hold_id)
+        if hold is None:
+            return False
+        if self.available(hold['product_id'], hold['user_id'], hold['source']) < quantity:
+            return False
+        product_id = hold['product_id']
+        self._reserved[product_id] = self._reserved.get(product_id, 0) + quantity - hold['quantity']
+        hold['quantity'] = quantity
+        return self.refresh(hold_id)
+
+    def refresh(self, hold_id) -> bool:
+        """Restart a live hold's TTL. Returns False if it was released or has expired."""
+        hold = self.get(hold_id)
+        if hold is None:
+            return False
+        hold['expires_at'] = time.monotonic() + hold['ttl']
+        heapq.heappush(self._expiry_heap, (hold['expires_at'], hold_id))
+        return True
+
+    def get(self, hold_id):
+        """Return a live hold, or None if it was released or has expired."""
+        self._expire()
+        return self._holds.get(hold_id)
+
+    def release(self, hold_id):
+        """Drop a hold and return its keys to the available pool."""
+        hold = self._holds.pop(hold_id, None)
+        if hold:
+            remaining = self._reserved.get(hold['product_id'], 0) - hold['quantity']
+            if remaining > 0:
+                self._reserved[hold['product_id']] = remaining
+            else:
+                self._reserved.pop(hold['product_id'], None)
+        return hold
+
+    def commit(self, hold_id):
+        """Convert a hold into a sale. The caller pops the keys right after this."""
+        return self.release(hold_id)
+
+# --- Interaction Trace Recorder ---
+# Option values that may hold something personal are kept out of traces
+TRACE_REDACTED_OPTIONS = {'key', 'reason', 'order_id', 'file'}
+TRACE_USER_OPTION_TYPES = {discord.AppCommandOptionType.user.value, discord.AppCommandOptionType.mentionable.value}
+TRACE_USER_OPTIONS = {'customer'}  # String options that carry a user id
+
+class InteractionRecorder:
+    """Append an anonymized line per interaction to a JSONL trace for replay.py.
+
+    Users are replaced by salted hashes that stay stable for the whole recording,
+    so a replay can tell one customer's clicks from another's without knowing who
+    they are. Free text (ticket reasons, keys, modal text) is redacted; numbers,
+    catalog ids, custom_ids and select values are kept because the replay needs them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.salt = os.urandom(16)
+        self.started = time.monotonic()
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+        self.write({'event': 'start', 'at': datetime.utcnow().isoformat()})
+
+    def pseudonym(self, user_id) -> str:
+        return hashlib.blake2b(str(user_id).encode(), key=self.salt, digest_size=6).hexdigest()
+
+    def write(self, event: dict):
+        self.file.write(json.dumps(event, separators=(',', ':')) + "\n")
+
+    @staticmethod
+    def _redact(value):
+        if isinstance(value, str) and not value.isdigit():
+            return '<redacted>'
+        return value
+
+    def _options(self, options: list, event: dict):
+        """Flatten slash command options, folding subcommand names into the command name."""
+        for option in options:
+            if option.get('type') in (discord.AppCommandOptionType.subcommand.value,
+                                      discord.AppCommandOptionType.subcommand_group.value):
+                event['command'] += f" {option['name']}"
+                self._options(option.get('options', []), event)
+                continue
+            value = option.get('value')
+            if option.get('type') in TRACE_USER_OPTION_TYPES or option['name'] in TRACE_USER_OPTIONS:
+                value = self.pseudonym(value)
+            elif option['name'] in TRACE_REDACTED_OPTIONS:
+                value = self._redact(value)
+            event['options'][option['name']] = value
+            if option.get('focused'):
+                event['focused'] = option['name']
+
+    @staticmethod
+    def _component_label(interaction: discord.Interaction, custom_id: str):
+        """The clicked button's label, which outlives the random custom_ids of temporary views."""
+        for row in (interaction.message.components if interaction.message else []):
+            for component in getattr(row, 'children', [row]):
+                if getattr(component, 'custom_id', None) == custom_id:
+                    return getattr(component, 'label', None)
+        return None
+
+    def record(self, interaction: discord.Interaction):
+        data = interaction.data or {}
+        event = {
+            't': round(time.monotonic() - self.started, 4),
+            'user': self.pseudonym(interaction.user.id),
+        }
+        if interaction.type in (discord.InteractionType.application_command, discord.InteractionType.autocomplete):
+            event['event'] = 'command' if interaction.type == discord.InteractionType.application_command else 'autocomplete'
+            event['command'] = data.get('name')
+            event['options'] = {}
+            self._options(data.get('options', []), event)
+        elif interaction.type == discord.InteractionType.component:
+            event['event'] = 'component'
+            event['custom_id'] = data.get('custom_id')
+            event['component_type'] = data.get('component_type')
+            event['label'] = self._component_label(interaction, data.get('custom_id'))
+            if 'values' in data:
+                event['values'] = data['values']
+        elif interaction.type == discord.InteractionType.modal_submit:
+            event['event'] = 'modal'
+            event['custom_id'] = data.get('custom_id')
+            event['fields'] = [
+                self._redact(component.get('value'))
+                for row in data.get('components', [])
+                for component in row.get('components', [])
+            ]
+        else:
+            return
+        self.write(event)
+
+    def close(self):
+        self.file.close()
+
+interaction_recorder = InteractionRecorder(TRACE_FILE) if TRACE_FILE else None
+
+@bot.listen('on_interaction')
+async def record_interaction(interaction: discord.Interaction):
+    """Add each interaction to the trace file when recording is switched on."""
+    if interaction_recorder is None:
+        return
+    try:
+        interaction_recorder.record(interaction)
+    except (OSError, ValueError, TypeError) as e:
+        interaction_log.warning("Error recording interaction: %s", e, extra=log_fields(interaction))
+
+# --- Slow Interaction Traces ---
+SLOW_TRACE_KEEP = 50              # Slowest traces kept for /slowtraces
+SLOW_TRACE_MIN_MS = 250           # Faster interactions are dropped as soon as they finish
+SLOW_TRACE_LIST = 15              # Traces listed per /slowtraces reply
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class InteractionTrace:
+    """The timed steps of one interaction's handler.
+
+    Spans are (name, start, end) tuples of perf_counter readings, appended as each
+    step finishes; nested spans simply overlap their parent.
+    """
+    __slots__ = ('name', 'interaction_id', 'user_id', 'guild_id', 'started_at', 'started', 'duration', 'spans')
+
+    def __init__(self, name: str, interaction: discord.Interaction):
+        self.name = name
+        self.interaction_id = interaction.id
+        self.user_id = interaction.user.id
+        self.guild_id = interaction.guild_id
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def slowest_span(self):
+        return max(self.spans, key=lambda s: s[2] - s[1], default=None)
+
+    def describe(self) -> str:
+        """One line per span, offset from the start of the interaction."""
+        lines = [f"{self.name} • {self.duration * 1000:.0f} ms • user {self.user_id} • "
+                 f"{self.started_at:%Y-%m-%d %H:%M:%S} UTC"]
+        for name, start, end in sorted(self.spans, key=lambda s: s[1]):
+            lines.append(f"  +{(start - self.started) * 1000:7.1f} ms  {(end - start) * 1000:7.1f} ms  {name}")
+        return "\n".join(lines)
+
+class Span:
+    """Context manager that adds one timed step to a trace."""
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: InteractionTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.spans.append((self.name, self.started, time.perf_counter()))
+        return False
+
+UNTRACED = nullcontext()
+
+def span(name: str):
+    """Time a step of the current interaction. Outside a traced handler this is a shared no-op."""
+    trace = current_trace.get()
+    return UNTRACED if trace is None else Span(trace, name)
+
+class SlowTraces:
+    """Keep the slowest traces seen so far in a bounded min-heap.
+
+    Finishing a fast interaction costs one comparison; a slow one replaces the
+    fastest trace kept once the heap is full.
+    """
+
+    def __init__(self, keep: int = SLOW_TRACE_KEEP, min_ms: float = SLOW_TRACE_MIN_MS):
+        self.keep = keep
+        self.min_seconds = min_ms / 1000
+        self.heap = []  # (duration, tiebreak, trace), fastest kept trace first
+        self.counter = itertools.count()
+        self.seen = 0
+
+    def offer(self, trace: InteractionTrace) -> bool:
+        """Keep `trace` if it is among the slowest. Returns whether it was kept."""
+        self.seen += 1
+        if trace.duration < self.min_seconds:
+            return False
+        entry = (trace.duration, next(self.counter), trace)
+        if len(self.heap) < self.keep:
+            heapq.heappush(self.heap, entry)
+        elif trace.duration > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+        else:
+            return False
+        return True
+
+    def slowest(self) -> list:
+        return [trace for _, _, trace in sorted(self.heap, reverse=True)]
+
+    def clear(self):
+        self.heap.clear()
+
+    @staticmethod
+    def chrome_trace(traces: list) -> dict:
+        """Chrome trace-event JSON (chrome://tracing, Perfetto) with one row per interaction."""
+        events = []
+        for tid, trace in enumerate(traces, start=1):
+            origin = trace.started_at.timestamp() * 1_000_000
+            events.append({'ph': 'M', 'pid': 1, 'tid': tid, 'name': 'thread_name',
+                           'args': {'name': f"{trace.name} {trace.interaction_id}"}})
+            events.append({'ph': 'X', 'pid': 1, 'tid': tid, 'name': trace.name, 'ts': origin,
+                           'dur': trace.duration * 1_000_000,
+                           'args': {'interaction_id': str(trace.interaction_id), 'user_id': str(trace.user_id),
+                                    'guild_id': str(trace.guild_id) if trace.guild_id else None}})
+            for name, start, end in trace.spans:
+                events.append({'ph': 'X', 'pid': 1, 'tid': tid, 'name': name,
+                               'ts': origin + (start - trace.started) * 1_000_000,
+                               'dur': (end - start) * 1_000_000})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+slow_traces = SlowTraces()
+
+def traced(name: str):
+    """Trace the wrapped handler's spans as one interaction, keeping the trace if it was slow.
+
+    The interaction must be the first positional argument. A traced handler called
+    from inside another one shows up as a span of the outer trace instead.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if current_trace.get() is not None:
+                with span(name):
+                    return await func(*args, **kwargs)
+            trace = InteractionTrace(name, args[0])
+            token = current_trace.set(trace)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                current_trace.reset(token)
+                trace.duration = time.perf_counter() - trace.started
+                if slow_traces.offer(trace):
+                    slowest = trace.slowest_span()
+                    interaction_log.info("Slow interaction traced", extra=log_fields(
+                        interaction_id=trace.interaction_id, user_id=trace.user_id, trace=name,
+                        duration_ms=round(trace.duration * 1000, 1),
+                        slowest_span=slowest[0] if slowest else None,
+                        slowest_span_ms=round((slowest[2] - slowest[1]) * 1000, 1) if slowest else None
+                    ))
+        return wrapper
+    return decorator
+
 # --- Bot Events ---
+@bot.listen('on_app_command_completion')
+async def log_command_completion(interaction: discord.Interaction, command):
+    """Time every slash command from Discord creating the interaction to the handler returning."""
+    elapsed = discord.utils.utcnow() - interaction.created_at
+    interaction_log.info("Command completed", extra=log_fields(
+        interaction, duration_ms=round(elapsed.total_seconds() * 1000, 1)
+    ))
+
+@bot.event
+async def setup_hook():
+    """Runs once before connecting, to start the bot's background services."""
+    if VALIDATION_PORT:
+        await start_validation_server(VALIDATION_HOST, int(VALIDATION_PORT))
+    for guild_id, problems in (await asyncio.to_thread(partitions.check_all)).items():
+        if problems:
+            log.warning("Integrity check found %d problem(s) in %s; run /fsck there or python fsck.py for details",
+                        len(problems), f"guild {guild_id}'s partition" if guild_id else "the default partition",
+                        extra=log_fields(guild_id=guild_id, problems=len(problems)))
+    rehydrate_persistent_views()
+    catalog_watcher.start()
+    bot.loop.create_task(ticket_close_worker())
+    ticket_idle_sweeper.start()
+    backup_scheduler.start()
+    start_event_exporters()
+
 @bot.event
 async def on_ready():
     """Runs when the bot has successfully connected to Discord."""
-    print(f'Logged in as {bot.user} (ID: {bot.user.id})')
-    print('------')
+    log.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
     try:
         synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        print(e)
+        log.info("Synced %d command(s)", len(synced))
+    except Exception:
+        log.exception("Failed to sync commands")
 
 # --- Ticket System ---
 class CreateTicketButton(ui.Button):
     def __init__(self):
         super().__init__(style=discord.ButtonStyle.primary, label="Create Ticket", emoji="🎫", custom_id="create_ticket")
     
+    @admission_controlled('tickets')
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.send_modal(TicketReasonModal())
 
@@ -106,31 +1283,27 @@ class TicketCloseButton(ui.Button):
     def __init__(self):
         super().__init__(style=discord.ButtonStyle.danger, label="Close Ticket", emoji="🔒", custom_id="close_ticket")
     
+    @admission_controlled('tickets', priority=0)
     async def callback(self, interaction: discord.Interaction):
         if not any(role.name == "Admin" for role in interaction.user.roles) and interaction.user.id not in ADMIN_USER_IDS:
             await interaction.response.send_message("Only staff can close tickets.", ephemeral=True)
             return
         
         await interaction.response.send_message("Closing this ticket in 5 seconds...")
-        await asyncio.sleep(5)
-        await interaction.channel.delete()
-        
-        # Remove from database
-        if str(interaction.channel.id) in database['tickets']:
-            del database['tickets'][str(interaction.channel.id)]
-            save_database(database)
+        # The close worker archives and deletes the channel, so this handler returns right away
+        schedule_ticket_close(interaction.channel.id, "Closed by staff", delay=5)
 
-class TicketPanelView(ui.View):
+class TicketPanelView(PartitionedView):
     def __init__(self):
         super().__init__(timeout=None)
         self.add_item(CreateTicketButton())
 
-class TicketView(ui.View):
+class TicketView(PartitionedView):
     def __init__(self):
         super().__init__(timeout=None)
         self.add_item(TicketCloseButton())
 
-class TicketReasonModal(ui.Modal, title="Create Support Ticket"):
+class TicketReasonModal(PartitionedModal, title="Create Support Ticket"):
     reason = TextInput(
         label="Reason for ticket",
         placeholder="Please describe the reason for creating this ticket...",
@@ -139,33 +1312,40 @@ class TicketReasonModal(ui.Modal, title="Create Support Ticket"):
         min_length=10
     )
     
+    @admission_controlled('tickets')
     async def on_submit(self, interaction: discord.Interaction):
         await create_ticket(interaction, self.reason.value)
 
+@traced('create_ticket')
 async def create_ticket(interaction: discord.Interaction, reason: str):
     """Helper function to create a ticket"""
     # Defer the response to prevent "application did not respond"
-    await interaction.response.defer(ephemeral=True)
+    with span('defer'):
+        await interaction.response.defer(ephemeral=True)
     
     # Check if ticket category exists, if not create it
     ticket_category = discord.utils.get(interaction.guild.categories, id=database.get('ticket_category'))
     if not ticket_category:
-        ticket_category = await interaction.guild.create_category("Tickets")
+        with span('create_category'):
+            ticket_category = await interaction.guild.create_category("Tickets")
         database['ticket_category'] = ticket_category.id
-        save_database(database)
+        with span('save_database'):
+            save_database(database)
     
     # Create ticket channel
     ticket_number = database.get('ticket_counter', 0) + 1
-    ticket_channel = await interaction.guild.create_text_channel(
-        f"ticket-{ticket_number}-{interaction.user.name}",
-        category=ticket_category,
-        topic=f"Ticket for {interaction.user.name} - {reason}",
-        reason=f"New ticket created by {interaction.user}"
-    )
+    with span('create_channel'):
+        ticket_channel = await interaction.guild.create_text_channel(
+            f"ticket-{ticket_number}-{interaction.user.name}",
+            category=ticket_category,
+            topic=f"Ticket for {interaction.user.name} - {reason}",
+            reason=f"New ticket created by {interaction.user}"
+        )
     
     # Set permissions
-    await ticket_channel.set_permissions(interaction.user, read_messages=True, send_messages=True)
-    await ticket_channel.set_permissions(interaction.guild.default_role, read_messages=False)
+    with span('set_permissions'):
+        await ticket_channel.set_permissions(interaction.user, read_messages=True, send_messages=True)
+        await ticket_channel.set_permissions(interaction.guild.default_role, read_messages=False)
     
     # Save ticket to database
     database['tickets'][str(ticket_channel.id)] = {
@@ -175,7 +1355,8 @@ async def create_ticket(interaction: discord.Interaction, reason: str):
         'reason': reason
     }
     database['ticket_counter'] = ticket_number
-    save_database(database)
+    with span('save_database'):
+        save_database(database)
     
     # Send welcome message
     embed = discord.Embed(
@@ -212,16 +1393,18 @@ async def create_ticket(interaction: discord.Interaction, reason: str):
     
     # Send the embeds with the view
     view = TicketView()
-    # Send the first message with the main embed and view
-    await ticket_channel.send(interaction.user.mention, embed=embed, view=view)
-    # Send the FAQ embed as a separate message
-    await ticket_channel.send(embed=faq_embed)
+    with span('welcome_messages'):
+        # Send the first message with the main embed and view
+        await ticket_channel.send(interaction.user.mention, embed=embed, view=view)
+        # Send the FAQ embed as a separate message
+        await ticket_channel.send(embed=faq_embed)
     
     # Send confirmation to user
-    await interaction.followup.send(
-        f"✅ Created your ticket: {ticket_channel.mention}",
-        ephemeral=True
-    )
+    with span('confirmation'):
+        await interaction.followup.send(
+            f"✅ Created your ticket: {ticket_channel.mention}",
+            ephemeral=True
+        )
 
 # --- Ticket Commands ---
 @bot.tree.command(name="ticketpanel", description="Create a ticket panel")
@@ -241,8 +1424,11 @@ async def ticketpanel(interaction: discord.Interaction):
     
     view = TicketPanelView()
     await interaction.response.send_message(embed=embed, view=view)
+    message = await interaction.original_response()
+    record_panel(message, 'ticket')
 
 @bot.tree.command(name="ticket", description="Create a support ticket")
+@admission_controlled('tickets')
 async def ticket(interaction: discord.Interaction, reason: str = "General Support"):
     """Create a new support ticket"""
     await create_ticket(interaction, reason)
@@ -269,23 +1455,178 @@ async def addtoticket(interaction: discord.Interaction, user: discord.Member):
     await interaction.channel.set_permissions(user, read_messages=True, send_messages=True)
     await interaction.response.send_message(f"✅ Added {user.mention} to this ticket.")
 
-# --- Admin Commands ---
-class AddKeyModal(ui.Modal, title="Add License Key"):
-    def __init__(self, product_id: str, product_name: str):
-        super().__init__()
-        self.product_id = product_id
-        self.product_name = product_name
-        self.key_input = TextInput(
-            label=f"Enter key(s) for {product_name}",
-            style=discord.TextStyle.paragraph,
-            required=True,
-            min_length=5,
-            placeholder="Paste one key per line to add multiple keys at once"
-        )
-        self.add_item(self.key_input)
+# --- Ticket Auto-Close ---
+DEFAULT_TICKET_IDLE_HOURS = 72  # Used until an admin runs /setticketidle
+TICKET_SWEEP_MINUTES = 10
+TICKET_CLOSE_BATCH = 5           # Channels closed per batch
+TICKET_CLOSE_BATCH_DELAY = 5     # Seconds between batches, to stay clear of rate limits
+TICKET_CLOSE_RETRIES = 3         # Failed closes are retried this many times before the ticket reopens
+TICKET_CLOSE_RETRY_DELAY = 60    # Seconds before the first retry, doubling after each failure
+TRANSCRIPT_DIR = 'transcripts'
+TRANSCRIPT_FLUSH_LINES = 200     # Messages buffered before each compressed write
+
+ticket_close_queue = asyncio.Queue()
+ticket_activity_changed = set()  # Partitions with activity timestamps not yet saved
+
+@bot.listen('on_message')
+async def track_ticket_activity(message: discord.Message):
+    """Remember when each ticket last saw a message, for the idle sweeper."""
+    await enter_partition(message.guild.id if message.guild else None)
+    ticket = database['tickets'].get(str(message.channel.id))
+    if ticket:
+        ticket['last_activity'] = message.created_at.replace(tzinfo=None).isoformat()
+        ticket_activity_changed.add(partitions.current())
+
+def schedule_ticket_close(channel_id: int, reason: str, delay: float = 0, attempt: int = 0):
+    """Queue a ticket for the close worker, optionally after a delay."""
+    ticket = database['tickets'].get(str(channel_id))
+    if ticket:
+        ticket['status'] = 'closing'
+    job = (partitions.current(), channel_id, reason, attempt)
+    if delay:
+        asyncio.get_running_loop().call_later(delay, ticket_close_queue.put_nowait, job)
+    else:
+        ticket_close_queue.put_nowait(job)
+
+async def archive_ticket_transcript(channel: discord.TextChannel, reason: str) -> str:
+    """Stream a channel's history into a gzipped JSONL transcript without blocking the loop."""
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    path = os.path.join(TRANSCRIPT_DIR, f"{channel.name}-{channel.id}.jsonl.gz")
+    transcript = await asyncio.to_thread(gzip.open, path, 'wt', encoding='utf-8')
+    try:
+        ticket = database['tickets'].get(str(channel.id), {})
+        lines = [json.dumps({'ticket': str(channel.id), 'name': channel.name, 'closed_reason': reason, **ticket}) + "\n"]
+        async for message in channel.history(limit=None, oldest_first=True):
+            lines.append(json.dumps({
+                'id': str(message.id),
+                'author_id': str(message.author.id),
+                'author': str(message.author),
+                'created_at': message.created_at.isoformat(),
+                'content': message.content,
+                'attachments': [attachment.url for attachment in message.attachments],
+                'embeds': [embed.to_dict() for embed in message.embeds]
+            }) + "\n")
+            if len(lines) >= TRANSCRIPT_FLUSH_LINES:
+                await asyncio.to_thread(transcript.writelines, lines)
+                lines = []
+        await asyncio.to_thread(transcript.writelines, lines)
+    finally:
+        await asyncio.to_thread(transcript.close)
+    return path
+
+async def close_ticket(channel_id: int, reason: str):
+    """Archive a ticket's transcript, delete its channel and forget it."""
+    channel = bot.get_channel(channel_id)
+    if channel is not None:
+        try:
+            await archive_ticket_transcript(channel, reason)
+        except discord.HTTPException as e:
+            ticket_log.warning("Error archiving ticket %s: %s", channel_id, e, extra=log_fields(channel_id=channel_id))
+        try:
+            await channel.delete(reason=reason)
+        except discord.NotFound:
+            pass  # Already deleted by someone else
     
-    async def on_submit(self, interaction: discord.Interaction):
-        keys_text = self.key_input.value.strip()
+    if database['tickets'].pop(str(channel_id), None) is not None:
+        save_database(database)
+
+def retry_ticket_close(channel_id: int, reason: str, attempt: int):
+    """Try a failed close again later, or reopen the ticket once the retries are used up."""
+    if attempt < TICKET_CLOSE_RETRIES:
+        schedule_ticket_close(channel_id, reason, delay=TICKET_CLOSE_RETRY_DELAY * 2 ** attempt, attempt=attempt + 1)
+        return
+    ticket = database['tickets'].get(str(channel_id))
+    if ticket and ticket.get('status') == 'closing':
+        # Back to open, so the idle sweeper or the Close button can try again later
+        ticket['status'] = 'open'
+        save_database(database)
+        ticket_log.warning("Gave up closing ticket %s after %d attempts", channel_id, attempt + 1,
+                           extra=log_fields(channel_id=channel_id))
+
+def requeue_closing_tickets(partition):
+    """Put a partition's tickets that were mid-close back in the close queue."""
+    for channel_id, ticket in partition.data['tickets'].items():
+        if ticket.get('status') == 'closing':
+            ticket_close_queue.put_nowait((partition, int(channel_id), "Closed by staff", 0))
+
+async def ticket_close_worker():
+    """Close queued tickets in small batches so a backlog can't trip rate limits."""
+    while True:
+        batch = [await ticket_close_queue.get()]
+        while len(batch) < TICKET_CLOSE_BATCH and not ticket_close_queue.empty():
+            batch.append(ticket_close_queue.get_nowait())
+        
+        for partition, channel_id, reason, attempt in batch:
+            with use_partition(partition):
+                try:
+                    await close_ticket(channel_id, reason)
+                except Exception:
+                    ticket_log.exception("Error closing ticket %s", channel_id,
+                                         extra=log_fields(channel_id=channel_id, attempt=attempt))
+                    retry_ticket_close(channel_id, reason, attempt)
+        await asyncio.sleep(TICKET_CLOSE_BATCH_DELAY)
+
+@tasks.loop(minutes=TICKET_SWEEP_MINUTES)
+async def ticket_idle_sweeper():
+    """Queue tickets that have been quiet for longer than each loaded partition's idle period."""
+    for partition in partitions.loaded():
+        with use_partition(partition):
+            idle_hours = database.get('ticket_idle_hours', DEFAULT_TICKET_IDLE_HOURS)
+            if not idle_hours:
+                continue
+            cutoff = datetime.utcnow() - timedelta(hours=idle_hours)
+            for channel_id, ticket in list(database['tickets'].items()):
+                if ticket.get('status', 'open') != 'open':
+                    continue
+                last_activity = parse_expiry(ticket.get('last_activity') or ticket.get('created_at'))
+                if last_activity and last_activity < cutoff:
+                    schedule_ticket_close(int(channel_id), f"Inactive for {idle_hours} hours")
+                    ticket_activity_changed.add(partition)
+    
+    # Activity timestamps are only kept in memory between sweeps
+    while ticket_activity_changed:
+        ticket_activity_changed.pop().save()
+
+@ticket_idle_sweeper.before_loop
+async def before_ticket_idle_sweeper():
+    await bot.wait_until_ready()
+    # Tickets caught mid-close by a restart go back in the queue; guild partitions do
+    # the same when they are loaded
+    requeue_closing_tickets(partitions.default)
+
+@bot.tree.command(name="setticketidle", description="Auto-close tickets after this many hours without messages")
+@discord.app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(hours="Idle hours before a ticket is closed, or 0 to never auto-close")
+async def setticketidle(interaction: discord.Interaction, hours: int):
+    """Set the inactivity period after which tickets are closed automatically"""
+    if hours < 0:
+        await interaction.response.send_message("Hours can't be negative.", ephemeral=True)
+        return
+    
+    database['ticket_idle_hours'] = hours
+    save_database(database)
+    await interaction.response.send_message(
+        f"✅ Tickets will close after {hours} idle hours." if hours else "✅ Tickets will no longer auto-close.",
+        ephemeral=True
+    )
+
+# --- Admin Commands ---
+class AddKeyModal(PartitionedModal, title="Add License Key"):
+    def __init__(self, product_id: str, product_name: str):
+        super().__init__()
+        self.product_id = product_id
+        self.product_name = product_name
+        self.key_input = TextInput(
+            label=f"Enter key(s) for {product_name}",
+            style=discord.TextStyle.paragraph,
+            required=True,
+            min_length=5,
+            placeholder="Paste one key per line to add multiple keys at once"
+        )
+        self.add_item(self.key_input)
+    
+    async def on_submit(self, interaction: discord.Interaction):
+        keys_text = self.key_input.value.strip()
         if not keys_text:
             await interaction.response.send_message("No keys provided.", ephemeral=True)
             return
@@ -295,20 +1636,10 @@ class AddKeyModal(ui.Modal, title="Add License Key"):
             await interaction.response.send_message("No valid keys found.", ephemeral=True)
             return
         
-        if self.product_id not in database['products']:
-            database['products'][self.product_id] = {
-                'name': self.product_name,
-                'keys': []
-            }
-        
-        if 'keys' not in database['products'][self.product_id]:
-            database['products'][self.product_id]['keys'] = []
-        
-        added_count = 0
-        for key in keys:
-            if key:
-                database['products'][self.product_id]['keys'].append(key)
-                added_count += 1
+        add_stock_keys(self.product_id, keys)
+        added_count = len(keys)
+        publish_event('stock.added', product_id=self.product_id, quantity=added_count,
+                      in_stock=stock_level(self.product_id))
         
         save_database(database)
         await interaction.response.send_message(
@@ -320,9 +1651,9 @@ class ProductSelect(Select):
     def __init__(self, user_id=None):
         self.user_id = user_id
         options = []
-        for product_id, product in database['products'].items():
-            name = product.get('name', f'Product {product_id}')
-            base_price = product.get('credit_cost', 0)
+        for product_id, product in catalog.products.items():
+            name = product.name
+            base_price = product.price
             
             # Calculate discounted price if user is provided
             if user_id and str(user_id) in database['users']:
@@ -345,7 +1676,7 @@ class ProductSelect(Select):
             options.append(SelectOption(
                 label="No products found",
                 value="none",
-                description="Create a product first using /createproduct"
+                description=f"Add products to {CATALOG_FILE} first"
             ))
         
         super().__init__(
@@ -359,27 +1690,26 @@ class ProductSelect(Select):
         product_id = self.values[0]
         if product_id == "none":
             await interaction.response.send_message(
-                "No products found. Please create a product first using /createproduct",
+                f"No products found. Please add products to {CATALOG_FILE} first.",
                 ephemeral=True
             )
             return
             
-        product = database['products'][product_id]
-        modal = AddKeyModal(product_id, product['name'])
+        modal = AddKeyModal(product_id, catalog.products[product_id].name)
         await interaction.response.send_modal(modal)
 
 @bot.tree.command(name="addkey", description="Add license keys to a product")
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def addkey(interaction: discord.Interaction):
     """Add one or more license keys to a product"""
-    if not database['products']:
+    if not catalog.products:
         await interaction.response.send_message(
-            "❌ No products found. Please create a product first using /createproduct",
+            f"❌ No products found. Please add products to {CATALOG_FILE} first.",
             ephemeral=True
         )
         return
         
-    view = View()
+    view = PartitionedView()
     view.add_item(ProductSelect())
     await interaction.response.send_message(
         "Select a product to add keys to:",
@@ -387,11 +1717,115 @@ async def addkey(interaction: discord.Interaction):
         ephemeral=True
     )
 
+async def product_autocomplete(interaction: discord.Interaction, current: str):
+    """Suggest catalog products by id or by any word of their name."""
+    return [
+        Choice(name=catalog.products[product_id].name, value=product_id)
+        for product_id in catalog.product_index.search(current.strip())
+    ]
+
+@bot.tree.command(name="setkeymode", description="Choose whether a product sells stocked keys or generates them.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(product="The product to configure", mode="stocked: sell keys added with /addkey, generated: mint signed keys")
+@app_commands.autocomplete(product=product_autocomplete)
+@app_commands.choices(mode=[Choice(name=mode, value=mode) for mode in KEY_MODES])
+async def setkeymode(interaction: discord.Interaction, product: str, mode: app_commands.Choice[str]):
+    """Switch a product between stocked and generated keys"""
+    if product not in catalog.products:
+        await interaction.response.send_message("❌ Product not found.", ephemeral=True)
+        return
+    if mode.value == 'generated' and not KEY_SIGNING_SECRET:
+        await interaction.response.send_message(
+            "❌ Set KEY_SIGNING_SECRET in the .env file before enabling generated keys.",
+            ephemeral=True
+        )
+        return
+    
+    database['products'][product]['key_mode'] = mode.value
+    save_database(database)
+    await interaction.response.send_message(
+        f"✅ {product_display_name(product)} now uses {mode.value} keys.",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="setkeystore", description="Choose where a product's unsold keys are kept.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(product="The product to configure", store="json: in database.json, mmap: in a compact per-product key file")
+@app_commands.autocomplete(product=product_autocomplete)
+@app_commands.choices(store=[Choice(name=store, value=store) for store in KEY_STORES])
+async def setkeystore(interaction: discord.Interaction, product: str, store: app_commands.Choice[str]):
+    """Move a product's stock between database.json and a memory-mapped key file"""
+    if product not in catalog.products:
+        await interaction.response.send_message("❌ Product not found.", ephemeral=True)
+        return
+    
+    set_key_store(product, store.value)
+    save_database(database)
+    await interaction.response.send_message(
+        f"✅ {product_display_name(product)} keeps its {stock_level(product)} unsold key(s) in "
+        f"{'a key file' if store.value == 'mmap' else 'database.json'}.",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="verifykey", description="Check whether a generated license key is genuine.")
+@app_commands.checks.has_permissions(administrator=True)
+async def verifykey(interaction: discord.Interaction, key: str):
+    """Verify a generated key's signature and show what it encodes"""
+    decoded = verify_license_key(key)
+    if decoded is None:
+        await interaction.response.send_message("❌ This is not a valid generated key.", ephemeral=True)
+        return
+    
+    product_id, duration_days, serial = decoded
+    product_name = product_display_name(product_id)
+    await interaction.response.send_message(
+        f"✅ Genuine key for **{product_name}** • {duration_days} day(s) • serial #{serial}",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="whoowns", description="Find who bought a license key.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(key="The full key, or the start of it to search")
+async def whoowns(interaction: discord.Interaction, key: str):
+    """Look up the owner of a key, falling back to a prefix search"""
+    key = key.strip()
+    records = license_index.lookup(key)
+    
+    if not records:
+        matches = license_index.search_prefix(key)
+        if not matches:
+            await interaction.response.send_message("❌ No sold key matches that.", ephemeral=True)
+            return
+        if len(matches) > 1:
+            await interaction.response.send_message(
+                "Several keys start with that:\n" + "\n".join(f"• `{match}`" for match in matches),
+                ephemeral=True
+            )
+            return
+        key = matches[0]
+        records = license_index.lookup(key)
+    
+    embed = discord.Embed(title="Key Owner", description=f"`{key}`", color=0x3498db)
+    if len(records) > 1:
+        embed.description += f"\n⚠️ This key was sold {len(records)} times."
+    for record in records:
+        product_name = product_display_name(record.product_id)
+        embed.add_field(
+            name=product_name,
+            value=(
+                f"User: <@{record.user_id}> (`{record.user_id}`)\n"
+                f"Order: `{record.order_id or 'unknown'}`\n"
+                f"Purchased: {record.purchase_date}"
+            ),
+            inline=False
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="addcredits", description="Add credits to a user's balance.")
 @app_commands.checks.has_permissions(administrator=True)
 async def addcredits(interaction: discord.Interaction, user: discord.Member, amount: int):
     user_data = get_user_data(user.id)
-    user_data['credits'] += amount
+    adjust_credits(user.id, user_data, amount, 'grant', actor=interaction.user.id)
     save_database(database)
     await interaction.response.send_message(f"Added {amount} credits to {user.mention}. New balance: {user_data['credits']}", ephemeral=True)
 
@@ -399,10 +1833,97 @@ async def addcredits(interaction: discord.Interaction, user: discord.Member, amo
 @app_commands.checks.has_permissions(administrator=True)
 async def setcredits(interaction: discord.Interaction, user: discord.Member, amount: int):
     user_data = get_user_data(user.id)
-    user_data['credits'] = amount
+    adjust_credits(user.id, user_data, amount - user_data['credits'], 'set', actor=interaction.user.id)
     save_database(database)
     await interaction.response.send_message(f"Set {user.mention}'s credits to {amount}.", ephemeral=True)
 
+@bot.tree.command(name="credithistory", description="Page through a user's credit journal.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(user="The user to show", page="Page number, newest entries first")
+async def credithistory(interaction: discord.Interaction, user: discord.Member, page: int = 1):
+    """Show a page of a user's credit ledger and check it against their balance"""
+    entries, page_count = credit_ledger.history(user.id, page)
+    if not entries:
+        await interaction.response.send_message(f"No credit history for {user.mention}.", ephemeral=True)
+        return
+    
+    lines = []
+    for entry in entries:
+        if entry['type'] == 'checkpoint':
+            lines.append(f"`#{entry['seq']}` 📌 checkpoint • balance **{entry['balance']}**")
+            continue
+        reference = f" • `{entry['ref']}`" if entry.get('ref') else ""
+        lines.append(
+            f"`#{entry['seq']}` {entry['ts'][:16].replace('T', ' ')} • **{entry['type']}** "
+            f"{entry['delta']:+} → {entry['balance']}{reference}"
+        )
+    
+    balance = get_user_data(user.id)['credits']
+    reconstructed = credit_ledger.reconstruct_balance(user.id)
+    embed = discord.Embed(title=f"Credit History - {user.display_name}", description="\n".join(lines), color=0x3498db)
+    embed.add_field(name="Balance", value=str(balance), inline=True)
+    embed.add_field(
+        name="Ledger",
+        value=f"{reconstructed} {'✅' if reconstructed == balance else '⚠️ mismatch'}",
+        inline=True
+    )
+    embed.set_footer(text=f"Page {page}/{page_count}")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="bulkcredits", description="Apply credit and discount changes from a CSV file.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    file="CSV with user_id, credit_delta and discount columns",
+    dry_run="Only show what would change (default: true)"
+)
+async def bulkcredits(interaction: discord.Interaction, file: discord.Attachment, dry_run: bool = True):
+    """Apply a CSV of credit and discount changes as one all-or-nothing transaction"""
+    await interaction.response.defer(ephemeral=True)
+    
+    try:
+        text = (await file.read()).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await interaction.followup.send("❌ The file must be UTF-8 encoded CSV.", ephemeral=True)
+        return
+    
+    changes, errors = parse_bulk_csv(text)
+    if errors:
+        shown = "\n".join(errors[:15]) + (f"\n…and {len(errors) - 15} more" if len(errors) > 15 else "")
+        await interaction.followup.send(f"❌ Nothing was applied. Fix these rows first:\n```\n{shown}\n```", ephemeral=True)
+        return
+    
+    diff_file = discord.File(io.BytesIO(format_bulk_diff(changes).encode('utf-8')), filename="bulk-diff.txt")
+    if dry_run:
+        await interaction.followup.send(
+            f"🔍 Dry run: {len(changes)} row(s) would be applied. Run again with `dry_run: False` to apply.",
+            file=diff_file,
+            ephemeral=True
+        )
+        return
+    
+    apply_bulk_changes(changes, actor=interaction.user.id)
+    save_database(database)
+    await interaction.followup.send(f"✅ Applied {len(changes)} row(s).", file=diff_file, ephemeral=True)
+
+@bot.tree.command(name="admission", description="Show admission control and load shedding counters.")
+@app_commands.checks.has_permissions(administrator=True)
+async def admission(interaction: discord.Interaction):
+    """Show how busy each handler group is and how much load was shed"""
+    embed = discord.Embed(title="Admission Control", color=0x3498db)
+    for name, limiter in sorted(admission_limiters.items()):
+        embed.add_field(
+            name=name,
+            value=(
+                f"Active: {limiter.active}/{limiter.limit} • Waiting: {limiter.waiting}/{limiter.max_queue}\n"
+                f"Admitted: {limiter.admitted} • Queued: {limiter.queued} • Shed: {limiter.shed}\n"
+                f"Peak waiting: {limiter.peak_waiting}"
+            ),
+            inline=False
+        )
+    if not admission_limiters:
+        embed.description = "No limited handlers have run yet."
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="setdiscount", description="Set a user's discount percentage.")
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(
@@ -420,8 +1941,31 @@ async def setdiscount(interaction: discord.Interaction, user: discord.Member, pe
     save_database(database)
     await interaction.response.send_message(f"Set {user.mention}'s discount to {percentage}%.", ephemeral=True)
 
+@bot.tree.command(name="setquantitylimit", description="Set how many keys members of a role can buy at once.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    role="The role to set the limit for",
+    limit=f"Maximum keys per purchase (1-{MAX_BULK_QUANTITY}), or 0 to remove the role's limit"
+)
+async def setquantitylimit(interaction: discord.Interaction, role: discord.Role, limit: int):
+    """Set a per-role purchase quantity limit for bulk orders"""
+    if not 0 <= limit <= MAX_BULK_QUANTITY:
+        await interaction.response.send_message(f"Limit must be between 0 and {MAX_BULK_QUANTITY}.", ephemeral=True)
+        return
+    
+    limits = database.setdefault('quantity_limits', {})
+    if limit == 0:
+        limits.pop(str(role.id), None)
+        message = f"Removed the quantity limit for {role.mention}. Members fall back to {DEFAULT_MAX_QUANTITY} keys."
+    else:
+        limits[str(role.id)] = limit
+        message = f"Members of {role.mention} can now buy up to {limit} keys at once."
+    save_database(database)
+    await interaction.response.send_message(message, ephemeral=True)
+
 # --- User Commands ---
 @bot.tree.command(name="balance", description="Check your credit balance.")
+@admission_controlled('history')
 async def balance(interaction: discord.Interaction):
     user_data = get_user_data(interaction.user.id)
     embed = discord.Embed(title="Your Balance", color=0x00ff00)
@@ -430,6 +1974,7 @@ async def balance(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="products", description="List all available products.")
+@admission_controlled('menus')
 async def products(interaction: discord.Interaction):
     user_data = get_user_data(interaction.user.id)
     discount = user_data.get('discount', 0)
@@ -440,10 +1985,10 @@ async def products(interaction: discord.Interaction):
         color=0x3498db
     )
     
-    for product_id, product in database['products'].items():
-        stock_count = len(product.get('keys', []))
-        stock_text = f"Stock: {stock_count}"
-        base_price = product['credit_cost']
+    for product_id, product in catalog.products.items():
+        stock_count = reservations.available(product_id, interaction.user.id)
+        stock_text = "Stock: Unlimited" if stock_count == math.inf else f"Stock: {stock_count}"
+        base_price = product.price
         
         if discount > 0:
             discounted_price = math.ceil(base_price * (1 - discount / 100))
@@ -452,7 +1997,7 @@ async def products(interaction: discord.Interaction):
             price_text = f"**{base_price} credits**"
         
         embed.add_field(
-            name=product['name'],
+            name=product.name,
             value=(
                 f"ID: `{product_id}`\n"
                 f"Price: {price_text}\n"
@@ -463,205 +2008,320 @@ async def products(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
-# Product categories and their variants
-PRODUCT_CATEGORIES = {
-    "r6": ("R6 Full", {"emoji": "🎮"}),
-    "fn": ("Fortnite Private", {"emoji": "🔫"}),
-    "spoofer": ("Perm Spoofer", {"emoji": "🔄"})
-}
+# --- Autocomplete Indexes ---
+AUTOCOMPLETE_LIMIT = 25  # Discord shows at most 25 choices
 
-PRODUCT_VARIANTS = {
-    "r6": {
-        "day": {"name": "1 Day", "price": 7, "duration": 1},
-        "week": {"name": "1 Week", "price": 34, "duration": 7},
-        "month": {"name": "1 Month", "price": 61, "duration": 30}
-    },
-    "fn": {
-        "day": {"name": "1 Day", "price": 10, "duration": 1},
-        "3day": {"name": "3 Days", "price": 19, "duration": 3},
-        "week": {"name": "1 Week", "price": 34, "duration": 7},
-        "month": {"name": "1 Month", "price": 55, "duration": 30},
-        "life": {"name": "Lifetime", "price": 250, "duration": 9999}
-    },
-    "spoofer": {
-        "onetime": {"name": "One Time", "price": 27, "duration": 9999},
-        "life": {"name": "Lifetime", "price": 55, "duration": 9999}
-    }
-}
+class PrefixIndex:
+    """Sorted (term, value) pairs searched by prefix with bisect.
 
-class DurationSelect(Select):
-    def __init__(self, product_type: str):
-        self.product_type = product_type
-        # Filter products by type (r6, fn, spoofer)
-        options = []
-        for product_id, product in database['products'].items():
-            if product_id.startswith(product_type):
-                options.append(SelectOption(
-                    label=product['name'],
-                    description=f"{product['credit_cost']} credits",
-                    value=product_id
-                ))
+    A value can be filed under several terms (an id, a name, each word of the
+    name); search returns each value once, in term order. Inserts use insort, so
+    a sale updates the index in place instead of rebuilding it.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = sorted((term.lower(), value) for term, value in entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, term: str, value):
+        bisect.insort(self.entries, (term.lower(), value))
+
+    def discard(self, term: str, value):
+        entry = (term.lower(), value)
+        position = bisect.bisect_left(self.entries, entry)
+        if position < len(self.entries) and self.entries[position] == entry:
+            del self.entries[position]
+
+    def search(self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> list:
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.entries, (prefix,))
+        matches = []
+        for term, value in itertools.islice(self.entries, start, None):
+            if not term.startswith(prefix) or len(matches) >= limit:
+                break
+            if value not in matches:
+                matches.append(value)
+        return matches
+
+def name_terms(identifier: str, name: str) -> list:
+    """Terms to file a record under: its id, its full name and each later word of the name."""
+    words = "".join(c if c.isalnum() else " " for c in name).split()
+    return [identifier, name] + [" ".join(words[i:]) for i in range(1, len(words))]
+
+class OrderIndex:
+    """Order ids for autocomplete, across all orders and per customer.
+
+    Admins search the global list; customers only ever search their own, which
+    keeps their suggestions small and never leaks another customer's ids. Each
+    customer's orders are also kept oldest first so an empty query can show the
+    latest purchases.
+    """
+
+    def __init__(self):
+        self.all = PrefixIndex()
+        self.by_user = {}
+        self.recent_by_user = {}
+
+    def rebuild(self, data: dict):
+        orders = sorted(data.get('orders', {}).items(), key=lambda item: item[1].get('date', ''))
+        self.all = PrefixIndex((order_id, order_id) for order_id, _ in orders)
+        self.by_user = {}
+        self.recent_by_user = {}
+        for order_id, order in orders:
+            self.by_user.setdefault(order['user_id'], []).append(order_id)
+            self.recent_by_user.setdefault(order['user_id'], []).append(order_id)
+        for order_ids in self.by_user.values():
+            order_ids.sort()
+
+    def add(self, user_id, order_id: str):
+        user_id = str(user_id)
+        self.all.add(order_id, order_id)
+        bisect.insort(self.by_user.setdefault(user_id, []), order_id)
+        self.recent_by_user.setdefault(user_id, []).append(order_id)
+
+    def search(self, prefix: str, user_id=None, limit: int = AUTOCOMPLETE_LIMIT) -> list:
+        """Order ids starting with `prefix`, limited to one customer's orders if `user_id` is given."""
+        prefix = prefix.upper()
+        if user_id is None:
+            return self.all.search(prefix, limit)
         
-        super().__init__(
-            placeholder="Select a duration...",
-            min_values=1,
-            max_values=1,
-            options=options
+        user_id = str(user_id)
+        if not prefix:
+            return self.recent_by_user.get(user_id, [])[-limit:][::-1]
+        order_ids = self.by_user.get(user_id, [])
+        start = bisect.bisect_left(order_ids, prefix)
+        matches = []
+        for order_id in itertools.islice(order_ids, start, start + limit):
+            if not order_id.startswith(prefix):
+                break
+            matches.append(order_id)
+        return matches
+
+class CustomerIndex:
+    """Customer ids and last known usernames, for picking customers who may have left the server."""
+
+    def __init__(self):
+        self.index = PrefixIndex()
+        self.names = {}
+
+    def rebuild(self, data: dict):
+        self.names = {user_id: user_data.get('name', '') for user_id, user_data in data.get('users', {}).items()}
+        self.index = PrefixIndex(
+            (term, user_id)
+            for user_id, name in self.names.items()
+            for term in (name_terms(user_id, name) if name else [user_id])
         )
 
-    async def callback(self, interaction: discord.Interaction):
-        product_id = self.values[0]
-        user_data = get_user_data(interaction.user.id)
-        product = database['products'][product_id]
-        
-        if not product.get('keys'):
-            return await interaction.response.edit_message(
-                content="❌ This product is out of stock.",
-                view=None,
-                embed=None
-            )
+    def add(self, user_id, name: str):
+        user_id = str(user_id)
+        old_name = self.names.get(user_id)
+        if old_name == name:
+            return
+        if old_name is None:
+            self.index.add(user_id, user_id)
+        elif old_name:
+            for term in name_terms(user_id, old_name)[1:]:
+                self.index.discard(term, user_id)
+        for term in name_terms(user_id, name)[1:]:
+            self.index.add(term, user_id)
+        self.names[user_id] = name
 
-        discount_percentage = user_data.get('discount', 0)
-        discounted_cost = math.ceil(product['credit_cost'] * (1 - discount_percentage / 100))
-        
-        if user_data['credits'] < discounted_cost:
-            return await interaction.response.edit_message(
-                content=f"❌ You don't have enough credits. This costs {discounted_cost} credits.",
-                view=None,
-                embed=None
-            )
-        
-        # Get a key to sell
-        if not product.get('keys'):
-            return await interaction.response.edit_message(
-                content="❌ This product is out of stock.",
-                view=None,
-                embed=None
-            )
-        
-        # Get the first key and remove it from the list
-        key_to_sell = product['keys'].pop(0)
-        
-        # If the key contains newlines, split them and put the remaining keys back
-        if '\n' in key_to_sell:
-            key_lines = key_to_sell.split('\n')
-            key_to_sell = key_lines[0]  # Use the first key
-            remaining_keys = key_lines[1:]  # Get the rest of the keys
-            if remaining_keys:  # If there are remaining keys, add them back to the product
-                product['keys'].extend(remaining_keys)
-        
-        expiry_date = (datetime.utcnow() + timedelta(days=product['duration_days'])).strftime('%Y-%m-%d')
-        
-        user_data['keys'].append({
-            'key': key_to_sell,
-            'product': product_id,
-            'purchase_date': datetime.utcnow().isoformat(),
-            'expires': expiry_date
-        })
-        
-        user_data['credits'] -= discounted_cost
-        save_database(database)
+    def search(self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> list:
+        return self.index.search(prefix, limit)
+
+def remember_customer(user):
+    """Keep the buyer's current username on their record and in the customer index."""
+    user_data = get_user_data(user.id)
+    user_data['name'] = user.name
+    customer_index.add(user.id, user.name)
+
+async def order_autocomplete(interaction: discord.Interaction, current: str):
+    """Suggest order ids: the caller's own, or every order for admins."""
+    scope = None if interaction.user.id in ADMIN_USER_IDS else interaction.user.id
+    orders = database.get('orders', {})
+    choices = []
+    for order_id in order_index.search(current.strip(), scope):
+        order = orders.get(order_id)
+        if order:
+            label = f"{order_id} · {order['product_name']} · {order['date'][:10]}"
+            choices.append(Choice(name=label[:100], value=order_id))
+    return choices
+
+async def customer_autocomplete(interaction: discord.Interaction, current: str):
+    """Suggest customers from the database by id or username."""
+    return [
+        Choice(name=f"{customer_index.names.get(user_id) or 'unknown'} ({user_id})"[:100], value=user_id)
+        for user_id in customer_index.search(current.strip())
+    ]
+
+# --- Product Catalog ---
+CATALOG_FILE = 'catalog.json'
+CATALOG_POLL_SECONDS = 5
+CATALOG_ID_CHARACTERS = set(string.ascii_lowercase + string.digits)
+
+CatalogProduct = namedtuple('CatalogProduct', ['product_id', 'category', 'variant', 'name', 'price', 'duration_days'])
+
+class CatalogError(ValueError):
+    """Raised when the catalog file is missing or fails validation."""
+
+class Catalog:
+    """Immutable, validated view of catalog.json, the single source of product pricing.
+
+    `categories` and `variants` keep the {category: (name, info)} and
+    {category: {variant: info}} shapes the menus use; `products` maps full product
+    ids like "r6_day" to CatalogProduct records. A reload builds a new Catalog and
+    swaps it in whole, so a purchase holding on to variant info from the old one is
+    never affected.
+    """
+
+    def __init__(self, data: dict, mtime: float = None):
+        errors = []
+        raw_categories = data.get('categories') if isinstance(data, dict) else None
+        if not isinstance(raw_categories, dict) or not raw_categories:
+            raise CatalogError("catalog needs a non-empty 'categories' object")
         
-        try:
-            # Generate a unique order ID
-            order_id = str(uuid.uuid4())[:8].upper()
-            
-            # First embed - Order Confirmation
-            order_embed = discord.Embed(
-                title=f"New Panel Order for {discounted_cost} credits",
-                color=0x2ecc71
-            )
-            
-            # Add order information
-            order_embed.description = f"This order was made by {interaction.user.mention} | {interaction.user.name}"
-            
-            # Add Order ID section
-            order_embed.add_field(
-                name="Order ID",
-                value=f"```\n{order_id}\n```",
-                inline=False
-            )
-            
-            # Add Products section
-            duration_text = "Lifetime" if product['duration_days'] == 9999 else f"{product['duration_days']} Day"
-            products_text = f"{product['name']}\n- {duration_text}: 1"
-            order_embed.add_field(
-                name="Products",
-                value=f"```\n{products_text}\n```",
-                inline=False
-            )
+        categories = {}
+        variants = {}
+        products = {}
+        for category_id, category in raw_categories.items():
+            if not set(category_id) <= CATALOG_ID_CHARACTERS:
+                errors.append(f"category id {category_id!r} may only use lowercase letters and digits")
+                continue
+            if not isinstance(category, dict) or not isinstance(category.get('name'), str):
+                errors.append(f"category {category_id!r} needs a name")
+                continue
+            if not isinstance(category.get('variants'), dict) or not category['variants']:
+                errors.append(f"category {category_id!r} needs at least one variant")
+                continue
             
-            # Add Amount Paid section
-            order_embed.add_field(
-                name="Amount Paid",
-                value=f"```\n{discounted_cost} credits\n```",
-                inline=False
-            )
-            
-            # Add Source section (changed from Panel to Bot)
-            order_embed.add_field(
-                name="Source",
-                value="```\nBot\n```",
-                inline=False
-            )
-            
-            # Add user's avatar as thumbnail
-            order_embed.set_thumbnail(url=interaction.user.display_avatar.url)
-            
-            # Second embed - License Key
-            key_embed = discord.Embed(
-                title=product['name'],
-                color=0x2ecc71
-            )
-            
-            # Add Key section
-            duration_text = "Lifetime" if product['duration_days'] == 9999 else f"{product['duration_days']} Day"
-            key_embed.add_field(
-                name=f"{duration_text} Item{'s' if product['duration_days'] != 1 else ''}",
-                value=f"```\n{key_to_sell}\n```",
-                inline=False
-            )
-            
-            # Removed expiry footer as per request
-                
-            # Store both embeds to send
-            embeds = [order_embed, key_embed]
-            
-            # Store order details
-            if 'orders' not in database:
-                database['orders'] = {}
-                
-            database['orders'][order_id] = {
-                'user_id': str(interaction.user.id),
-                'product_id': product_id,
-                'product_name': product['name'],
-                'key': key_to_sell,
-                'price': discounted_cost,
-                'date': datetime.utcnow().isoformat(),
-                'expires': expiry_date
-            }
-            save_database(database)
-            
-            # Send both embeds in DM
-            await interaction.user.send(embeds=embeds)
+            category_variants = {}
+            for variant_id, variant in category['variants'].items():
+                where = f"{category_id}.{variant_id}"
+                if not set(variant_id) <= CATALOG_ID_CHARACTERS:
+                    errors.append(f"variant id {where!r} may only use lowercase letters and digits")
+                elif not isinstance(variant, dict) or not isinstance(variant.get('name'), str):
+                    errors.append(f"variant {where!r} needs a name")
+                elif not isinstance(variant.get('price'), int) or variant['price'] < 0:
+                    errors.append(f"variant {where!r} needs a whole, non-negative price")
+                elif not isinstance(variant.get('duration'), int) or variant['duration'] < 1:
+                    errors.append(f"variant {where!r} needs a duration of at least 1 day")
+                else:
+                    info = {'name': variant['name'], 'price': variant['price'], 'duration': variant['duration']}
+                    category_variants[variant_id] = MappingProxyType(info)
+                    product_id = f"{category_id}_{variant_id}"
+                    products[product_id] = CatalogProduct(
+                        product_id, category_id, variant_id,
+                        f"{category['name']} ({variant['name']})", variant['price'], variant['duration']
+                    )
             
-            # Update the interaction response
-            await interaction.response.edit_message(
-                content=f"✅ Order #{order_id} successful! Check your DMs for your key.",
-                view=None,
-                embed=None,
-                delete_after=10
-            )
-        except discord.Forbidden:
-            await interaction.response.edit_message(
-                content="❌ I couldn't send you a DM. Please check your privacy settings and try again.",
-                view=None,
-                embed=None
-            )
+            categories[category_id] = (category['name'], MappingProxyType({'emoji': category.get('emoji', '🛒')}))
+            variants[category_id] = MappingProxyType(category_variants)
+        
+        if errors:
+            raise CatalogError("; ".join(errors))
+        self.categories = MappingProxyType(categories)
+        self.variants = MappingProxyType(variants)
+        self.products = MappingProxyType(products)
+        self.mtime = mtime
+        self.category_index = PrefixIndex(
+            (term, category_id)
+            for category_id, (name, _) in categories.items()
+            for term in name_terms(category_id, name)
+        )
+        self.product_index = PrefixIndex(
+            (term, product.product_id)
+            for product in products.values()
+            for term in name_terms(product.product_id, product.name)
+        )
 
-class VariantSelectView(View):
-    def __init__(self, product_id: str):
-        super().__init__()
+def load_catalog(path: str = CATALOG_FILE) -> Catalog:
+    """Read and validate the catalog file."""
+    try:
+        mtime = os.path.getmtime(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise CatalogError(f"{path} not found")
+    except ValueError as e:
+        raise CatalogError(f"{path} is not valid JSON: {e}")
+    return Catalog(data, mtime)
+
+def sync_products_with_catalog():
+    """Make sure every catalog product has a stock entry and drop pricing the catalog now owns."""
+    for product_id in catalog.products:
+        product = database['products'].setdefault(product_id, {})
+        if 'key_file' not in product:
+            product.setdefault('keys', [])
+        for field in ('name', 'credit_cost', 'duration_days'):
+            product.pop(field, None)
+
+def reload_catalog():
+    """Swap in a freshly validated catalog for the current partition. Raises CatalogError and keeps the old one if invalid.
+
+    A guild without a catalog.json of its own follows the default catalog, so that is
+    the one reloaded, and every loaded partition using it gets its stock entries synced.
+    """
+    partition = partitions.current()
+    if partition.default is not None and not os.path.exists(partition.catalog_file):
+        partition = partition.default
+    new_catalog = load_catalog(partition.catalog_file)
+    partition.own_catalog, partition.catalog_mtime = new_catalog, new_catalog.mtime
+    for member in partitions.loaded():
+        if member.catalog is new_catalog:
+            with use_partition(member):
+                sync_products_with_catalog()
+                save_database(database)
+    # Menus for categories added since startup need their persistent views too
+    for category_id in new_catalog.categories:
+        bot.add_view(VariantSelectView(category_id, persistent=True))
+    catalog_log.info("Loaded %s with %d product(s)", partition.catalog_file, len(new_catalog.products))
+
+def product_display_name(product_id: str) -> str:
+    """A product's name from the catalog, falling back to its id for retired products."""
+    product = catalog.products.get(product_id)
+    return product.name if product else database['products'].get(product_id, {}).get('name', product_id)
+
+async def category_autocomplete(interaction: discord.Interaction, current: str):
+    """Suggest product categories from the live catalog."""
+    return [
+        Choice(name=catalog.categories[category_id][0], value=category_id)
+        for category_id in catalog.category_index.search(current.strip())
+    ]
+
+@tasks.loop(seconds=CATALOG_POLL_SECONDS)
+async def catalog_watcher():
+    """Hot-reload a loaded partition's catalog whenever its file changes on disk."""
+    for partition in partitions.loaded():
+        try:
+            mtime = os.path.getmtime(partition.catalog_file)
+        except OSError:
+            continue
+        if mtime != partition.catalog_mtime:
+            # Remember the version even if it's broken, so it isn't retried every poll
+            partition.catalog_mtime = mtime
+            try:
+                with use_partition(partition):
+                    reload_catalog()
+            except CatalogError as e:
+                catalog_log.warning("Ignoring invalid catalog change: %s", e)
+
+@bot.tree.command(name="reloadcatalog", description="Reload product pricing from the catalog file")
+@app_commands.checks.has_permissions(administrator=True)
+async def reloadcatalog(interaction: discord.Interaction):
+    """Reload catalog.json now instead of waiting for the file watcher"""
+    try:
+        reload_catalog()
+    except CatalogError as e:
+        await interaction.response.send_message(f"❌ Catalog not reloaded, the old one stays active:\n```\n{e}\n```", ephemeral=True)
+        return
+    await interaction.response.send_message(f"✅ Catalog reloaded with {len(catalog.products)} products.", ephemeral=True)
+
+class VariantSelectView(PartitionedView):
+    def __init__(self, product_id: str, persistent: bool = False):
+        # Persistent copies back /genpanel messages across restarts; /gen menus are throwaway
+        super().__init__(timeout=None if persistent else 180)
         self.product_id = product_id
         self.add_item(VariantSelect(product_id))
 
@@ -674,189 +2334,321 @@ class VariantSelect(Select):
                 value=variant_id,
                 description=f"{variant_info['duration']} days of access"
             )
-            for variant_id, variant_info in PRODUCT_VARIANTS[product_id].items()
+            for variant_id, variant_info in catalog.variants[product_id].items()
         ]
         super().__init__(
             placeholder="Select a duration...",
             min_values=1,
             max_values=1,
-            options=options
+            options=options,
+            custom_id=f"gen_variant:{product_id}"
         )
     
+    @admission_controlled('menus')
     async def callback(self, select_interaction: discord.Interaction):
-        if select_interaction.user.id != select_interaction.message.interaction.user.id:
+        # Public /genpanel menus are for everyone; /gen menus only for whoever ran /gen
+        message = select_interaction.message
+        is_panel = str(message.id) in database.get('panels', {})
+        if not is_panel and message.interaction and select_interaction.user.id != message.interaction.user.id:
             await select_interaction.response.send_message("This is not your menu!", ephemeral=True)
             return
         
+        # The price shown in the menu is locked in now, even if the catalog reloads mid-purchase
+        variant_info = catalog.variants.get(self.product_id, {}).get(self.values[0])
+        if variant_info is None:
+            await select_interaction.response.send_message("This product is no longer available.", ephemeral=True)
+            return
+        
+        # Hold a key while the quantity modal is open; submitting resizes the hold to the chosen quantity
+        hold_id = reservations.reserve(select_interaction.user.id, f"{self.product_id}_{self.values[0]}", 1)
+        if hold_id is None:
+            await select_interaction.response.send_message("This product is out of stock.", ephemeral=True)
+            return
+        
         # Show quantity input modal
-        quantity_modal = QuantityModal(self.product_id, self.values[0])
-        await select_interaction.response.send_modal(quantity_modal)
+        quantity_modal = QuantityModal(self.product_id, self.values[0], variant_info, hold_id)
+        try:
+            await select_interaction.response.send_modal(quantity_modal)
+        except discord.HTTPException:
+            reservations.release(hold_id)
+            raise
 
 @bot.tree.command(name="gen", description="Generate a license key for a product")
-@app_commands.choices(product=[
-    app_commands.Choice(name=name, value=product_id)
-    for product_id, (name, _) in PRODUCT_CATEGORIES.items()
-])
-async def gen(interaction: discord.Interaction, product: app_commands.Choice[str]):
+@app_commands.autocomplete(product=category_autocomplete)
+@admission_controlled('menus')
+async def gen(interaction: discord.Interaction, product: str):
     """Generate a license key for a product
     
     Parameters
     ----------
     product: The product to generate a key for
     """
+    if product not in catalog.categories:
+        await interaction.response.send_message("❌ Unknown product.", ephemeral=True)
+        return
+    
     # Show variant selection
-    view = VariantSelectView(product.value)
+    view = VariantSelectView(product)
     await interaction.response.send_message(
-        f"Select duration for {product.name}:",
+        f"Select duration for {catalog.categories[product][0]}:",
         view=view,
         ephemeral=True
     )
+
+class QuantityModal(PartitionedModal, title="Enter Quantity"):
+    def __init__(self, product_id: str, variant_id: str, variant_info, hold_id: str = None):
+        # A modal that is closed without submitting times out along with its hold
+        super().__init__(timeout=RESERVATION_TTL_SECONDS)
+        self.product_id = product_id
+        self.variant_id = variant_id
+        self.variant_info = variant_info
+        self.hold_id = hold_id
+        self.quantity = ui.TextInput(
+            label="How many keys do you want to generate?",
+            placeholder="Enter the number of keys you want",
+            min_length=1,
+            max_length=len(str(MAX_BULK_QUANTITY))
+        )
+        self.add_item(self.quantity)
     
-    class QuantityModal(ui.Modal, title="Enter Quantity"):
-        def __init__(self, product_id: str):
-            super().__init__()
-            self.product_id = product_id
-            self.quantity = ui.TextInput(
-                label="How many keys do you want to generate? (1-10)",
-                placeholder="Enter a number between 1 and 10",
-                min_length=1,
-                max_length=2
-            )
-            self.add_item(self.quantity)
-        
-        async def on_submit(self, interaction: discord.Interaction):
-            try:
-                quantity = int(self.quantity.value)
-                if quantity < 1 or quantity > 10:  # Max 10 keys at once
-                    await interaction.response.send_message(
-                        "Please enter a number between 1 and 10.",
-                        ephemeral=True
-                    )
-                    return
-                
-                # Show duration selection
-                view = View()
-                
-                class DurationButton(Button):
-                    def __init__(self, label: str, variant_id: str, quantity: int):
-                        super().__init__(label=label, style=discord.ButtonStyle.primary)
-                        self.variant_id = variant_id
-                        self.quantity = quantity
-                    
-                    async def callback(self, button_interaction: discord.Interaction):
-                        if button_interaction.user.id != interaction.user.id:
-                            await button_interaction.response.send_message("This is not your menu!", ephemeral=True)
-                            return
-                        
-                        variant_info = PRODUCT_VARIANTS[self.view.product_id][self.variant_id]
-                        product_id_full = f"{self.view.product_id}_{self.variant_id}"
-                        
-                        if product_id_full not in database['products'] or not database['products'][product_id_full].get('keys'):
-                            await button_interaction.response.send_message("This product is out of stock.", ephemeral=True)
-                            return
-                        
-                        await process_purchase(button_interaction, product_id_full, variant_info, self.quantity)
-                
-                # Add duration buttons
-                for variant_id, variant_info in PRODUCT_VARIANTS[self.product_id].items():
-                    duration = variant_info['duration']
-                    view.add_item(DurationButton(
-                        f"{duration} Day{'s' if duration > 1 else ''} - {variant_info['price']} credits", 
-                        variant_id,
-                        quantity
-                    ))
-                
-                # Add back button
-                class BackButton(Button):
-                    def __init__(self):
-                        super().__init__(label="Back", style=discord.ButtonStyle.secondary)
-                    
-                    async def callback(self, back_interaction: discord.Interaction):
-                        if back_interaction.user.id != interaction.user.id:
-                            await back_interaction.response.send_message("This is not your menu!", ephemeral=True)
-                            return
-                        
-                        # Show product selection again
-                        view = View()
-                        view.add_item(ProductSelect())
-                        
-                        try:
-                            await back_interaction.response.edit_message(
-                                content="Select a product:",
-                                view=view,
-                                embed=None
-                            )
-                        except Exception as e:
-                            await back_interaction.followup.send("An error occurred. Please try again.", ephemeral=True)
-                            print(f"Error going back: {e}")
-                
-                view.add_item(BackButton())
-                view.product_id = self.product_id
-                
-                await interaction.response.edit_message(
-                    content=f"Select duration for {PRODUCT_CATEGORIES[self.product_id][0]} (Quantity: {quantity}):",
-                    view=view,
-                    embed=None
-                )
-                
-            except (ValueError, AttributeError) as e:
-                await interaction.response.send_message("Please enter a valid number.", ephemeral=True)
-                return
-    
-    # Add product selection view
-class QuantityModal(ui.Modal, title="Enter Quantity"):
-    def __init__(self, product_id: str, variant_id: str):
-        super().__init__()
-        self.product_id = product_id
-        self.variant_id = variant_id
-        self.quantity = ui.TextInput(
-            label="How many keys do you want to generate?",
-            placeholder="Enter the number of keys you want",
-            min_length=1,
-            max_length=3
-        )
-        self.add_item(self.quantity)
-    
+    @admission_controlled('purchase')
     async def on_submit(self, interaction: discord.Interaction):
         try:
             quantity = int(self.quantity.value)
-            if quantity < 1 or quantity > 10:  # Max 10 keys at once
+            max_quantity = get_quantity_limit(interaction.user)
+            if quantity < 1 or quantity > max_quantity:
+                reservations.release(self.hold_id)
                 await interaction.response.send_message(
-                    "Please enter a number between 1 and 10.",
+                    f"Please enter a number between 1 and {max_quantity}.",
                     ephemeral=True
                 )
                 return
             
             # Process the purchase directly since we already have all the information
-            variant_info = PRODUCT_VARIANTS[self.product_id][self.variant_id]
+            variant_info = self.variant_info
             product_id_full = f"{self.product_id}_{self.variant_id}"
             
-            if product_id_full not in database['products'] or not database['products'][product_id_full].get('keys'):
-                await interaction.response.send_message("This product is out of stock.", ephemeral=True)
+            # A resubmitted modal gets the first submission's answer instead of a second charge
+            idempotency_key = purchase_idempotency_key(interaction, product_id_full, quantity, source=self.custom_id)
+            claimed, previous_result = purchase_idempotency.claim(idempotency_key)
+            if not claimed:
+                await send_duplicate_purchase_response(interaction, previous_result)
+                return
+            
+            # Grow the menu's hold to the chosen quantity, or place a new one if it has expired
+            if reservations.resize(self.hold_id, quantity):
+                hold_id = self.hold_id
+            else:
+                hold_id = reservations.reserve(interaction.user.id, product_id_full, quantity)
+            if hold_id is None:
+                purchase_idempotency.discard(idempotency_key)
+                available_keys = reservations.available(product_id_full, interaction.user.id, 'purchase')
+                if not available_keys:
+                    await interaction.response.send_message("This product is out of stock.", ephemeral=True)
+                else:
+                    await interaction.response.send_message(
+                        f"Not enough keys in stock. Only {available_keys} available.",
+                        ephemeral=True
+                    )
                 return
             
-            await process_purchase(interaction, product_id_full, variant_info, quantity)
+            await process_purchase(interaction, product_id_full, variant_info, quantity, hold_id=hold_id,
+                                   idempotency_key=idempotency_key)
             
         except (ValueError, AttributeError) as e:
+            reservations.release(self.hold_id)
             await interaction.response.send_message("Please enter a valid number.", ephemeral=True)
-            print(f"Error in product selection: {e}")
+            interaction_log.info("Invalid quantity in product selection: %s", e, extra=log_fields(interaction))
             return
+    
+    async def on_timeout(self):
+        reservations.release(self.hold_id)
+
+# --- Persistent Views ---
+def record_panel(message: discord.Message, panel_type: str, product: str = None):
+    """Remember a posted panel so its view can be reattached after a restart."""
+    database.setdefault('panels', {})[str(message.id)] = {
+        'type': panel_type,
+        'channel_id': str(message.channel.id),
+        'product': product
+    }
+    save_database(database)
+
+def rehydrate_persistent_views():
+    """Reattach every persistent view in one pass, without fetching any messages.
+
+    Views registered by custom_id cover every ticket channel and /gen menu; panels
+    recorded in the database are also bound to their message ids.
+    """
+    bot.add_view(TicketPanelView())
+    bot.add_view(TicketView())
+    for product_id in catalog.categories:
+        bot.add_view(VariantSelectView(product_id, persistent=True))
+    
+    panels = database.get('panels', {})
+    for message_id, panel in list(panels.items()):
+        if panel['type'] == 'ticket':
+            bot.add_view(TicketPanelView(), message_id=int(message_id))
+        elif panel['type'] == 'gen' and panel['product'] in catalog.variants:
+            bot.add_view(VariantSelectView(panel['product'], persistent=True), message_id=int(message_id))
+        else:
+            # The product behind this panel is gone, so there is nothing to attach
+            del panels[message_id]
+    log.info("Rehydrated %d panel(s)", len(panels))
+
+@bot.tree.command(name="genpanel", description="Post a public purchase menu for a product")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.autocomplete(product=category_autocomplete)
+async def genpanel(interaction: discord.Interaction, product: str):
+    """Post a persistent /gen menu that keeps working across restarts"""
+    if product not in catalog.categories:
+        await interaction.response.send_message("❌ Unknown product.", ephemeral=True)
+        return
+    
+    name, info = catalog.categories[product]
+    embed = discord.Embed(
+        title=f"{info['emoji']} {name}",
+        description="Pick a duration below to buy keys with your credits.",
+        color=0x3498db
+    )
+    await interaction.response.send_message(embed=embed, view=VariantSelectView(product, persistent=True))
+    message = await interaction.original_response()
+    record_panel(message, 'gen', product)
+
+# --- Orders ---
+INLINE_KEY_LIMIT = 10  # More keys than this are delivered as a file instead of inside an embed
+INLINE_KEY_CHARS = 3500  # Stay well below Discord's 4096 character embed description limit
+INLINE_KEY_FIELD_CHARS = 1000  # One embed field holds at most 1024 characters
+
+def take_keys(product_id: str, quantity: int) -> list:
+    """Remove and return the first `quantity` keys of a product in one slice.
+
+    Generated products mint a fresh batch of signed keys instead, and products kept
+    in a key file advance its head cursor.
+    """
+    if is_generated_product(product_id):
+        return generate_license_keys(product_id, quantity)
+    if uses_key_file(product_id):
+        keys = partitions.current().key_file(product_id).take(quantity)
+    else:
+        stock = database['products'][product_id]['keys']
+        keys = stock[:quantity]
+        del stock[:quantity]
+    publish_event('stock.removed', product_id=product_id, quantity=len(keys), in_stock=stock_level(product_id))
+    return keys
+
+def keys_need_attachment(items: list) -> bool:
+    """Whether an order's keys are too many or too long to show inside embeds."""
+    keys = [key for item in items for key in item['keys']]
+    return len(keys) > INLINE_KEY_LIMIT or sum(len(key) + 2 for key in keys) > INLINE_KEY_CHARS
+
+def split_keys(text: str) -> list:
+    """The keys in a newline-joined key string, as saved on orders and legacy key entries."""
+    return [line for line in text.split("\n") if line]
+
+def order_key_items(order: dict) -> list:
+    """An order's items, including orders saved before items were recorded."""
+    return order.get('items') or [{
+        'product_id': order.get('product_id'),
+        'product_name': order.get('product_name'),
+        'keys': split_keys(order.get('key', '')),
+        'expires': order.get('expires')
+    }]
+
+def make_key_file(order_id: str, items: list, prefix: str = 'order') -> discord.File:
+    """Render an order's keys into an in-memory attachment.
+
+    Single-product orders get a plain one-key-per-line .txt; multi-product orders
+    get a .csv so each key keeps its product and expiry. A discord.File can only be
+    sent once, so call this again for every send.
+    """
+    if len(items) == 1:
+        content = "\n".join(items[0]['keys']) + "\n"
+        filename = f"{prefix}-{order_id}.txt"
+    else:
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(['product_id', 'product_name', 'key', 'expires'])
+        for item in items:
+            for key in item['keys']:
+                writer.writerow([item['product_id'], item['product_name'], key, item['expires']])
+        content = text.getvalue()
+        filename = f"{prefix}-{order_id}.csv"
+    return discord.File(io.BytesIO(content.encode('utf-8')), filename=filename)
+
+def calculate_discounted_price(base_price: int, discount_percentage: int) -> int:
+    """Apply a percentage discount, rounding up to a whole credit."""
+    return math.ceil(base_price * (1 - discount_percentage / 100))
+
+def generate_order_id():
+    """Create an 8 character order ID that isn't already in use."""
+    while True:
+        order_id = ''.join(random.choices('0123456789ABCDEF', k=8))
+        if order_id not in database.get('orders', {}):
+            return order_id
+
+def record_order(user, items: list) -> str:
+    """Store a single order record covering every line item of a purchase.
+
+    The flat product/key/price/expires fields keep the shape /myorders and /order
+    already read; `items` holds the per-line detail for multi-product orders. The
+    order and its buyer are added to the autocomplete indexes as part of the sale.
+    """
+    if 'orders' not in database:
+        database['orders'] = {}
+    
+    order_id = generate_order_id()
+    if len(items) == 1:
+        product_id = items[0]['product_id']
+        product_name = items[0]['product_name']
+    else:
+        product_id = 'cart'
+        product_name = ", ".join(f"{item['product_name']} ×{item['quantity']}" for item in items)
+    
+    database['orders'][order_id] = {
+        'user_id': str(user.id),
+        'product_id': product_id,
+        'product_name': product_name,
+        'key': "\n".join(key for item in items for key in item['keys']),
+        'price': sum(item['unit_price'] * item['quantity'] for item in items),
+        'date': datetime.utcnow().isoformat(),
+        'expires': max(item['expires'] for item in items),
+        'items': items
+    }
+    order_index.add(user.id, order_id)
+    remember_customer(user)
+    publish_event('order.created', order_id=order_id, **database['orders'][order_id])
+    return order_id
 
 # Process purchase function
-async def process_purchase(interaction: discord.Interaction, product_id: str, variant_info: dict, quantity: int = 1):
-    """Process the purchase of a product"""
+@traced('process_purchase')
+async def process_purchase(interaction: discord.Interaction, product_id: str, variant_info: dict, quantity: int = 1,
+                           hold_id: str = None, idempotency_key=None):
+    """Process the purchase of a product
+
+    If `hold_id` refers to a live stock reservation, the held keys are converted into
+    the sale; otherwise the keys are checked against whatever isn't held by others.
+    If `idempotency_key` was claimed by the caller, it is completed with the outcome
+    once the sale is saved, or discarded if the purchase didn't go through.
+    """
+    purchase_result = None
+    order_id = None
+    started = time.perf_counter()
+    
     # Defer the response immediately to prevent timeout
     if not interaction.response.is_done():
-        await interaction.response.defer(ephemeral=True)
+        with span('defer'):
+            await interaction.response.defer(ephemeral=True)
     
     try:
         # Get user data and check if they have enough credits
-        user_data = get_user_data(interaction.user.id)
+        with span('get_user_data'):
+            user_data = get_user_data(interaction.user.id)
         
         # Calculate final price with discount
         base_price = variant_info['price']
         discount_percentage = user_data.get('discount', 0)
-        final_price = math.ceil(base_price * (1 - discount_percentage / 100))
+        final_price = calculate_discounted_price(base_price, discount_percentage)
         
         if user_data['credits'] < final_price:
             await interaction.followup.send(
@@ -866,13 +2658,14 @@ async def process_purchase(interaction: discord.Interaction, product_id: str, va
             )
             return
         
-        # Check if product has available keys
-        if not database['products'].get(product_id, {}).get('keys'):
+        # Check if product has available keys (our own hold counts as available)
+        with span('check_stock'):
+            available_keys = reservations.available(product_id, interaction.user.id, 'purchase')
+        if not available_keys:
             await interaction.followup.send("❌ This product is currently out of stock.", ephemeral=True)
             return
         
         # Check if we have enough keys in stock
-        available_keys = len(database['products'][product_id]['keys'])
         if available_keys < quantity:
             await interaction.followup.send(
                 f"❌ Not enough keys in stock. Only {available_keys} available.",
@@ -893,13 +2686,14 @@ async def process_purchase(interaction: discord.Interaction, product_id: str, va
             )
             return
         
-        # Get and remove keys from database
-        keys = [database['products'][product_id]['keys'].pop(0) for _ in range(quantity)]
+        # Convert the hold into the sale, then get and remove keys from database
+        with span('take_keys'):
+            if hold_id:
+                reservations.commit(hold_id)
+            keys = take_keys(product_id, quantity)
         
-        # Update user's credits and purchase history
-        user_data['credits'] -= total_price
-        user_data['total_spent'] += total_price
-        user_data['keys_generated'] = user_data.get('keys_generated', 0) + quantity
+        # Update user's purchase history, leaderboards and discount tier
+        record_sale(interaction.user.id, user_data, total_price, quantity)
         
         # Add to user's keys
         if 'keys' not in user_data:
@@ -909,18 +2703,37 @@ async def process_purchase(interaction: discord.Interaction, product_id: str, va
         expiry_days = variant_info.get('duration', 1)
         expiry_date = (datetime.utcnow() + timedelta(days=expiry_days)).strftime('%Y-%m-%d %H:%M:%S')
         
+        # Record the order so it lands in the same write as the sale
+        order_items = [{
+            'product_id': product_id,
+            'product_name': product_display_name(product_id),
+            'quantity': quantity,
+            'unit_price': final_price,
+            'keys': keys,
+            'expires': expiry_date
+        }]
+        with span('record_order'):
+            order_id = record_order(interaction.user, order_items)
+            adjust_credits(interaction.user.id, user_data, -total_price, 'purchase', reference=order_id)
+        purchase_result = f"✅ Order #{order_id} was already completed. Check your DMs for the key."
+        
         for key in keys:
-            user_data['keys'].append({
+            key_entry = {
                 'key': key,
                 'product': product_id,
                 'purchase_date': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                'expires': expiry_date
-            })
-        
-        save_database(database)
+                'expires': expiry_date,
+                'order_id': order_id
+            }
+            user_data['keys'].append(key_entry)
+            license_index.add(interaction.user.id, key_entry)
         
-        # Create order ID (6 character alphanumeric)
-        order_id = ''.join(random.choices('0123456789ABCDEF', k=8))
+        with span('save_database'):
+            save_database(database)
+        order_log.info("Purchase completed", extra=log_fields(
+            interaction, order_id=order_id, product_id=product_id, quantity=quantity, price=total_price,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1)
+        ))
         
         # First embed - Order Confirmation - Yellow color (0xFFFF00)
         order_embed = discord.Embed(
@@ -981,27 +2794,46 @@ async def process_purchase(interaction: discord.Interaction, product_id: str, va
             color=0xFFFF00  # Yellow color
         )
         
-        # Add keys information
-        key_embed.description = f"```\n" + "\n\n".join(keys) + "\n```"
+        # Add keys information (large orders go out as an attachment instead)
+        attach_keys = keys_need_attachment(order_items)
+        if attach_keys:
+            key_embed.description = f"Your {quantity} keys are attached to this message."
+        else:
+            key_embed.description = f"```\n" + "\n\n".join(keys) + "\n```"
         
         # Store both embeds in a list
         embeds = [order_embed, key_embed]
         
         # First try to send a DM to the user
         try:
-            dm_channel = await interaction.user.create_dm()
-            await dm_channel.send(embeds=embeds)
+            with span('create_dm'):
+                dm_channel = await interaction.user.create_dm()
+            with span('dm_send'):
+                if attach_keys:
+                    await dm_channel.send(embeds=embeds, file=make_key_file(order_id, order_items))
+                else:
+                    await dm_channel.send(embeds=embeds)
             dm_success = True
-            await interaction.followup.send("✅ Your purchase was successful! Check your DMs for the key.", ephemeral=True)
+            with span('followup'):
+                await interaction.followup.send("✅ Your purchase was successful! Check your DMs for the key.", ephemeral=True)
         except Exception as dm_error:
-            print(f"Error sending DM: {dm_error}")
+            order_log.warning("Error sending DM: %s", dm_error, extra=log_fields(interaction, order_id=order_id))
             dm_success = False
             # If DM fails, send in the channel
-            await interaction.followup.send(
-                "I couldn't send you a DM. Here's your purchase:",
-                embeds=embeds,
-                ephemeral=True
-            )
+            with span('followup_with_keys'):
+                if attach_keys:
+                    await interaction.followup.send(
+                        "I couldn't send you a DM. Here's your purchase:",
+                        embeds=embeds,
+                        file=make_key_file(order_id, order_items),
+                        ephemeral=True
+                    )
+                else:
+                    await interaction.followup.send(
+                        "I couldn't send you a DM. Here's your purchase:",
+                        embeds=embeds,
+                        ephemeral=True
+                    )
         
         # Send public order confirmation in the ticket channel (without the keys)
         try:
@@ -1019,11 +2851,14 @@ async def process_purchase(interaction: discord.Interaction, product_id: str, va
                         inline=False
                     )
                 
-                await interaction.channel.send(embed=public_embed)
+                with span('ticket_confirmation'):
+                    await interaction.channel.send(embed=public_embed)
         except Exception as e:
-            print(f"Error sending public order confirmation: {e}")
-    except Exception as e:
-        print(f"Unexpected error in process_purchase: {e}")
+            order_log.warning("Error sending public order confirmation: %s", e, extra=log_fields(interaction, order_id=order_id))
+    except Exception:
+        order_log.exception("Unexpected error in process_purchase", extra=log_fields(
+            interaction, order_id=order_id, product_id=product_id, quantity=quantity
+        ))
         try:
             await interaction.followup.send(
                 "❌ An error occurred while processing your purchase. Please contact support.",
@@ -1035,6 +2870,15 @@ async def process_purchase(interaction: discord.Interaction, product_id: str, va
                 await interaction.channel.send("❌ An error occurred. Please try again or contact support.", delete_after=10)
             except:
                 pass
+    finally:
+        # Give back any hold that wasn't converted into a sale
+        if hold_id:
+            reservations.release(hold_id)
+        if idempotency_key:
+            if purchase_result:
+                purchase_idempotency.complete(idempotency_key, purchase_result)
+            else:
+                purchase_idempotency.discard(idempotency_key)
 
 async def send_order_embeds(interaction: discord.Interaction, order_id: str, product_id: str, variant_info: dict,
                            key_to_sell: str, expiry_date: str, discounted_cost: int, discount_percentage: int):
@@ -1044,7 +2888,7 @@ async def send_order_embeds(interaction: discord.Interaction, order_id: str, pro
         if not interaction.response.is_done():
             await interaction.response.defer(ephemeral=True, thinking=False)
         
-        product_name = database['products'][product_id]['name']
+        product_name = product_display_name(product_id)
         
         # First embed - Order Confirmation
         order_embed = discord.Embed(
@@ -1114,58 +2958,580 @@ async def send_order_embeds(interaction: discord.Interaction, order_id: str, pro
             "I couldn't send you a DM. Please check your privacy settings and try again.",
             ephemeral=True
         )
-    except Exception as e:
-        print(f"Error in send_order_embeds: {e}")
+    except Exception:
+        order_log.exception("Error in send_order_embeds", extra=log_fields(interaction, order_id=order_id))
         await interaction.followup.send(
             "An error occurred while processing your order. Please try again.",
             ephemeral=True
         )
 
+# --- Leaderboards ---
+LEADERBOARD_WINDOWS = {'all': None, '30d': 30, '7d': 7}  # Window name -> days, None for all-time
+LEADERBOARD_METRICS = {'spent': "credits spent", 'keys': "keys bought"}
+LEADERBOARD_SIZE = 10
+
+class RankedScores:
+    """Scores kept in rank order as (-score, user_id) pairs, so top-N is a slice and a rank is a bisect.
+
+    Changing a score moves one entry instead of re-sorting everyone.
+    """
+
+    def __init__(self, scores: dict = None):
+        self.scores = {user_id: score for user_id, score in (scores or {}).items() if score}  # user_id -> score
+        self.ranked = sorted((-score, user_id) for user_id, score in self.scores.items())  # (-score, user_id), best first
+
+    def set(self, user_id: str, score: int):
+        old_score = self.scores.get(user_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            del self.ranked[bisect.bisect_left(self.ranked, (-old_score, user_id))]
+        if score:
+            self.scores[user_id] = score
+            bisect.insort(self.ranked, (-score, user_id))
+        else:
+            self.scores.pop(user_id, None)
+
+    def add(self, user_id: str, delta: int):
+        self.set(user_id, self.scores.get(user_id, 0) + delta)
+
+    def top(self, limit: int = LEADERBOARD_SIZE) -> list:
+        return [(user_id, -negative_score) for negative_score, user_id in self.ranked[:limit]]
+
+    def rank(self, user_id: str):
+        """1-based rank, or None for users without a score."""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.ranked, (-score, user_id)) + 1
+
+class Leaderboards:
+    """Top spenders and top volume over all-time and sliding windows, updated on every sale.
+
+    All-time scores mirror users[*].total_spent and keys_generated. Windowed scores
+    are sums over the orders inside the window: each sale is appended to a deque per
+    window and subtracted again once it ages out, which happens lazily whenever a
+    board is read or written.
+    """
+
+    def __init__(self):
+        self.boards = {(window, metric): RankedScores() for window in LEADERBOARD_WINDOWS for metric in LEADERBOARD_METRICS}
+        self.recent = {window: deque() for window, days in LEADERBOARD_WINDOWS.items() if days}  # (date, user_id, spent, keys)
+
+    def rebuild(self, data: dict):
+        users = data.get('users', {})
+        self.boards = {
+            ('all', 'spent'): RankedScores({user_id: user_data.get('total_spent', 0) for user_id, user_data in users.items()}),
+            ('all', 'keys'): RankedScores({user_id: user_data.get('keys_generated', 0) for user_id, user_data in users.items()})
+        }
+        
+        now = datetime.utcnow()
+        oldest = now - timedelta(days=max(days for days in LEADERBOARD_WINDOWS.values() if days))
+        sales = []
+        for order in data.get('orders', {}).values():
+            date = parse_expiry(order.get('date'))
+            if date is None or date < oldest:
+                continue
+            if 'items' in order:
+                quantity = sum(item['quantity'] for item in order['items'])
+            else:
+                quantity = len(order.get('key', '').split("\n"))
+            sales.append((date, order['user_id'], order.get('price', 0), quantity))
+        sales.sort()
+        
+        # Sum each window once and sort its board once, rather than inserting sale by sale
+        for window, events in self.recent.items():
+            cutoff = now - timedelta(days=LEADERBOARD_WINDOWS[window])
+            events.clear()
+            events.extend(sale for sale in sales if sale[0] >= cutoff)
+            totals = {metric: Counter() for metric in LEADERBOARD_METRICS}
+            for _, user_id, spent, keys in events:
+                totals['spent'][user_id] += spent
+                totals['keys'][user_id] += keys
+            for metric, scores in totals.items():
+                self.boards[window, metric] = RankedScores(scores)
+
+    def _add_recent(self, date: datetime, user_id: str, spent: int, keys: int):
+        for window, events in self.recent.items():
+            events.append((date, user_id, spent, keys))
+            self.boards[window, 'spent'].add(user_id, spent)
+            self.boards[window, 'keys'].add(user_id, keys)
+
+    def _expire(self):
+        now = datetime.utcnow()
+        for window, events in self.recent.items():
+            cutoff = now - timedelta(days=LEADERBOARD_WINDOWS[window])
+            while events and events[0][0] < cutoff:
+                _, user_id, spent, keys = events.popleft()
+                self.boards[window, 'spent'].add(user_id, -spent)
+                self.boards[window, 'keys'].add(user_id, -keys)
+
+    def record(self, user_id, user_data: dict, spent: int, keys: int):
+        """Count a sale that has already been added to the user's totals."""
+        user_id = str(user_id)
+        self.boards['all', 'spent'].set(user_id, user_data['total_spent'])
+        self.boards['all', 'keys'].set(user_id, user_data['keys_generated'])
+        self._add_recent(datetime.utcnow(), user_id, spent, keys)
+        self._expire()
+
+    def top(self, window: str, metric: str, limit: int = LEADERBOARD_SIZE) -> list:
+        self._expire()
+        return self.boards[window, metric].top(limit)
+
+    def rank(self, window: str, metric: str, user_id):
+        self._expire()
+        board = self.boards[window, metric]
+        user_id = str(user_id)
+        return board.rank(user_id), board.scores.get(user_id, 0)
+
+def discount_tier(total_spent: int):
+    """The (spend threshold, percentage) tier a lifetime spend qualifies for, or None."""
+    tiers = database.get('discount_tiers', [])
+    position = bisect.bisect_right(tiers, [total_spent, math.inf])
+    return tiers[position - 1] if position else None
+
+def record_sale(user_id, user_data: dict, spent: int, keys: int):
+    """Add a sale to the buyer's totals and the leaderboards, and raise their discount if they reached a tier.
+
+    Tiers only ever raise a discount, so a larger one set with /setdiscount is kept.
+    """
+    user_data['total_spent'] += spent
+    user_data['keys_generated'] = user_data.get('keys_generated', 0) + keys
+    leaderboards.record(user_id, user_data, spent, keys)
+    
+    tier = discount_tier(user_data['total_spent'])
+    if tier and tier[1] > user_data.get('discount', 0):
+        user_data['discount'] = tier[1]
+        order_log.info("Discount tier reached", extra=log_fields(
+            user_id=str(user_id), total_spent=user_data['total_spent'], discount=tier[1]
+        ))
+
+@bot.tree.command(name="leaderboard", description="Show the top resellers by spend or volume.")
+@admission_controlled('history')
+@app_commands.describe(window="Time period to rank", metric="What to rank by")
+@app_commands.choices(
+    window=[Choice(name="All time", value='all'), Choice(name="Last 30 days", value='30d'), Choice(name="Last 7 days", value='7d')],
+    metric=[Choice(name=name.capitalize(), value=metric) for metric, name in LEADERBOARD_METRICS.items()]
+)
+async def leaderboard(interaction: discord.Interaction, window: app_commands.Choice[str] = None,
+                      metric: app_commands.Choice[str] = None):
+    """Show the top resellers and where the caller ranks"""
+    window = window.value if window else 'all'
+    metric = metric.value if metric else 'spent'
+    
+    lines = [
+        f"**{position}.** {customer_index.names.get(user_id) or f'<@{user_id}>'} - {score} {LEADERBOARD_METRICS[metric]}"
+        for position, (user_id, score) in enumerate(leaderboards.top(window, metric), start=1)
+    ]
+    embed = discord.Embed(
+        title=f"🏆 Top Resellers - {'All Time' if window == 'all' else f'Last {LEADERBOARD_WINDOWS[window]} Days'}",
+        description="\n".join(lines) if lines else "No sales yet.",
+        color=0xf1c40f
+    )
+    rank, score = leaderboards.rank(window, metric, interaction.user.id)
+    embed.set_footer(text=f"Your rank: #{rank} with {score} {LEADERBOARD_METRICS[metric]}" if rank else "You're not ranked yet.")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="setdiscounttier", description="Automatically give a discount once a user has spent enough.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    spend="Lifetime credits spent to reach the tier",
+    percentage="The tier's discount percentage (1-100), or 0 to remove the tier"
+)
+async def setdiscounttier(interaction: discord.Interaction, spend: int, percentage: int):
+    """Add, change or remove an automatic discount tier"""
+    if spend < 1 or not 0 <= percentage <= 100:
+        await interaction.response.send_message("Spend must be positive and the percentage between 0 and 100.", ephemeral=True)
+        return
+    
+    tiers = [tier for tier in database.get('discount_tiers', []) if tier[0] != spend]
+    if percentage:
+        bisect.insort(tiers, [spend, percentage])
+    database['discount_tiers'] = tiers
+    save_database(database)
+    
+    shown = "\n".join(f"{threshold}+ credits spent: {tier_percentage}%" for threshold, tier_percentage in tiers)
+    await interaction.response.send_message(
+        f"✅ Discount tiers, applied at each purchase:\n```\n{shown}\n```" if tiers else "✅ No discount tiers are set.",
+        ephemeral=True
+    )
+
+# --- Cart ---
+CART_MAX_ITEMS = 9  # One embed per line plus the order summary must fit in a single DM
+CART_HOLD_TTL_SECONDS = 30 * 60  # Cart lines keep their keys this long after the cart was last used
+
+cart_group = app_commands.Group(name="cart", description="Stage several products and check out in one order")
+
+async def cart_variant_autocomplete(interaction: discord.Interaction, current: str):
+    """Suggest variants for the category picked in the `product` option."""
+    category = interaction.namespace.product
+    variants = catalog.variants.get(category, {})
+    return [
+        Choice(name=f"{info['name']} - {info['price']} credits", value=variant_id)
+        for variant_id, info in variants.items()
+        if current.lower() in info['name'].lower() or current.lower() in variant_id
+    ][:25]
+
+def refresh_cart_holds(user_id, cart: list) -> list:
+    """Restart the TTL of every line's hold, re-holding lines whose hold expired.
+
+    Returns the lines that couldn't be held again because the stock is gone; they
+    stay in the cart with no hold and are checked against stock at checkout.
+    """
+    unheld = []
+    for line in cart:
+        if reservations.refresh(line['hold_id']):
+            continue
+        line['hold_id'] = reservations.reserve(user_id, line['product_id'], line['quantity'],
+                                               source='cart', ttl=CART_HOLD_TTL_SECONDS)
+        if line['hold_id'] is None:
+            unheld.append(line)
+    return unheld
+
+def cart_unheld_warning(unheld: list) -> str:
+    """A note for the user about cart lines that are no longer held, or '' if all are."""
+    if not unheld:
+        return ""
+    names = ", ".join(product_display_name(line['product_id']) for line in unheld)
+    return f"\n⚠️ No longer held, the stock ran out: {names}. Checkout will only succeed if stock comes back."
+
+@cart_group.command(name="add", description="Add a product to your cart")
+@app_commands.describe(product="The product to add", variant="The duration to add", quantity="How many keys")
+@app_commands.autocomplete(product=category_autocomplete, variant=cart_variant_autocomplete)
+@admission_controlled('menus')
+async def cart_add(interaction: discord.Interaction, product: str, variant: str, quantity: int = 1):
+    """Stage a line item, holding its keys until checkout"""
+    # The price is locked in when the item is added, even if the catalog reloads before checkout
+    variant_info = catalog.variants.get(product, {}).get(variant)
+    if variant_info is None:
+        return await interaction.response.send_message("❌ Unknown product or duration.", ephemeral=True)
+    
+    cart = carts.setdefault(interaction.user.id, [])
+    product_id_full = f"{product}_{variant}"
+    line = next((item for item in cart if item['product_id'] == product_id_full), None)
+    
+    if line is None and len(cart) >= CART_MAX_ITEMS:
+        return await interaction.response.send_message(
+            f"❌ Your cart can hold at most {CART_MAX_ITEMS} different products.",
+            ephemeral=True
+        )
+    
+    new_quantity = quantity + (line['quantity'] if line else 0)
+    max_quantity = get_quantity_limit(interaction.user)
+    if quantity < 1 or new_quantity > max_quantity:
+        return await interaction.response.send_message(
+            f"Please keep each product between 1 and {max_quantity} keys.",
+            ephemeral=True
+        )
+    
+    # Touching the cart keeps the rest of it held too
+    unheld = refresh_cart_holds(interaction.user.id, [item for item in cart if item is not line])
+    
+    # Grow an existing line's hold in place, so a failed add leaves it untouched
+    if line and reservations.get(line['hold_id']):
+        hold_id = line['hold_id'] if reservations.resize(line['hold_id'], new_quantity) else None
+    else:
+        hold_id = reservations.reserve(interaction.user.id, product_id_full, new_quantity,
+                                       source='cart', ttl=CART_HOLD_TTL_SECONDS)
+    if hold_id is None:
+        if line and not reservations.get(line['hold_id']):
+            unheld += refresh_cart_holds(interaction.user.id, [line])
+        available_keys = reservations.available(product_id_full, interaction.user.id, 'cart')
+        return await interaction.response.send_message(
+            f"❌ Not enough keys in stock. Only {available_keys} available." + cart_unheld_warning(unheld),
+            ephemeral=True
+        )
+    
+    if line:
+        line['quantity'] = new_quantity
+        line['hold_id'] = hold_id
+    else:
+        cart.append({
+            'category': product,
+            'variant': variant,
+            'variant_info': variant_info,
+            'product_id': product_id_full,
+            'quantity': quantity,
+            'hold_id': hold_id
+        })
+    
+    await interaction.response.send_message(
+        f"🛒 Added {quantity} × {catalog.categories[product][0]} ({variant_info['name']}) to your cart. "
+        "Use `/cart checkout` when you're done." + cart_unheld_warning(unheld),
+        ephemeral=True
+    )
+
+def price_cart(user_data: dict, cart: list):
+    """Price every line of a cart with the user's discount. Returns (lines, total)."""
+    discount_percentage = user_data.get('discount', 0)
+    lines = []
+    for item in cart:
+        variant_info = item['variant_info']
+        unit_price = calculate_discounted_price(variant_info['price'], discount_percentage)
+        lines.append((item, variant_info, unit_price))
+    return lines, sum(unit_price * item['quantity'] for item, _, unit_price in lines)
+
+@cart_group.command(name="view", description="Show the products in your cart")
+async def cart_view(interaction: discord.Interaction):
+    cart = carts.get(interaction.user.id)
+    if not cart:
+        return await interaction.response.send_message("Your cart is empty. Use `/cart add` to add products.", ephemeral=True)
+    
+    user_data = get_user_data(interaction.user.id)
+    lines, total = price_cart(user_data, cart)
+    unheld = refresh_cart_holds(interaction.user.id, cart)
+    
+    embed = discord.Embed(title="🛒 Your Cart", color=0x3498db)
+    for number, (item, variant_info, unit_price) in enumerate(lines, start=1):
+        embed.add_field(
+            name=f"{number}. {product_display_name(item['product_id'])}",
+            value=f"{item['quantity']} × {unit_price} credits" + (" • ⚠️ no longer held" if item in unheld else ""),
+            inline=False
+        )
+    embed.add_field(name="Total", value=f"**{total} credits** (balance: {user_data['credits']})", inline=False)
+    if user_data.get('discount', 0) > 0:
+        embed.set_footer(text=f"Prices include your {user_data['discount']}% discount")
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@cart_group.command(name="remove", description="Remove a product from your cart")
+@app_commands.describe(item="The line number shown in /cart view")
+async def cart_remove(interaction: discord.Interaction, item: int):
+    cart = carts.get(interaction.user.id, [])
+    if not 1 <= item <= len(cart):
+        return await interaction.response.send_message("❌ There is no such item in your cart.", ephemeral=True)
+    
+    line = cart.pop(item - 1)
+    reservations.release(line['hold_id'])
+    unheld = refresh_cart_holds(interaction.user.id, cart)
+    await interaction.response.send_message("✅ Removed the item from your cart." + cart_unheld_warning(unheld), ephemeral=True)
+
+@cart_group.command(name="clear", description="Empty your cart")
+async def cart_clear(interaction: discord.Interaction):
+    for line in carts.pop(interaction.user.id, []):
+        reservations.release(line['hold_id'])
+    await interaction.response.send_message("✅ Your cart is now empty.", ephemeral=True)
+
+@cart_group.command(name="checkout", description="Buy everything in your cart as one order")
+@admission_controlled('purchase')
+async def cart_checkout(interaction: discord.Interaction):
+    """Validate, charge and deliver every line of the cart in one go"""
+    started = time.perf_counter()
+    await interaction.response.defer(ephemeral=True)
+    
+    # Read the cart only after deferring: from here to the save nothing awaits, so a
+    # duplicate checkout that was waiting on its own defer finds the cart already gone
+    cart = carts.get(interaction.user.id)
+    if not cart:
+        return await interaction.followup.send("Your cart is empty. Use `/cart add` to add products.", ephemeral=True)
+    
+    user_data = get_user_data(interaction.user.id)
+    lines, total_price = price_cart(user_data, cart)
+    refresh_cart_holds(interaction.user.id, cart)
+    
+    # Validate every line before touching anything so the order commits all-or-nothing
+    for item, variant_info, _ in lines:
+        available_keys = reservations.available(item['product_id'], interaction.user.id, 'cart')
+        if available_keys < item['quantity']:
+            return await interaction.followup.send(
+                f"❌ Not enough keys in stock for {product_display_name(item['product_id'])}. "
+                f"Only {available_keys} available.",
+                ephemeral=True
+            )
+    
+    if user_data['credits'] < total_price:
+        return await interaction.followup.send(
+            f"❌ You don't have enough credits. Your cart costs {total_price} credits.",
+            ephemeral=True
+        )
+    
+    # Commit: no awaits from here until the single save, so nothing can interleave
+    purchase_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    items = []
+    for item, variant_info, unit_price in lines:
+        reservations.commit(item['hold_id'])
+        keys = take_keys(item['product_id'], item['quantity'])
+        items.append({
+            'product_id': item['product_id'],
+            'product_name': product_display_name(item['product_id']),
+            'quantity': item['quantity'],
+            'unit_price': unit_price,
+            'keys': keys,
+            'expires': (datetime.utcnow() + timedelta(days=variant_info['duration'])).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    
+    order_id = record_order(interaction.user, items)
+    quantity = sum(item['quantity'] for item in items)
+    adjust_credits(interaction.user.id, user_data, -total_price, 'purchase', reference=order_id)
+    record_sale(interaction.user.id, user_data, total_price, quantity)
+    for item in items:
+        for key in item['keys']:
+            key_entry = {
+                'key': key,
+                'product': item['product_id'],
+                'purchase_date': purchase_date,
+                'expires': item['expires'],
+                'order_id': order_id
+            }
+            user_data['keys'].append(key_entry)
+            license_index.add(interaction.user.id, key_entry)
+    save_database(database)
+    order_log.info("Cart checkout completed", extra=log_fields(
+        interaction, order_id=order_id, lines=len(items), quantity=quantity, price=total_price,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1)
+    ))
+    del carts[interaction.user.id]
+    
+    # One DM with the order summary and one key embed per line
+    order_embed = discord.Embed(
+        title=f"Order Confirmation - {order_id}",
+        color=0xFFFF00,
+        timestamp=datetime.utcnow()
+    )
+    order_embed.set_thumbnail(url=interaction.user.display_avatar.url)
+    order_embed.add_field(name=f"This order was made by {interaction.user.mention}", value="", inline=False)
+    order_embed.add_field(name="Order ID", value=f"```\n{order_id}\n```", inline=False)
+    order_embed.add_field(
+        name="Products",
+        value="```\n" + "\n".join(f"{item['product_name']}: {item['quantity']}" for item in items) + "\n```",
+        inline=False
+    )
+    order_embed.add_field(
+        name="Amount Paid",
+        value="```\n" + "\n".join(
+            f"{item['quantity']} × {item['unit_price']} credits" for item in items
+        ) + f"\nTotal: {total_price} credits\n```",
+        inline=False
+    )
+    order_embed.add_field(name="Source", value="```\nBot (Cart)\n```", inline=False)
+    
+    embeds = [order_embed]
+    attach_keys = keys_need_attachment(items)
+    if attach_keys:
+        order_embed.add_field(name="Keys", value=f"Your {quantity} keys are attached to this message.", inline=False)
+    else:
+        for item in items:
+            key_embed = discord.Embed(
+                title=f"{item['product_name']} - {item['quantity']} Key{'s' if item['quantity'] > 1 else ''}",
+                color=0xFFFF00
+            )
+            key_embed.description = "```\n" + "\n\n".join(item['keys']) + "\n```"
+            embeds.append(key_embed)
+    
+    try:
+        if attach_keys:
+            await interaction.user.send(embeds=embeds, file=make_key_file(order_id, items))
+        else:
+            await interaction.user.send(embeds=embeds)
+        await interaction.followup.send(
+            f"✅ Order #{order_id} successful! Check your DMs for your {quantity} key{'s' if quantity > 1 else ''}.",
+            ephemeral=True
+        )
+    except Exception as dm_error:
+        order_log.warning("Error sending DM: %s", dm_error, extra=log_fields(interaction, order_id=order_id))
+        if attach_keys:
+            await interaction.followup.send(
+                "I couldn't send you a DM. Here's your purchase:",
+                embeds=embeds,
+                file=make_key_file(order_id, items),
+                ephemeral=True
+            )
+        else:
+            await interaction.followup.send(
+                "I couldn't send you a DM. Here's your purchase:",
+                embeds=embeds,
+                ephemeral=True
+            )
+
+bot.tree.add_command(cart_group)
+
 @bot.tree.command(name="mykeys", description="View your purchased license keys in a DM.")
+@traced('mykeys')
+@admission_controlled('history')
 async def mykeys(interaction: discord.Interaction):
-    user_data = get_user_data(interaction.user.id)
+    with span('get_user_data'):
+        user_data = get_user_data(interaction.user.id)
     if not user_data['keys']:
         return await interaction.response.send_message("You haven't purchased any products yet.", ephemeral=True)
     
-    await interaction.response.defer(ephemeral=True)
+    with span('defer'):
+        await interaction.response.defer(ephemeral=True)
 
     embed = discord.Embed(title="Your License Keys", color=0x9b59b6)
     
+    # Group the keys like order items, so a long list can go out as the same attachment a purchase uses
+    items = []
     for key_info in user_data['keys']:
-        product_name = database['products'].get(key_info['product'], {}).get('name', 'Unknown Product')
-        embed.add_field(
-            name=product_name,
-            value=f"Key: `{key_info['key']}`\nExpires: {key_info['expires']}",
-            inline=False
-        )
+        if items and (items[-1]['product_id'], items[-1]['expires']) == (key_info['product'], key_info['expires']):
+            items[-1]['keys'].extend(split_keys(key_info['key']))
+        else:
+            items.append({
+                'product_id': key_info['product'],
+                'product_name': product_display_name(key_info['product']),
+                'keys': split_keys(key_info['key']),
+                'expires': key_info['expires']
+            })
+    
+    attach_keys = keys_need_attachment(items) or any(len(key_info['key']) > INLINE_KEY_FIELD_CHARS for key_info in user_data['keys'])
+    if attach_keys:
+        counts = Counter()
+        for item in items:
+            counts[item['product_name']] += len(item['keys'])
+        embed.description = f"You have {len(user_data['keys'])} keys. The full list is attached to this message."
+        for product_name, count in counts.most_common(25):
+            embed.add_field(name=product_name, value=f"{count} key{'s' if count != 1 else ''}", inline=True)
+    else:
+        for key_info in user_data['keys']:
+            product_name = product_display_name(key_info['product'])
+            embed.add_field(
+                name=product_name,
+                value=f"```\n{key_info['key']}\n```\nExpires: {key_info['expires']}",
+                inline=False
+            )
     
     try:
-        await interaction.user.send(embed=embed)
-        await interaction.followup.send("📨 I've sent your keys to your DMs.", ephemeral=True)
+        with span('dm_send'):
+            if attach_keys:
+                await interaction.user.send(embed=embed, file=make_key_file(interaction.user.id, items, prefix='keys'))
+            else:
+                await interaction.user.send(embed=embed)
+        with span('followup'):
+            await interaction.followup.send("📨 I've sent your keys to your DMs.", ephemeral=True)
     except discord.Forbidden:
         await interaction.followup.send("❌ I couldn't send you a DM. Please check your privacy settings and try again.", ephemeral=True)
 
 @bot.tree.command(name="myorders", description="View your order history")
-async def myorders(interaction: discord.Interaction):
+@app_commands.describe(customer="Admins only: view another customer's orders")
+@app_commands.autocomplete(customer=customer_autocomplete)
+@traced('myorders')
+@admission_controlled('history')
+async def myorders(interaction: discord.Interaction, customer: str = None):
     """View your order history with order IDs and product details."""
-    user_orders = []
     user_id = str(interaction.user.id)
+    if customer and customer != user_id:
+        if interaction.user.id not in ADMIN_USER_IDS:
+            return await interaction.response.send_message(
+                "❌ You don't have permission to view another customer's orders.",
+                ephemeral=True
+            )
+        user_id = customer
     
-    # Get all orders for this user
-    if 'orders' in database:
-        for order_id, order in database['orders'].items():
-            if order['user_id'] == user_id:
-                user_orders.append((order_id, order))
+    # The order index keeps each customer's orders oldest first, so no full scan is needed
+    with span('lookup_orders'):
+        orders = database.get('orders', {})
+        user_orders = [
+            (order_id, orders[order_id])
+            for order_id in reversed(order_index.recent_by_user.get(user_id, []))
+            if order_id in orders
+        ]
     
     if not user_orders:
         return await interaction.response.send_message(
-            "You don't have any orders yet. Use `/gen` to make a purchase.",
+            "You don't have any orders yet. Use `/gen` to make a purchase."
+            if user_id == str(interaction.user.id) else "❌ That customer has no orders.",
             ephemeral=True
         )
     
-    # Sort by date (newest first)
-    user_orders.sort(key=lambda x: x[1]['date'], reverse=True)
-    
     # Create a more compact order list
     order_list = []
     for order_id, order in user_orders:
@@ -1176,19 +3542,24 @@ async def myorders(interaction: discord.Interaction):
         )
     
     embed = discord.Embed(
-        title="Your Order History",
+        title="Your Order History" if user_id == str(interaction.user.id)
+        else f"Order History for {customer_index.names.get(user_id) or user_id}",
         description="\n".join(order_list) if order_list else "No orders found.",
         color=0x9b59b6
     )
     
     embed.set_footer(text="Use /order <order_id> to view details of a specific order")
     
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    with span('respond'):
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="order", description="View details of a specific order")
+@app_commands.describe(order_id="Start typing to pick from your orders")
+@app_commands.autocomplete(order_id=order_autocomplete)
+@admission_controlled('history')
 async def order(interaction: discord.Interaction, order_id: str):
     """View details of a specific order by ID."""
-    order_id = order_id.upper()
+    order_id = order_id.strip().upper()
     
     if 'orders' not in database or order_id not in database['orders']:
         return await interaction.response.send_message(
@@ -1205,16 +3576,24 @@ async def order(interaction: discord.Interaction, order_id: str):
             ephemeral=True
         )
     
+    # Large orders list their keys in an attachment instead of the embed
+    items = order_key_items(order_info)
+    attach_keys = keys_need_attachment(items)
+    if attach_keys:
+        key_line = f"**Keys:** {sum(len(item['keys']) for item in items)} keys, attached as a file"
+    else:
+        key_line = "**Keys:**\n```\n" + "\n\n".join(key for item in items for key in item['keys']) + "\n```"
+    
     # Create the order details message with inline code blocks
     key_message = f"""
     **Order ID:** `{order_id}` • **Product:** `{order_info['product_name']}`
     **Date:** `{datetime.fromisoformat(order_info['date']).strftime('%Y-%m-%d %H:%M')}`
     **Expires:** `{order_info['expires']}` • **Price:** `{order_info['price']} credits`
     
-    **Key:** `{order_info['key']}`
+    {key_line}
     """
     
-    embed = nextcord.Embed(
+    embed = discord.Embed(
         title=f"Order #{order_id} - {order_info['product_name']}",
         description=key_message,
         color=0x2ecc71
@@ -1226,14 +3605,1583 @@ async def order(interaction: discord.Interaction, order_id: str):
     else:
         embed.set_footer(text="Use /myorders to view all your purchases")
     
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    if attach_keys:
+        await interaction.response.send_message(embed=embed, file=make_key_file(order_id, items), ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# --- License Validation Service ---
+class BloomFilter:
+    """Compact probabilistic set used to reject unknown keys before the index lookup."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1024)
+        self.size = int(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+def parse_expiry(expires: str):
+    """Parse either stored expiry format ('%Y-%m-%d' or '%Y-%m-%d %H:%M:%S') into a datetime."""
+    try:
+        return datetime.fromisoformat(expires)
+    except (TypeError, ValueError):
+        return None
+
+KeyRecord = namedtuple('KeyRecord', ['user_id', 'order_id', 'product_id', 'purchase_date', 'expires'])
+
+class LicenseIndex:
+    """In-memory reverse index from every sold key to who owns it.
+
+    Each key maps to a list of KeyRecords (more than one if a key was ever sold
+    twice), plus a sorted key list for prefix search. Built once from users[*].keys
+    when the database loads and updated on each sale, so lookups never have to
+    scan user histories or touch the JSON file.
+    """
+
+    def __init__(self):
+        self.owners = {}
+        self.sorted_keys = []
+        self.bloom = BloomFilter(0)
+
+    def rebuild(self, *databases: dict):
+        """Index every key sold in `databases`, e.g. the default database and each guild partition's."""
+        self.owners = {}
+        for data in databases:
+            # Older sales don't store their order id on the key, so recover it from the orders
+            order_ids = {}
+            for order_id, order in data.get('orders', {}).items():
+                if 'items' in order:
+                    for item in order['items']:
+                        for key in item['keys']:
+                            order_ids[key] = order_id
+                elif order.get('key'):
+                    order_ids[order['key']] = order_id
+            
+            for user_id, user_data in data.get('users', {}).items():
+                for key_entry in user_data.get('keys', []):
+                    record = self._record(user_id, key_entry, order_ids.get(key_entry['key']))
+                    self.owners.setdefault(key_entry['key'], []).append(record)
+        self.sorted_keys = sorted(self.owners)
+        self.bloom = BloomFilter(len(self.owners) * 2)
+        for key in self.owners:
+            self.bloom.add(key)
+
+    @staticmethod
+    def _record(user_id, key_entry: dict, order_id=None) -> KeyRecord:
+        return KeyRecord(
+            str(user_id),
+            key_entry.get('order_id', order_id),
+            key_entry['product'],
+            key_entry.get('purchase_date'),
+            parse_expiry(key_entry.get('expires'))
+        )
+
+    def add(self, user_id, key_entry: dict):
+        key = key_entry['key']
+        if key not in self.owners:
+            self.owners[key] = []
+            bisect.insort(self.sorted_keys, key)
+            if self.bloom.count >= self.bloom.capacity:
+                # Keep the false positive rate down by regrowing once the filter is full
+                self.bloom = BloomFilter(len(self.owners) * 2)
+                for indexed_key in self.owners:
+                    self.bloom.add(indexed_key)
+            else:
+                self.bloom.add(key)
+        self.owners[key].append(self._record(user_id, key_entry))
+
+    def lookup(self, key: str):
+        """Every ownership record for a key, oldest sale first, or None if it was never sold."""
+        if key not in self.bloom:
+            return None
+        return self.owners.get(key)
+
+    def search_prefix(self, prefix: str, limit: int = 10) -> list:
+        """Sold keys starting with `prefix`, in sorted order."""
+        start = bisect.bisect_left(self.sorted_keys, prefix)
+        matches = []
+        for key in itertools.islice(self.sorted_keys, start, start + limit):
+            if not key.startswith(prefix):
+                break
+            matches.append(key)
+        return matches
+
+    def validate(self, key: str) -> dict:
+        """Describe a key the way the validation endpoint reports it."""
+        records = self.lookup(key)
+        if not records:
+            return {'key': key, 'valid': False, 'reason': 'unknown'}
+        record = records[-1]
+        expired = record.expires is not None and record.expires < datetime.utcnow()
+        return {
+            'key': key,
+            'valid': not expired,
+            'reason': 'expired' if expired else None,
+            'product': record.product_id,
+            'user_id': record.user_id,
+            'expires': record.expires.isoformat() if record.expires else None
+        }
+
+license_index = LicenseIndex()
+
+MAX_VALIDATION_BATCH = 1000
+
+async def handle_validate(request: web.Request):
+    """GET /validate?key=... checks one key; POST /validate {"keys": [...]} checks a batch."""
+    if request.method == 'POST':
+        try:
+            keys = (await request.json())['keys']
+        except (ValueError, KeyError, TypeError):
+            return web.json_response({'error': 'expected a JSON body like {"keys": [...]}'}, status=400)
+        if not isinstance(keys, list) or len(keys) > MAX_VALIDATION_BATCH:
+            return web.json_response({'error': f'send a list of at most {MAX_VALIDATION_BATCH} keys'}, status=400)
+        return web.json_response({'results': [license_index.validate(str(key)) for key in keys]})
+    
+    key = request.query.get('key')
+    if not key:
+        return web.json_response({'error': 'missing key parameter'}, status=400)
+    return web.json_response(license_index.validate(key))
+
+async def handle_profile(request: web.Request):
+    """Local trigger for the profiler: GET /debug/profile/{action}?seconds=N with an X-Profiling-Token header."""
+    if not hmac.compare_digest(request.headers.get('X-Profiling-Token', ''), PROFILING_TOKEN):
+        return web.json_response({'error': 'missing or wrong X-Profiling-Token'}, status=403)
+    action = request.match_info['action']
+    if action not in PROFILE_ACTIONS:
+        return web.json_response({'error': f"action must be one of {', '.join(PROFILE_ACTIONS)}"}, status=404)
+    try:
+        text, path = await profiler.run(action, float(request.query.get('seconds', 10)))
+    except ValueError:
+        return web.json_response({'error': 'seconds must be a number'}, status=400)
+    except RuntimeError as e:
+        return web.json_response({'error': str(e)}, status=409)
+    return web.Response(text=text if path is None else f"{text}\nWritten to {path}\n")
+
+def create_validation_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get('/validate', handle_validate)
+    app.router.add_post('/validate', handle_validate)
+    if PROFILING_TOKEN:
+        app.router.add_get('/debug/profile/{action}', handle_profile)
+    return app
+
+async def start_validation_server(host: str, port: int) -> web.AppRunner:
+    """Serve the validation endpoint on the running event loop."""
+    runner = web.AppRunner(create_validation_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    validation_log.info("License validation service listening on http://%s:%s/validate", host, port)
+    return runner
+
+async def run_validation_sidecar(host: str, port: int, poll_seconds: float = 5.0):
+    """Serve validation without the bot, reloading the index whenever a database file changes."""
+    global license_index
+    await start_validation_server(host, port)
+    last_mtime = None
+    while True:
+        try:
+            partitions.scan()
+            paths = partitions.database_files()
+            mtime = max(os.path.getmtime(path) for path in ('database.json', *paths))
+            if mtime != last_mtime:
+                fresh_index = LicenseIndex()
+                await asyncio.to_thread(lambda: fresh_index.rebuild(load_database(), *partitions.read_databases(paths)))
+                license_index = fresh_index
+                last_mtime = mtime
+        except (OSError, ValueError) as e:
+            validation_log.warning("Error reloading license index: %s", e)
+        await asyncio.sleep(poll_seconds)
+
+# --- Profiling ---
+PROFILE_DIR = 'profiles'
+PROFILE_TRACE_FRAMES = 10         # Stack depth tracemalloc keeps per allocation
+PROFILE_TOP = 25                  # Lines per section in a report
+CPU_SAMPLE_INTERVAL = 0.005       # Seconds between stack samples of the event loop thread
+MAX_CPU_PROFILE_SECONDS = 60
+PROFILE_ACTIONS = ('memory', 'objects', 'cpu', 'stop-tracing')
+
+def read_rss_bytes():
+    """Current resident set size from /proc, or None where that isn't available."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def format_bytes(size) -> str:
+    if size is None:
+        return "n/a"
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+class Profiler:
+    """On-demand memory and CPU diagnostics that run beside the bot without pausing it.
+
+    Heavy work (taking and comparing tracemalloc snapshots, walking the gc heap,
+    sampling stacks) happens in worker threads, so the event loop keeps serving
+    while a report is built. Each report is also written to PROFILE_DIR.
+    """
+
+    def __init__(self):
+        self.last_snapshot = None
+        self.last_snapshot_at = None
+        self.cpu_running = False
+
+    def _write(self, kind: str, text: str, extension: str = 'txt') -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{kind}-{datetime.utcnow():%Y%m%d-%H%M%S}.{extension}")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    async def run(self, action: str, seconds: float = 10) -> tuple:
+        """Run one profiling action. Returns (report text, path of the file it was written to)."""
+        if action == 'memory':
+            return await self.memory()
+        if action == 'objects':
+            return await self.objects()
+        if action == 'cpu':
+            return await self.cpu(seconds)
+        if action == 'stop-tracing':
+            tracemalloc.stop()
+            self.last_snapshot = self.last_snapshot_at = None
+            return "Stopped tracemalloc; the next memory report starts a fresh baseline.\n", None
+        raise ValueError(f"unknown profiling action {action!r}")
+
+    async def memory(self) -> tuple:
+        """Top allocation sites, plus growth since the previous snapshot."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        
+        def snapshot_report():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [
+                f"RSS: {format_bytes(read_rss_bytes())} • traced: {format_bytes(current)} (peak {format_bytes(peak)})",
+                "",
+                f"Top {PROFILE_TOP} allocation sites:"
+            ]
+            lines += [f"  {stat}" for stat in snapshot.statistics('lineno')[:PROFILE_TOP]]
+            if self.last_snapshot is None:
+                lines += ["", "First snapshot since tracing started; run again later to see what grew."]
+            else:
+                lines += ["", f"Growth since {self.last_snapshot_at:%Y-%m-%d %H:%M:%S} UTC:"]
+                lines += [f"  {stat}" for stat in snapshot.compare_to(self.last_snapshot, 'lineno')[:PROFILE_TOP]]
+            return snapshot, "\n".join(lines) + "\n"
+        
+        snapshot, text = await asyncio.to_thread(snapshot_report)
+        self.last_snapshot, self.last_snapshot_at = snapshot, datetime.utcnow()
+        return text, self._write('memory', text)
+
+    async def objects(self) -> tuple:
+        """Live object counts by type, open Views and Modals, and the size of the bot's own caches."""
+        def tally():
+            types_seen = Counter()
+            views = Counter()
+            for obj in gc.get_objects():
+                types_seen[type(obj).__qualname__] += 1
+                if isinstance(obj, (View, Modal)):
+                    views[type(obj).__qualname__] += 1
+            return types_seen, views
+        
+        types_seen, views = await asyncio.to_thread(tally)
+        users = database.get('users', {})
+        lines = [
+            f"RSS: {format_bytes(read_rss_bytes())}",
+            "",
+            f"Live Views/Modals: {sum(views.values())} (persistent: {len(bot.persistent_views)})"
+        ]
+        lines += [f"  {count:>8}  {name}" for name, count in views.most_common(PROFILE_TOP)]
+        lines += [
+            "",
+            "Database:",
+            f"  users {len(users)} • orders {len(database.get('orders', {}))} • tickets {len(database.get('tickets', {}))}",
+            f"  sold keys {sum(len(user.get('keys', [])) for user in users.values())}"
+            f" • stocked keys {sum(stock_level(product_id) for product_id in database.get('products', {}))}",
+            "",
+            "discord.py caches:",
+            f"  users {len(bot.users)} • guild members {sum(guild.member_count or 0 for guild in bot.guilds)}"
+            f" • messages {len(bot.cached_messages)}",
+            "",
+            f"Top {PROFILE_TOP} object types (gc-tracked):"
+        ]
+        lines += [f"  {count:>8}  {name}" for name, count in types_seen.most_common(PROFILE_TOP)]
+        text = "\n".join(lines) + "\n"
+        return text, self._write('objects', text)
+
+    async def cpu(self, seconds: float) -> tuple:
+        """Sample the event loop thread's stack for `seconds` and summarise where it spends time.
+
+        Stacks are also written in collapsed ("folded") form, which flamegraph.pl and
+        speedscope read directly.
+        """
+        if self.cpu_running:
+            raise RuntimeError("a CPU profile is already running")
+        seconds = min(max(seconds, 1), MAX_CPU_PROFILE_SECONDS)
+        loop_thread = threading.get_ident()
+        
+        def sample():
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(loop_thread)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    stacks[";".join(reversed(stack))] += 1
+                time.sleep(CPU_SAMPLE_INTERVAL)
+            return stacks
+        
+        self.cpu_running = True
+        try:
+            stacks = await asyncio.to_thread(sample)
+        finally:
+            self.cpu_running = False
+        
+        total = sum(stacks.values()) or 1
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                inclusive[name] += count
+        # A loop with nothing to do sits in the selector waiting for I/O
+        idle = sum(count for name, count in own.items() if name.startswith(('select (', 'poll (')))
+        
+        lines = [
+            f"{total} samples over {seconds:.0f}s • loop idle in {idle / total:.0%} of them",
+            "",
+            f"Top {PROFILE_TOP} by own time:"
+        ]
+        lines += [f"  {count / total:6.1%}  {name}" for name, count in own.most_common(PROFILE_TOP)]
+        lines += ["", f"Top {PROFILE_TOP} by inclusive time:"]
+        lines += [f"  {count / total:6.1%}  {name}" for name, count in inclusive.most_common(PROFILE_TOP)]
+        text = "\n".join(lines) + "\n"
+        folded = "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+        return text + f"\nFolded stacks: {self._write('cpu', folded, 'folded')}\n", self._write('cpu', text)
+
+profiler = Profiler()
+
+@bot.tree.command(name="profile", description="Profile the bot's memory or CPU use while it keeps running.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(action="What to profile", seconds="How long to sample the CPU for (cpu only)")
+@app_commands.choices(action=[Choice(name=action, value=action) for action in PROFILE_ACTIONS])
+async def profile(interaction: discord.Interaction, action: app_commands.Choice[str], seconds: int = 10):
+    """Run a profiling action and attach its report"""
+    await interaction.response.defer(ephemeral=True)
+    try:
+        text, path = await profiler.run(action.value, seconds)
+    except RuntimeError as e:
+        await interaction.followup.send(f"❌ {e}.", ephemeral=True)
+        return
+    
+    if path is None:
+        await interaction.followup.send(f"✅ {text}", ephemeral=True)
+        return
+    await interaction.followup.send(
+        f"📊 `{action.value}` report written to `{path}`.",
+        file=discord.File(io.BytesIO(text.encode('utf-8')), filename=os.path.basename(path)),
+        ephemeral=True
+    )
+
+@bot.tree.command(name="slowtraces", description="Show the slowest traced interactions and where their time went.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(action="list the slowest traces, export them as Chrome trace JSON, or clear them")
+@app_commands.choices(action=[Choice(name=action, value=action) for action in ('list', 'export', 'clear')])
+async def slowtraces(interaction: discord.Interaction, action: app_commands.Choice[str]):
+    """List, export or clear the slow interaction traces"""
+    traces = slow_traces.slowest()
+    if action.value == 'clear':
+        slow_traces.clear()
+        await interaction.response.send_message(f"✅ Cleared {len(traces)} trace(s).", ephemeral=True)
+        return
+    if not traces:
+        await interaction.response.send_message(
+            f"No interaction has taken {SLOW_TRACE_MIN_MS} ms or more since the last restart "
+            f"({slow_traces.seen} traced).",
+            ephemeral=True
+        )
+        return
+    
+    if action.value == 'export':
+        text = json.dumps(slow_traces.chrome_trace(traces))
+        await interaction.response.send_message(
+            f"📊 {len(traces)} trace(s). Open the file in chrome://tracing or ui.perfetto.dev.",
+            file=discord.File(io.BytesIO(text.encode('utf-8')),
+                              filename=f"slowtraces-{datetime.utcnow():%Y%m%d-%H%M%S}.json"),
+            ephemeral=True
+        )
+        return
+    
+    summary = "\n\n".join(trace.describe() for trace in traces[:SLOW_TRACE_LIST])
+    header = (f"Slowest {min(len(traces), SLOW_TRACE_LIST)} of {len(traces)} kept "
+              f"({slow_traces.seen} traced, threshold {SLOW_TRACE_MIN_MS} ms):\n")
+    if len(header) + len(summary) + 8 <= 2000:
+        await interaction.response.send_message(f"{header}```\n{summary}\n```", ephemeral=True)
+        return
+    await interaction.response.send_message(
+        header.rstrip(':\n') + ". Full breakdown attached.",
+        file=discord.File(io.BytesIO(summary.encode('utf-8')), filename="slowtraces.txt"),
+        ephemeral=True
+    )
+
+# --- Backups ---
+BACKUP_DIR = 'backups'
+BACKUP_INTERVAL_MINUTES = 30
+BACKUP_KEEP = 336                 # Snapshots kept; a week at the default interval
+BACKUP_CHUNK_RECORDS = 64         # Average records (or lines) per chunk
+BACKUP_CHUNK_MAX_BYTES = 1024 * 1024
+BACKUP_FILES = ('database.json', CATALOG_FILE, CREDIT_LEDGER_FILE)
+
+class BackupError(Exception):
+    pass
+
+def database_records(data: dict):
+    """Split the database into (boundary key, line) records, one per user, order, product, ticket..."""
+    for name, value in data.items():
+        if isinstance(value, dict):
+            # A header keeps empty sections and the section order on restore
+            yield name, json.dumps(['d', name], separators=(',', ':'))
+            for record_id, record in value.items():
+                yield f"{name}/{record_id}", json.dumps(['s', name, record_id, record], separators=(',', ':'))
+        else:
+            yield name, json.dumps(['v', name, value], separators=(',', ':'))
+
+def database_from_records(lines) -> dict:
+    data = {}
+    for line in lines:
+        record = json.loads(line)
+        if record[0] == 'd':
+            data[record[1]] = {}
+        elif record[0] == 's':
+            data[record[1]][record[2]] = record[3]
+        else:
+            data[record[1]] = record[2]
+    return data
+
+class BackupStore:
+    """Content-addressed, incremental snapshots of the bot's files.
+
+    Each file is cut into chunks at record boundaries (one record per user, order,
+    ticket, ledger line...). A chunk ends after a record whose key hashes to 0 mod
+    BACKUP_CHUNK_RECORDS, so boundaries depend on the records themselves rather
+    than their byte offsets: an appended order or an edited user only produces new
+    chunks around that record, and every other chunk is shared with earlier
+    snapshots. Chunks are stored gzipped under their SHA-256, and a snapshot is a
+    small manifest listing each file's chunks and its whole-file checksum.
+
+    Snapshots read the files on disk, which save_database replaces atomically, so
+    they can run in a worker thread without pausing or locking the bot.
+    """
+
+    def __init__(self, root: str = BACKUP_DIR):
+        self.root = root
+        self.chunk_dir = os.path.join(root, 'chunks')
+        self.snapshot_dir = os.path.join(root, 'snapshots')
+        self.lock = threading.Lock()  # Keeps pruning from deleting chunks a concurrent snapshot relies on
+
+    # Storage
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunk_dir, digest[:2], f"{digest}.gz")
+
+    @staticmethod
+    def _write_atomic(path: str, content: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def _put_chunk(self, content: bytes) -> tuple:
+        """Store a chunk unless it already exists. Returns (digest, bytes written)."""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        compressed = gzip.compress(content, compresslevel=6)
+        self._write_atomic(path, compressed)
+        return digest, len(compressed)
+
+    def _get_chunk(self, digest: str) -> bytes:
+        try:
+            with open(self._chunk_path(digest), 'rb') as f:
+                content = gzip.decompress(f.read())
+        except (OSError, EOFError) as e:
+            raise BackupError(f"chunk {digest[:12]} is missing or unreadable: {e}")
+        if hashlib.sha256(content).hexdigest() != digest:
+            raise BackupError(f"chunk {digest[:12]} is corrupt (checksum mismatch)")
+        return content
+
+    def _chunks(self, records) -> list:
+        """Group (boundary key, line) records into chunk payloads."""
+        chunks, current, size = [], [], 0
+        for boundary_key, line in records:
+            current.append(line)
+            size += len(line) + 1
+            if zlib.crc32(boundary_key.encode()) % BACKUP_CHUNK_RECORDS == 0 or size >= BACKUP_CHUNK_MAX_BYTES:
+                chunks.append(("\n".join(current) + "\n").encode('utf-8'))
+                current, size = [], 0
+        if current:
+            chunks.append(("\n".join(current) + "\n").encode('utf-8'))
+        return chunks
+
+    # Snapshots
+    def list_snapshots(self) -> list:
+        """Snapshot ids, oldest first. Ids are UTC timestamps, so they sort by time."""
+        try:
+            names = os.listdir(self.snapshot_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith('.json'))
+
+    def load_manifest(self, snapshot_id: str) -> dict:
+        try:
+            with open(os.path.join(self.snapshot_dir, f"{snapshot_id}.json"), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BackupError(f"no snapshot {snapshot_id!r}")
+
+    def snapshot(self, files=None) -> dict:
+        """Back up `files` (backup_files() by default) as they are on disk.
+
+        Returns the manifest plus stats, or None if nothing changed. Inside the bot,
+        list the files on the event loop and pass them in, since this runs in a
+        worker thread and listing them rescans the shared partition registry.
+        """
+        if files is None:
+            files = backup_files()
+        with self.lock:
+            return self._snapshot(files)
+
+    def _snapshot(self, files) -> dict:
+        snapshots = self.list_snapshots()
+        previous = self.load_manifest(snapshots[-1])['files'] if snapshots else {}
+        started = time.perf_counter()
+        manifest_files = {}
+        written = 0
+        for name in files:
+            try:
+                with open(name, 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            digest = hashlib.sha256(content).hexdigest()
+            if previous.get(name, {}).get('sha256') == digest:
+                # Unchanged since the last snapshot: reuse its chunk list without re-chunking
+                manifest_files[name] = previous[name]
+                continue
+            
+            data = json.loads(content) if os.path.basename(name) == 'database.json' else None
+            if data is not None and json.dumps(data, indent=4).encode('utf-8') == content:
+                kind, records = 'records', database_records(data)
+            else:
+                # Anything not in save_database's exact format is chunked by line so it restores byte for byte
+                kind = 'lines'
+                records = ((line, line) for line in content.decode('utf-8').split('\n'))
+            chunk_ids = []
+            for chunk in self._chunks(records):
+                chunk_id, size = self._put_chunk(chunk)
+                chunk_ids.append(chunk_id)
+                written += size
+            manifest_files[name] = {'sha256': digest, 'size': len(content), 'kind': kind, 'chunks': chunk_ids}
+        
+        if manifest_files == previous:
+            return None
+        snapshot_id = datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+        manifest = {'id': snapshot_id, 'created': datetime.utcnow().isoformat(), 'files': manifest_files}
+        self._write_atomic(os.path.join(self.snapshot_dir, f"{snapshot_id}.json"), json.dumps(manifest).encode('utf-8'))
+        self.prune()
+        return dict(manifest, bytes_written=written, seconds=time.perf_counter() - started)
+
+    def _assemble(self, entry: dict) -> bytes:
+        content = b"".join(self._get_chunk(chunk_id) for chunk_id in entry['chunks'])
+        if entry['kind'] == 'records':
+            data = database_from_records(content.decode('utf-8').splitlines())
+            # save_database's own formatting, so the restored file is byte-for-byte the original
+            content = json.dumps(data, indent=4).encode('utf-8')
+        else:
+            # The line split adds a newline after the last line; drop it again
+            content = content[:-1]
+        if hashlib.sha256(content).hexdigest() != entry['sha256']:
+            raise BackupError("reassembled file does not match its recorded checksum")
+        return content
+
+    def verify(self, snapshot_id: str) -> list:
+        """Check every chunk and whole-file checksum of a snapshot. Returns a list of problems."""
+        problems = []
+        for name, entry in self.load_manifest(snapshot_id)['files'].items():
+            try:
+                self._assemble(entry)
+            except BackupError as e:
+                problems.append(f"{name}: {e}")
+        return problems
+
+    def resolve(self, at: datetime = None, snapshot_id: str = None) -> str:
+        """The requested snapshot, or the latest one taken at or before `at`."""
+        snapshots = self.list_snapshots()
+        if snapshot_id:
+            if snapshot_id not in snapshots:
+                raise BackupError(f"no snapshot {snapshot_id!r}")
+            return snapshot_id
+        if at is not None:
+            snapshots = [s for s in snapshots if datetime.strptime(s, '%Y%m%dT%H%M%S%fZ') <= at]
+        if not snapshots:
+            raise BackupError("no snapshot at or before that time")
+        return snapshots[-1]
+
+    def restore(self, snapshot_id: str, target_dir: str) -> list:
+        """Write a snapshot's files into `target_dir`, each verified before it replaces anything."""
+        restored = []
+        for name, entry in self.load_manifest(snapshot_id)['files'].items():
+            try:
+                content = self._assemble(entry)
+            except BackupError as e:
+                raise BackupError(f"{name}: {e}")
+            self._write_atomic(os.path.join(target_dir, name), content)
+            restored.append(name)
+        return restored
+
+    def prune(self, keep: int = BACKUP_KEEP):
+        """Drop the oldest snapshots beyond `keep` and any chunk no remaining snapshot uses."""
+        snapshots = self.list_snapshots()
+        if len(snapshots) <= keep:
+            return
+        for snapshot_id in snapshots[:-keep]:
+            os.remove(os.path.join(self.snapshot_dir, f"{snapshot_id}.json"))
+        referenced = {
+            chunk_id
+            for snapshot_id in snapshots[-keep:]
+            for entry in self.load_manifest(snapshot_id)['files'].values()
+            for chunk_id in entry['chunks']
+        }
+        for directory, _, names in os.walk(self.chunk_dir):
+            for name in names:
+                if name.endswith('.gz') and name[:-3] not in referenced:
+                    os.remove(os.path.join(directory, name))
+
+backups = BackupStore()
+
+def backup_files() -> list:
+    """The top-level files, every guild partition's files and the key files."""
+    partitions.scan()
+    return [*BACKUP_FILES, *partitions.files(), *partitions.key_store_files()]
+
+@tasks.loop(minutes=BACKUP_INTERVAL_MINUTES)
+async def backup_scheduler():
+    """Take an incremental snapshot in a worker thread while the bot keeps running."""
+    try:
+        result = await asyncio.to_thread(backups.snapshot, backup_files())
+    except (OSError, ValueError, BackupError):
+        log.exception("Scheduled backup failed")
+        return
+    if result:
+        log.info("Backup %s written", result['id'], extra=log_fields(
+            snapshot=result['id'], bytes_written=result['bytes_written'], duration_ms=round(result['seconds'] * 1000, 1)
+        ))
+
+@bot.tree.command(name="backup", description="Take, list or verify database backups.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(action="What to do", snapshot="Snapshot id to verify (defaults to the latest)")
+@app_commands.choices(action=[Choice(name=action, value=action) for action in ('snapshot', 'list', 'verify')])
+async def backup(interaction: discord.Interaction, action: app_commands.Choice[str], snapshot: str = None):
+    """Manage incremental backups; restoring is done offline with backup.py"""
+    await interaction.response.defer(ephemeral=True)
+    try:
+        if action.value == 'snapshot':
+            result = await asyncio.to_thread(backups.snapshot, backup_files())
+            message = (
+                "✅ Nothing changed since the last snapshot." if result is None else
+                f"✅ Snapshot `{result['id']}` written: {format_bytes(result['bytes_written'])} of new chunks "
+                f"in {result['seconds'] * 1000:.0f} ms."
+            )
+        elif action.value == 'list':
+            snapshots = backups.list_snapshots()
+            shown = "\n".join(snapshots[-15:][::-1])
+            message = f"🗄️ {len(snapshots)} snapshot(s), newest first:\n```\n{shown}\n```" if snapshots else "No snapshots yet."
+        else:
+            snapshot_id = backups.resolve(snapshot_id=snapshot)
+            problems = await asyncio.to_thread(backups.verify, snapshot_id)
+            message = (
+                f"✅ Snapshot `{snapshot_id}` verified." if not problems else
+                f"❌ Snapshot `{snapshot_id}` is damaged:\n```\n" + "\n".join(problems) + "\n```"
+            )
+    except BackupError as e:
+        message = f"❌ {e}"
+    await interaction.followup.send(message, ephemeral=True)
+
+# --- Event Outbox ---
+OUTBOX_FILE = 'outbox.jsonl'
+OUTBOX_CURSOR_FILE = 'outbox_cursors.json'
+OUTBOX_BATCH_SIZE = 500                      # Most events sent to a sink at once
+OUTBOX_BATCH_BYTES = 256 * 1024
+OUTBOX_SEND_TIMEOUT = 10                     # Seconds a sink gets to accept a batch
+OUTBOX_POLL_SECONDS = 30                     # Re-check for events even without a wakeup
+OUTBOX_MAX_RETRY_SECONDS = 60
+OUTBOX_COMPACT_BYTES = 16 * 1024 * 1024      # Truncate the outbox past this size once every sink has read it all
+OUTBOX_BACKLOG_WARNING_BYTES = 64 * 1024 * 1024
+
+class OutboxDeliveryError(Exception):
+    pass
+
+class EventOutbox:
+    """Durable, append-only log of order, credit and stock events for downstream systems.
+
+    Mutation points publish events as they change the database. The events are held
+    until that change is saved and then appended and fsynced to outbox.jsonl, so a
+    consumer never hears of a sale a crash undid. Every event carries an increasing
+    `seq`; delivery is at-least-once, so consumers drop any seq they've already seen.
+
+    Each sink has a cursor (byte offset and last delivered seq) in outbox_cursors.json
+    that only moves after the sink accepts a batch. Sinks pull batches at their own
+    pace: a slow or offline sink only grows its backlog on disk and never holds up a
+    purchase. Once every sink has caught up, a large outbox is truncated.
+    """
+
+    def __init__(self, sink_names: list, path: str = OUTBOX_FILE, cursor_path: str = OUTBOX_CURSOR_FILE):
+        self.sink_names = sink_names
+        self.path = path
+        self.cursor_path = cursor_path
+        self.pending = []
+        self.wakeups = []  # One asyncio.Event per exporter, set whenever events are appended
+        try:
+            with open(cursor_path, 'r') as f:
+                self.cursors = json.load(f)  # sink name -> {'offset', 'seq'}
+        except FileNotFoundError:
+            self.cursors = {}
+        # A compacted outbox is empty, but its seqs must not be handed out again
+        self.next_seq = max(self._last_seq(), *(cursor['seq'] for cursor in self.cursors.values()), 0) + 1
+
+    def _last_seq(self) -> int:
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(max(0, f.seek(0, os.SEEK_END) - 65536))
+                lines = [line for line in f.read().split(b'\n') if line.strip()]
+        except FileNotFoundError:
+            return 0
+        for line in reversed(lines):
+            try:
+                return json.loads(line)['seq']
+            except (ValueError, KeyError):
+                continue  # A line cut short by a crash, or the tail of one before our window
+        return 0
+
+    def publish(self, event_type: str, **fields):
+        self.pending.append({
+            'seq': self.next_seq,
+            'ts': datetime.utcnow().isoformat(),
+            'type': event_type,
+            'guild_id': partitions.current().guild_id,
+            **fields
+        })
+        self.next_seq += 1
+
+    def flush(self):
+        """Append pending events to the outbox. Called right after the database is saved."""
+        if not self.pending:
+            return
+        with open(self.path, 'a') as f:
+            f.writelines(json.dumps(event) + "\n" for event in self.pending)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+        for wakeup in self.wakeups:
+            wakeup.set()
+
+    def read_batch(self, offset: int) -> tuple:
+        """Complete events from `offset`, up to a batch. Returns (events, offset after them).
+
+        Runs on the event loop, like flush and the truncate in _compact, so a batch is
+        never read from a file that is being truncated under it.
+        """
+        events, size = [], 0
+        try:
+            with open(self.path, 'rb') as f:
+                if offset > f.seek(0, os.SEEK_END):
+                    offset = 0  # The outbox was truncated after this cursor was saved
+                f.seek(offset)
+                for line in iter(f.readline, b''):
+                    if not line.endswith(b'\n'):
+                        break
+                    events.append(json.loads(line))
+                    offset += len(line)
+                    size += len(line)
+                    if len(events) >= OUTBOX_BATCH_SIZE or size >= OUTBOX_BATCH_BYTES:
+                        break
+        except FileNotFoundError:
+            pass
+        return events, offset
+
+    def backlog(self, sink_name: str) -> tuple:
+        """(undelivered events, undelivered bytes) for one sink."""
+        cursor = self.cursors.get(sink_name, {'offset': 0, 'seq': 0})
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        return self.next_seq - 1 - cursor['seq'] - len(self.pending), max(0, size - cursor['offset'])
+
+    def advance(self, sink_name: str, offset: int, seq: int):
+        self.cursors[sink_name] = {'offset': offset, 'seq': seq}
+        write_json_atomic(self.cursor_path, self.cursors)
+        self._compact()
+
+    def _compact(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        offsets = [self.cursors.get(name, {'offset': 0})['offset'] for name in self.sink_names]
+        if size < OUTBOX_COMPACT_BYTES or any(offset < size for offset in offsets):
+            return
+        # Cursors first: a crash before the truncate only means a redelivery
+        for name in self.sink_names:
+            self.cursors[name]['offset'] = 0
+        write_json_atomic(self.cursor_path, self.cursors)
+        open(self.path, 'w').close()
+        event_log.info("Compacted the outbox after every sink caught up", extra=log_fields(bytes=size))
+
+class FileSink:
+    """Appends each batch to a JSONL file."""
+
+    def __init__(self, path: str):
+        self.name = f"file:{path}"
+        self.path = path
+
+    def _write(self, events: list):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.writelines(json.dumps(event) + "\n" for event in events)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def send(self, events: list):
+        await asyncio.to_thread(self._write, events)
+
+class WebhookSink:
+    """POSTs each batch as {"events": [...]}; any 2xx response acknowledges it."""
+
+    def __init__(self, url: str):
+        self.name = url
+        self.url = url
+        self.session = None
+
+    async def send(self, events: list):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        async with self.session.post(self.url, json={'events': events}) as response:
+            if not 200 <= response.status < 300:
+                raise OutboxDeliveryError(f"HTTP {response.status}")
+
+class UnixSocketSink:
+    """Writes each batch as JSONL over a fresh connection, then closes the write side.
+
+    The consumer acknowledges the batch by sending back any line before closing.
+    """
+
+    def __init__(self, path: str):
+        self.name = f"unix:{path}"
+        self.path = path
+
+    async def send(self, events: list):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            writer.writelines(json.dumps(event).encode() + b"\n" for event in events)
+            await writer.drain()
+            writer.write_eof()
+            if not await reader.readline():
+                raise OutboxDeliveryError("connection closed without an acknowledgement")
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+def parse_event_sinks(spec: str) -> list:
+    """Parse EVENT_SINKS ("file:path,http://...,unix:path") into sinks, skipping unknown entries."""
+    sinks = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        if entry.startswith('file:'):
+            sinks.append(FileSink(entry[len('file:'):]))
+        elif entry.startswith(('http://', 'https://')):
+            sinks.append(WebhookSink(entry))
+        elif entry.startswith('unix:'):
+            sinks.append(UnixSocketSink(entry[len('unix:'):]))
+        else:
+            event_log.warning("Ignoring unknown event sink %r", entry)
+    return sinks
+
+event_sinks = parse_event_sinks(EVENT_SINKS)
+outbox = EventOutbox([sink.name for sink in event_sinks]) if event_sinks else None  # Nothing is recorded without somewhere to send it
+
+def publish_event(event_type: str, **fields):
+    """Queue an event for the outbox; it is written when the change is saved."""
+    if outbox is not None:
+        outbox.publish(event_type, **fields)
+
+async def export_events(sink):
+    """Deliver the outbox to one sink in batches, resuming from its cursor and retrying with backoff."""
+    wakeup = asyncio.Event()
+    outbox.wakeups.append(wakeup)
+    retry_delay = 1
+    backlog_warned = False
+    while True:
+        wakeup.clear()
+        cursor = outbox.cursors.get(sink.name, {'offset': 0, 'seq': 0})
+        events, offset = outbox.read_batch(cursor['offset'])
+        if not events:
+            try:
+                await asyncio.wait_for(wakeup.wait(), OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(sink.send(events), OUTBOX_SEND_TIMEOUT)
+        except Exception as e:
+            # Whatever went wrong, the cursor hasn't moved, so the batch is simply sent again
+            event_log.warning("Delivery to %s failed, retrying in %ds: %r", sink.name, retry_delay, e,
+                              extra=log_fields(sink=sink.name, first_seq=events[0]['seq']))
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, OUTBOX_MAX_RETRY_SECONDS)
+            continue
+        
+        retry_delay = 1
+        outbox.advance(sink.name, offset, events[-1]['seq'])
+        pending_events, pending_bytes = outbox.backlog(sink.name)
+        event_log.debug("Delivered %d event(s) to %s", len(events), sink.name, extra=log_fields(
+            sink=sink.name, last_seq=events[-1]['seq'], backlog=pending_events,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1)
+        ))
+        if (pending_bytes > OUTBOX_BACKLOG_WARNING_BYTES) != backlog_warned:
+            backlog_warned = not backlog_warned
+            if backlog_warned:
+                event_log.warning("%s is %d event(s) behind", sink.name, pending_events,
+                                  extra=log_fields(sink=sink.name, backlog=pending_events))
+
+def start_event_exporters():
+    for sink in event_sinks:
+        bot.loop.create_task(export_events(sink), name=f"export-events-{sink.name}")
+
+@bot.tree.command(name="outbox", description="Show how far each event sink has got.")
+@app_commands.checks.has_permissions(administrator=True)
+async def outbox_status(interaction: discord.Interaction):
+    """Show each event sink's cursor and backlog"""
+    if outbox is None:
+        await interaction.response.send_message("No event sinks are configured (set EVENT_SINKS).", ephemeral=True)
+        return
+    
+    lines = []
+    for sink in event_sinks:
+        pending_events, pending_bytes = outbox.backlog(sink.name)
+        delivered = outbox.cursors.get(sink.name, {}).get('seq', 0)
+        lines.append(f"{sink.name}\n  delivered through #{delivered}, {pending_events} event(s) / {format_bytes(pending_bytes)} behind")
+    await interaction.response.send_message(
+        f"📤 Last event #{outbox.next_seq - 1}\n```\n" + "\n".join(lines) + "\n```", ephemeral=True
+    )
+
+# --- Guild Partitions ---
+PARTITION_DIR = 'guilds'
+PARTITION_FILES = ('database.json', CATALOG_FILE, CREDIT_LEDGER_FILE)
+
+current_partition = contextvars.ContextVar('current_partition')
+
+class GuildPartition:
+    """One guild's share of the bot's state, loaded on first use and saved on its own.
+
+    The default partition (guild_id None) is database.json, catalog.json and the
+    credit ledger at the top level, and serves every guild until /partition enable
+    gives a guild its own directory under guilds/<guild_id>/. A guild partition has
+    its own database file (stock, tickets, orders, panels and settings such as
+    ticket_category), stock reservations, carts, autocomplete indexes and leaderboards. It uses its own catalog.json
+    if the directory has one and follows the default catalog otherwise.
+
+    Users and their credits belong to the guild unless the partition was created
+    with shared_credits, in which case its users section and credit ledger are the
+    default partition's, and saving the guild also saves the default database.
+    """
+
+    def __init__(self, guild_id: int = None, default: 'GuildPartition' = None):
+        self.guild_id = guild_id
+        self.default = default
+        directory = os.path.join(PARTITION_DIR, str(guild_id)) if guild_id else ''
+        self.database_file = os.path.join(directory, 'database.json')
+        self.catalog_file = os.path.join(directory, CATALOG_FILE)
+        self.key_store_dir = os.path.join(directory, KEY_STORE_DIR)
+        self.key_files = {}  # product_id -> MappedKeyFile, opened on first use
+        self.data = None
+        self.own_catalog = None
+        self.catalog_mtime = None  # Last catalog file version the watcher has seen, valid or not
+        self.reservations = StockReservations()
+        self.carts = {}  # user_id -> list of staged line items ({'category', 'variant', 'variant_info', 'product_id', 'quantity', 'hold_id'})
+        self.order_index = OrderIndex()
+        self.customer_index = CustomerIndex()
+        self.leaderboards = Leaderboards()
+        self.own_credit_ledger = CreditLedger(os.path.join(directory, CREDIT_LEDGER_FILE))
+
+    @property
+    def shared_credits(self) -> bool:
+        return self.default is not None and bool(self.data.get('shared_credits'))
+
+    @property
+    def catalog(self) -> Catalog:
+        if self.own_catalog is None and self.default is not None:
+            return self.default.catalog
+        return self.own_catalog
+
+    @property
+    def credit_ledger(self) -> CreditLedger:
+        return self.default.credit_ledger if self.shared_credits else self.own_credit_ledger
+
+    def load(self):
+        """Read the partition's files and build its indexes."""
+        self.read()
+        with use_partition(self):
+            sync_products_with_catalog()
+        self.order_index.rebuild(self.data)
+        self.customer_index.rebuild(self.data)
+        self.leaderboards.rebuild(self.data)
+        if not self.shared_credits:
+            self.own_credit_ledger.load()
+
+    def read(self):
+        """Read the partition's database and catalog, without building anything from them."""
+        if self.default is None:
+            self.data = load_database()
+            self.own_catalog = load_catalog(self.catalog_file)
+        else:
+            with open(self.database_file, 'r') as f:
+                self.data = json.load(f)
+            for section in ('users', 'products', 'tickets'):
+                self.data.setdefault(section, {})
+            if self.shared_credits:
+                self.data['users'] = self.default.data['users']
+            if os.path.exists(self.catalog_file):
+                try:
+                    self.own_catalog = load_catalog(self.catalog_file)
+                except CatalogError as e:
+                    catalog_log.warning("Guild %s uses the default catalog until its own is fixed: %s", self.guild_id, e)
+        if self.own_catalog is not None:
+            self.catalog_mtime = self.own_catalog.mtime
+
+    def key_file(self, product_id: str) -> MappedKeyFile:
+        key_file = self.key_files.get(product_id)
+        if key_file is None:
+            key_file = MappedKeyFile(self.key_store_dir, product_id, self.data['products'][product_id]['key_file'])
+            self.key_files[product_id] = key_file
+        return key_file
+
+    def save(self):
+        if not self.shared_credits:
+            write_json_atomic(self.database_file, self.data)
+            return
+        # Shared users live in the default database only
+        write_json_atomic(self.database_file, {section: value for section, value in self.data.items() if section != 'users'})
+        self.default.save()
+
+class PartitionStore:
+    """The default partition plus every guild partition loaded so far.
+
+    Guilds with a directory under PARTITION_DIR are found by scan(); each one is
+    only read from disk, in a worker thread, the first time get() is asked for it.
+    """
+
+    def __init__(self):
+        self.default = GuildPartition()
+        self.partitions = {}    # guild_id -> loaded GuildPartition
+        self.loading = {}       # guild_id -> task loading it, so concurrent first uses share one load
+        self.guild_ids = set()  # Guilds that have a partition on disk, loaded or not
+        self.scan()
+
+    def scan(self):
+        try:
+            names = os.listdir(PARTITION_DIR)
+        except FileNotFoundError:
+            names = []
+        self.guild_ids = {
+            int(name) for name in names
+            if name.isdigit() and os.path.exists(os.path.join(PARTITION_DIR, name, 'database.json'))
+        }
+
+    async def get(self, guild_id) -> GuildPartition:
+        """The partition serving a guild, loading it on first use. DMs and guilds without one get the default."""
+        if guild_id is None or int(guild_id) not in self.guild_ids:
+            return self.default
+        guild_id = int(guild_id)
+        partition = self.partitions.get(guild_id)
+        if partition is not None:
+            return partition
+        if guild_id not in self.loading:
+            self.loading[guild_id] = asyncio.ensure_future(self._load(guild_id))
+        return await asyncio.shield(self.loading[guild_id])
+
+    async def _load(self, guild_id: int) -> GuildPartition:
+        started = time.perf_counter()
+        partition = GuildPartition(guild_id, self.default)
+        try:
+            # Reading the files and building the indexes only touches the new partition
+            await asyncio.to_thread(partition.load)
+        finally:
+            del self.loading[guild_id]
+        self.partitions[guild_id] = partition
+        with use_partition(partition):
+            rehydrate_persistent_views()
+        requeue_closing_tickets(partition)
+        log.info("Loaded partition for guild %s", guild_id, extra=log_fields(
+            guild_id=guild_id, duration_ms=round((time.perf_counter() - started) * 1000, 1)
+        ))
+        return partition
+
+    def current(self) -> GuildPartition:
+        return current_partition.get(self.default)
+
+    def loaded(self) -> list:
+        return [self.default, *self.partitions.values()]
+
+    async def create(self, guild_id: int, shared_credits: bool = False) -> GuildPartition:
+        """Give a guild an empty partition of its own and load it."""
+        path = os.path.join(PARTITION_DIR, str(guild_id), 'database.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json_atomic(path, {
+            'users': {},
+            'products': {},
+            'tickets': {},
+            'ticket_counter': 0,
+            'ticket_category': None,
+            'shared_credits': shared_credits
+        })
+        self.guild_ids.add(guild_id)
+        return await self.get(guild_id)
+
+    def check_all(self) -> dict:
+        """Run the report-only integrity check over every partition. Returns {guild_id or None: problems}.
+
+        Partitions that aren't loaded are only read for the check, not loaded.
+        """
+        results = {}
+        for partition in self.loaded():
+            with use_partition(partition):
+                results[partition.guild_id] = check_database(partition.data)
+        for guild_id in sorted(self.guild_ids - set(self.partitions)):
+            partition = GuildPartition(guild_id, self.default)
+            try:
+                partition.read()
+            except (OSError, ValueError, CatalogError) as e:
+                log.warning("Could not read partition for guild %s: %s", guild_id, e, extra=log_fields(guild_id=guild_id))
+                continue
+            with use_partition(partition):
+                results[guild_id] = check_database(partition.data)
+            for key_file in partition.key_files.values():
+                key_file.close()
+        return results
+
+    def database_files(self) -> list:
+        return [os.path.join(PARTITION_DIR, str(guild_id), 'database.json') for guild_id in sorted(self.guild_ids)]
+
+    def files(self) -> list:
+        """Every file a guild partition may have on disk, whether or not it exists."""
+        return [
+            os.path.join(PARTITION_DIR, str(guild_id), name)
+            for guild_id in sorted(self.guild_ids) for name in PARTITION_FILES
+        ]
+
+    def key_store_files(self) -> list:
+        """Every key file on disk, the default partition's and each guild's."""
+        directories = [KEY_STORE_DIR, *(os.path.join(PARTITION_DIR, str(guild_id), KEY_STORE_DIR) for guild_id in sorted(self.guild_ids))]
+        files = []
+        for directory in directories:
+            try:
+                names = sorted(os.listdir(directory))
+            except FileNotFoundError:
+                continue
+            files += [os.path.join(directory, name) for name in names if name.endswith('.keys')]
+        return files
+
+    def all_databases(self):
+        """Yield every partition's database: loaded ones from memory, the rest as saved."""
+        yield self.default.data
+        for guild_id in sorted(self.guild_ids):
+            partition = self.partitions.get(guild_id)
+            if partition is not None:
+                yield partition.data
+                continue
+            try:
+                with open(os.path.join(PARTITION_DIR, str(guild_id), 'database.json'), 'r') as f:
+                    yield json.load(f)
+            except FileNotFoundError:
+                continue
+
+    def read_databases(self, paths=None):
+        """Yield each guild partition's database (or those at `paths`) as saved, without loading the partition."""
+        for path in self.database_files() if paths is None else paths:
+            try:
+                with open(path, 'r') as f:
+                    yield json.load(f)
+            except FileNotFoundError:
+                continue
+
+partitions = PartitionStore()
+
+@contextmanager
+def use_partition(partition: GuildPartition):
+    """Run a block (including awaits within one task) against another partition."""
+    token = current_partition.set(partition)
+    try:
+        yield partition
+    finally:
+        current_partition.reset(token)
+
+class PartitionView(MutableMapping):
+    """A dict attribute of whichever partition is current, such as its database or carts."""
+
+    def __init__(self, attribute: str):
+        self.attribute = attribute
+
+    def _target(self) -> dict:
+        return getattr(partitions.current(), self.attribute)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __contains__(self, key):
+        return key in self._target()
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def get(self, key, default=None):
+        return self._target().get(key, default)
+
+    def setdefault(self, key, default=None):
+        return self._target().setdefault(key, default)
+
+    def pop(self, key, *default):
+        return self._target().pop(key, *default)
+
+class PartitionAttribute:
+    """Forwards attribute access to an object of whichever partition is current, such as its catalog."""
+
+    def __init__(self, attribute: str):
+        self._attribute = attribute
+
+    def __getattr__(self, name):
+        return getattr(getattr(partitions.current(), self._attribute), name)
+
+database = PartitionView('data')
+carts = PartitionView('carts')
+reservations = PartitionAttribute('reservations')
+catalog = PartitionAttribute('catalog')
+order_index = PartitionAttribute('order_index')
+customer_index = PartitionAttribute('customer_index')
+leaderboards = PartitionAttribute('leaderboards')
+credit_ledger = PartitionAttribute('credit_ledger')
+
+async def enter_partition(guild_id):
+    """Make a guild's partition current for the rest of the running handler.
+
+    discord.py runs each command, component, modal and listener in a task of its
+    own, and the interaction checks run in that same task, so setting the context
+    variable there (see PartitionedCommandTree, PartitionedView, PartitionedModal)
+    scopes it to exactly one handler.
+    """
+    current_partition.set(await partitions.get(guild_id))
+
+@bot.tree.command(name="partition", description="Give this server its own stock, tickets and settings.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    action="What to do",
+    shared_credits="Keep using the default user table and credit balances (only when enabling)"
+)
+@app_commands.choices(action=[Choice(name=action, value=action) for action in ('status', 'enable')])
+async def partition(interaction: discord.Interaction, action: app_commands.Choice[str], shared_credits: bool = False):
+    """Show or create this server's partition"""
+    if interaction.guild_id is None:
+        await interaction.response.send_message("❌ Partitions belong to a server; run this in one.", ephemeral=True)
+        return
+    
+    current = partitions.current()
+    if action.value == 'enable':
+        if current is not partitions.default:
+            await interaction.response.send_message("❌ This server already has its own partition.", ephemeral=True)
+            return
+        current = await partitions.create(interaction.guild_id, shared_credits)
+        log.info("Partition created", extra=log_fields(interaction, guild_id=interaction.guild_id, shared_credits=shared_credits))
+        await interaction.response.send_message(
+            "✅ This server now has its own partition, starting with no stock or tickets. "
+            "Run /setticketcategory and /addkey again here.", ephemeral=True
+        )
+        return
+    
+    if current is partitions.default:
+        message = "This server uses the default partition, shared with every server without its own."
+    else:
+        message = (
+            f"This server has its own partition in `{os.path.dirname(current.database_file)}`.\n"
+            f"Catalog: {'its own' if current.own_catalog is not None else 'the default'} • "
+            f"Credits: {'shared with the default partition' if current.shared_credits else 'scoped to this server'}"
+        )
+    message += f"\n{len(partitions.partitions)} of {len(partitions.guild_ids)} server partition(s) loaded."
+    await interaction.response.send_message(message, ephemeral=True)
+
+# --- Integrity Check ---
+STORED_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'  # What purchases write today
+TICKET_STATUSES = {'open', 'closing'}
+
+IntegrityProblem = namedtuple('IntegrityProblem', ['section', 'record', 'message', 'repaired'])
+
+def check_database(data: dict, repair: bool = False, actor=None) -> list:
+    """Check the database invariants in one pass per section and optionally repair what is safe to.
+
+    Users are walked first to learn who owns every sold key, then products, orders
+    and tickets are checked against that map, so no section is visited twice. The
+    only state kept between sections is that map, keyed by each key's hash rather
+    than the key itself and holding a bare user id unless a key has several buyers.
+
+    Repairs only touch data that can be fixed without guessing:
+    - multi-line keys are split into one entry per key
+    - a key sold to the same user more than once keeps its first entry
+    - date-only expiries get the purchase time of day, matching current sales
+    - sold or duplicate keys are dropped from stock
+    - keys an order delivered but the buyer's list is missing are added back
+    - negative balances are set to 0 through the credit ledger, out-of-range discounts clamped
+    Keys sold to two different users and unparseable dates are only reported.
+    """
+    problems = []
+    
+    def problem(section, record, message, repaired=False):
+        problems.append(IntegrityProblem(section, str(record), message, repaired and repair))
+    
+    owners = {}     # hash(key) -> the user id it was sold to, or a set of them once there are several
+    contested = {}  # key -> set of user ids, for keys sold to more than one user
+    
+    def owned_by(key):
+        owner = owners.get(hash(key), ())
+        return owner if isinstance(owner, set) or owner == () else (owner,)
+    
+    def add_owner(key, user_id):
+        fingerprint = hash(key)
+        owner = owners.get(fingerprint)
+        if owner is None:
+            owners[fingerprint] = user_id
+            return
+        if not isinstance(owner, set):
+            if owner == user_id:
+                return
+            owner = owners[fingerprint] = {owner}
+        owner.add(user_id)
+        contested[key] = owner
+    
+    for user_id, user_data in data.get('users', {}).items():
+        credits = user_data.get('credits', 0)
+        if not isinstance(credits, int):
+            problem('users', user_id, f"credits is not a whole number: {credits!r}")
+        elif credits < 0:
+            problem('users', user_id, f"negative balance of {credits} credits", repaired=True)
+            if repair:
+                adjust_credits(user_id, user_data, -credits, 'set', reference='fsck', actor=actor)
+        discount = user_data.get('discount', 0)
+        if not isinstance(discount, int) or not 0 <= discount <= 100:
+            problem('users', user_id, f"discount {discount!r} is outside 0-100", repaired=isinstance(discount, int))
+            if repair and isinstance(discount, int):
+                user_data['discount'] = min(max(discount, 0), 100)
+        
+        checked_keys = []
+        seen = set()
+        for key_entry in user_data.get('keys', []):
+            key = key_entry.get('key')
+            if not isinstance(key, str) or not key.strip() or 'product' not in key_entry:
+                problem('users', user_id, f"malformed key entry {key_entry!r}")
+                checked_keys.append(key_entry)
+                continue
+            
+            split_keys = [line.strip() for line in key.split('\n') if line.strip()]
+            if len(split_keys) > 1:
+                problem('users', user_id, f"{len(split_keys)} keys were sold as one: {key!r}", repaired=True)
+            entries = [dict(key_entry, key=line) for line in split_keys] if len(split_keys) > 1 else [key_entry]
+            
+            purchased = parse_expiry(key_entry.get('purchase_date'))
+            if purchased is None:
+                problem('users', user_id, f"key {key!r} has an invalid purchase date {key_entry.get('purchase_date')!r}")
+            expires = parse_expiry(key_entry.get('expires'))
+            if expires is None:
+                problem('users', user_id, f"key {key!r} has an invalid expiry {key_entry.get('expires')!r}")
+            elif len(key_entry['expires']) == 10:
+                problem('users', user_id, f"key {key!r} has a date-only expiry {key_entry['expires']!r}",
+                        repaired=purchased is not None)
+                if repair and purchased is not None:
+                    normalized = datetime.combine(expires.date(), purchased.time()).strftime(STORED_DATE_FORMAT)
+                    for entry in entries:
+                        entry['expires'] = normalized
+            
+            for entry in entries:
+                if entry['key'] in seen:
+                    problem('users', user_id, f"key {entry['key']!r} was sold to this user more than once", repaired=True)
+                    if repair:
+                        continue
+                seen.add(entry['key'])
+                add_owner(entry['key'], user_id)
+                checked_keys.append(entry)
+        if repair and 'keys' in user_data:
+            user_data['keys'] = checked_keys
+    
+    for key, key_owners in contested.items():
+        problem('users', ", ".join(sorted(key_owners)), f"key {key!r} was sold to {len(key_owners)} different users")
+    
+    for product_id, product in data.get('products', {}).items():
+        if product_id not in catalog.products:
+            problem('products', product_id, "product is not in the catalog")
+        if 'key_file' in product:
+            path = os.path.join(partitions.current().key_store_dir, product['key_file']['file'])
+            if not os.path.exists(path) or os.path.getsize(path) < product['key_file']['tail']:
+                problem('products', product_id, f"key file {path} is missing or shorter than its recorded stock")
+                continue
+        stock = []
+        stocked = set()
+        for key in (stocked_keys(product_id) if 'key_file' in product else product.get('keys', [])):
+            for line in (line.strip() for line in key.split('\n')):
+                if not line:
+                    continue
+                if hash(line) in owners:
+                    problem('products', product_id, f"key {line!r} is in stock but was already sold", repaired=True)
+                elif line in stocked:
+                    problem('products', product_id, f"key {line!r} is in stock more than once", repaired=True)
+                else:
+                    stocked.add(line)
+                    stock.append(line)
+            if '\n' in key:
+                problem('products', product_id, f"stock entry holds several keys: {key!r}", repaired=True)
+        if repair and 'key_file' in product:
+            if len(stock) != product['key_file']['count']:
+                partitions.current().key_file(product_id).rewrite(stock)
+        elif repair and 'keys' in product:
+            product['keys'] = stock
+    
+    for order_id, order in data.get('orders', {}).items():
+        if parse_expiry(order.get('date')) is None:
+            problem('orders', order_id, f"invalid order date {order.get('date')!r}")
+        user_data = data.get('users', {}).get(order.get('user_id'))
+        if user_data is None:
+            problem('orders', order_id, f"buyer {order.get('user_id')!r} has no user record")
+            continue
+        for item in order_key_items(order):
+            for key in item['keys']:
+                if order['user_id'] in owned_by(key):
+                    continue
+                problem('orders', order_id, f"key {key!r} is missing from the buyer's keys", repaired=True)
+                if repair:
+                    user_data.setdefault('keys', []).append({
+                        'key': key,
+                        'product': item['product_id'],
+                        'purchase_date': order.get('date'),
+                        'expires': item['expires'],
+                        'order_id': order_id
+                    })
+                    add_owner(key, order['user_id'])
+    
+    for channel_id, ticket in data.get('tickets', {}).items():
+        if ticket.get('status', 'open') not in TICKET_STATUSES:
+            problem('tickets', channel_id, f"unknown status {ticket.get('status')!r}")
+        if parse_expiry(ticket.get('created_at')) is None:
+            problem('tickets', channel_id, f"invalid creation date {ticket.get('created_at')!r}")
+        if 'creator_id' not in ticket:
+            problem('tickets', channel_id, "ticket has no creator")
+    
+    return problems
+
+def format_integrity_report(problems: list) -> str:
+    """One line per problem, grouped by section."""
+    if not problems:
+        return "No problems found.\n"
+    lines = []
+    for problem in sorted(problems, key=lambda problem: (problem.section, problem.record)):
+        status = "repaired" if problem.repaired else "open"
+        lines.append(f"[{status}] {problem.section}/{problem.record}: {problem.message}")
+    return "\n".join(lines) + "\n"
+
+def rebuild_license_index():
+    """Reindex every key sold in any partition, since validation is global."""
+    license_index.rebuild(*partitions.all_databases())
+
+def run_integrity_check(repair: bool = False, actor=None) -> list:
+    """Check the live database, saving and reindexing it if anything was repaired."""
+    problems = check_database(database, repair=repair, actor=actor)
+    if any(problem.repaired for problem in problems):
+        save_database(database)
+        rebuild_license_index()
+    return problems
+
+@bot.tree.command(name="fsck", description="Check the database for damaged records and optionally repair them.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(repair="Fix what can be fixed safely; the rest is only reported")
+async def fsck(interaction: discord.Interaction, repair: bool = False):
+    """Run the integrity checker and attach the full report"""
+    await interaction.response.defer(ephemeral=True)
+    started = time.perf_counter()
+    problems = run_integrity_check(repair=repair, actor=interaction.user.id)
+    elapsed = (time.perf_counter() - started) * 1000
+    
+    if not problems:
+        await interaction.followup.send(f"✅ No problems found ({elapsed:.0f} ms).", ephemeral=True)
+        return
+    
+    repaired = sum(1 for problem in problems if problem.repaired)
+    summary = f"🔍 Found {len(problems)} problem(s) in {elapsed:.0f} ms"
+    summary += f", repaired {repaired}." if repair else ". Run again with `repair: True` to fix what can be fixed."
+    report_file = discord.File(io.BytesIO(format_integrity_report(problems).encode('utf-8')), filename="fsck-report.txt")
+    await interaction.followup.send(summary, file=report_file, ephemeral=True)
 
-# Load the database at startup
-database = load_database()
+# Load the database at startup; guild partitions load when their guild is first seen
+partitions.default.load()
+rebuild_license_index()
                                                                                                     
 # --- Run the Bot ---
 if __name__ == "__main__":
-    if DISCORD_TOKEN:
-        bot.run(DISCORD_TOKEN)
+    setup_logging()
+    if '--validation-only' in sys.argv:
+        # Sidecar mode: only serve the license validation endpoint
+        asyncio.run(run_validation_sidecar(VALIDATION_HOST, int(VALIDATION_PORT or 8080)))
+    elif DISCORD_TOKEN:
+        # discord.py logs through the same queue instead of its own console handler
+        bot.run(DISCORD_TOKEN, log_handler=None)
     else:
-        print("Error: DISCORD_TOKEN not found in .env file.")
\ No newline at end of file
+        log.error("DISCORD_TOKEN not found in .env file.")
\ No newline at end of file
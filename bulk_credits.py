@@ -0,0 +1,47 @@
+"""Apply a bulk credits CSV to database.json from the command line.
+
+The CSV needs user_id, credit_delta and discount columns (leave a cell empty to
+keep that value). Rows are validated together and applied with a single save:
+
+    python bulk_credits.py resellers.csv            # show the diff only
+    python bulk_credits.py resellers.csv --apply    # apply and save
+
+Stop the bot first: it keeps the database in memory and would overwrite the change
+on its next save. Use /bulkcredits to do the same while it is running.
+"""
+import argparse
+import sys
+import time
+
+import bot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply credit and discount changes from a CSV file.")
+    parser.add_argument('csv_file', help="CSV with user_id, credit_delta and discount columns")
+    parser.add_argument('--apply', action='store_true', help="Apply the changes instead of only showing the diff")
+    args = parser.parse_args()
+
+    with open(args.csv_file, 'r', encoding='utf-8-sig') as f:
+        text = f.read()
+
+    started = time.perf_counter()
+    changes, errors = bot.parse_bulk_csv(text)
+    if errors:
+        print("Nothing was applied. Fix these rows first:", file=sys.stderr)
+        for error in errors:
+            print(f"  {error}", file=sys.stderr)
+        sys.exit(1)
+
+    sys.stdout.write(bot.format_bulk_diff(changes))
+    if not args.apply:
+        print(f"Dry run: {len(changes)} row(s) would be applied. Re-run with --apply to save.")
+        return
+
+    bot.apply_bulk_changes(changes, actor='cli')
+    bot.save_database(bot.database)
+    print(f"Applied {len(changes)} row(s) in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+
+if __name__ == "__main__":
+    main()
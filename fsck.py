@@ -0,0 +1,35 @@
+"""Check database.json for damaged records from the command line.
+
+Reports every problem the integrity checker finds; with --repair it also fixes
+what can be fixed safely and saves the database:
+
+    python fsck.py             # report only
+    python fsck.py --repair    # repair and save
+
+Stop the bot before repairing: it keeps the database in memory and would overwrite
+the repair on its next save. Use /fsck to do the same while it is running.
+"""
+import argparse
+import sys
+import time
+
+import bot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the database for damaged records.")
+    parser.add_argument('--repair', action='store_true', help="Fix what can be fixed safely and save")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    problems = bot.run_integrity_check(repair=args.repair, actor='cli')
+    elapsed = (time.perf_counter() - started) * 1000
+
+    sys.stdout.write(bot.format_integrity_report(problems))
+    remaining = sum(1 for problem in problems if not problem.repaired)
+    print(f"{len(problems)} problem(s), {len(problems) - remaining} repaired, checked in {elapsed:.1f} ms.")
+    sys.exit(1 if remaining else 0)
+
+
+if __name__ == "__main__":
+    main()
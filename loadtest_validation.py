@@ -0,0 +1,101 @@
+"""Load test for the license validation service.
+
+Start the service first, either inside the bot (VALIDATION_PORT=8080 python bot.py)
+or as a sidecar (VALIDATION_PORT=8080 python bot.py --validation-only), then run:
+
+    python loadtest_validation.py --url http://127.0.0.1:8080/validate --duration 10 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import time
+
+import aiohttp
+
+
+def load_known_keys(path):
+    """Collect sold keys from the database so the test mixes hits and misses."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [key_entry['key'] for user in data.get('users', {}).values() for key_entry in user.get('keys', [])]
+
+
+def random_key():
+    return '-'.join(''.join(random.choices(string.ascii_uppercase + string.digits, k=5)) for _ in range(5))
+
+
+def pick_keys(known_keys, count, unknown_ratio):
+    return [
+        random.choice(known_keys) if known_keys and random.random() >= unknown_ratio else random_key()
+        for _ in range(count)
+    ]
+
+
+async def worker(session, args, known_keys, deadline, latencies, counters):
+    while time.perf_counter() < deadline:
+        keys = pick_keys(known_keys, args.batch, args.unknown_ratio)
+        started = time.perf_counter()
+        try:
+            if args.batch == 1:
+                request = session.get(args.url, params={'key': keys[0]})
+            else:
+                request = session.post(args.url, json={'keys': keys})
+            async with request as response:
+                await response.read()
+                if response.status != 200:
+                    counters['errors'] += 1
+                    continue
+        except aiohttp.ClientError:
+            counters['errors'] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        counters['keys'] += len(keys)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test the license validation endpoint.")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/validate')
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run for")
+    parser.add_argument('--concurrency', type=int, default=64, help="Simultaneous connections")
+    parser.add_argument('--batch', type=int, default=1, help="Keys per request (1 uses GET, more uses POST)")
+    parser.add_argument('--unknown-ratio', type=float, default=0.5, help="Share of lookups for keys that don't exist")
+    parser.add_argument('--database', default='database.json', help="Where to sample known keys from")
+    args = parser.parse_args()
+
+    known_keys = load_known_keys(args.database)
+    latencies = []
+    counters = {'keys': 0, 'errors': 0}
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(session, args, known_keys, deadline, latencies, counters)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Requests:   {len(latencies)} ok, {counters['errors']} failed in {elapsed:.1f}s")
+    print(f"Throughput: {len(latencies) / elapsed:,.0f} requests/s, {counters['keys'] / elapsed:,.0f} lookups/s")
+    print(
+        f"Latency:    p50 {percentile(latencies, 0.50) * 1000:.2f} ms, "
+        f"p95 {percentile(latencies, 0.95) * 1000:.2f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,49 @@
+"""Trigger the running bot's profiler from the command line.
+
+The bot serves the profiler next to the license validation endpoint when both
+VALIDATION_PORT and PROFILING_TOKEN are set. With the same .env in place:
+
+    python profile_bot.py objects
+    python profile_bot.py memory            # run again later to see what grew
+    python profile_bot.py cpu --seconds 20
+    python profile_bot.py stop-tracing
+
+Reports are printed here and also written to the bot's profiles/ directory.
+"""
+import argparse
+import os
+import sys
+import urllib.error
+import urllib.request
+
+from dotenv import load_dotenv
+
+ACTIONS = ('memory', 'objects', 'cpu', 'stop-tracing')
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Profile the running bot's memory or CPU use.")
+    parser.add_argument('action', choices=ACTIONS)
+    parser.add_argument('--seconds', type=float, default=10, help="How long to sample the CPU for")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{os.getenv('VALIDATION_PORT') or 8080}")
+    parser.add_argument('--token', default=os.getenv('PROFILING_TOKEN'), help="Defaults to PROFILING_TOKEN")
+    args = parser.parse_args()
+
+    if not args.token:
+        sys.exit("Set PROFILING_TOKEN or pass --token.")
+    request = urllib.request.Request(
+        f"{args.url.rstrip('/')}/debug/profile/{args.action}?seconds={args.seconds}",
+        headers={'X-Profiling-Token': args.token}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=args.seconds + 60) as response:
+            sys.stdout.write(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        sys.exit(f"Profiling failed ({e.code}): {e.read().decode('utf-8')}")
+    except urllib.error.URLError as e:
+        sys.exit(f"Couldn't reach the bot at {args.url}: {e.reason}")
+
+
+if __name__ == "__main__":
+    main()
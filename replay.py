@@ -0,0 +1,472 @@
+"""Replay a recorded interaction trace against a scratch copy of the bot.
+
+Record real traffic by starting the bot with TRACE_FILE set (TRACE_FILE=trace.jsonl
+python bot.py), then feed the trace back through the bot's own handlers:
+
+    python replay.py trace.jsonl --speed 10 --credits 500 --restock 200
+
+database.json and catalog.json are copied into a temporary directory before the bot
+is imported, so the replay never touches the real files. Each pseudonymous user from
+the trace becomes a fake Discord user whose clicks run in order; different users run
+concurrently, at the recorded pace divided by --speed. Admin commands are skipped.
+The report covers latency, error rate and a set of database invariants checked at the end.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+from collections import Counter, defaultdict
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+EVENT_TIMEOUT = 30  # Seconds before a handler counts as hung
+REDACTED_TEXT = "Replayed interaction"  # Stand-in for text the recorder redacted
+
+ids = itertools.count(10 ** 17)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def load_trace(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return [event for event in events if event.get('event') != 'start']
+
+
+# --- Fake Discord objects ---
+class FakeMessage:
+    def __init__(self, owner=None, view=None):
+        self.id = next(ids)
+        self.interaction = types.SimpleNamespace(user=owner) if owner else None
+        self.components = []
+        self.view = view
+
+    async def delete(self, **kwargs):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, name="replay"):
+        self.id = next(ids)
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.category = None
+        self.category_id = None
+
+    async def send(self, *args, view=None, **kwargs):
+        return FakeMessage(view=view)
+
+    async def set_permissions(self, *args, **kwargs):
+        pass
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(ids)
+        self.categories = []
+        self.default_role = types.SimpleNamespace(id=next(ids), name="@everyone")
+
+    async def create_category(self, name, **kwargs):
+        category = FakeChannel(name)
+        self.categories.append(category)
+        return category
+
+    async def create_text_channel(self, name, **kwargs):
+        return FakeChannel(name)
+
+
+class FakeUser:
+    """A pseudonymous user from the trace, remembering the views and modals it was shown."""
+
+    def __init__(self, pseudonym):
+        self.id = next(ids)
+        self.name = f"replay-{pseudonym}"
+        self.display_name = self.name
+        self.mention = f"<@{self.id}>"
+        self.display_avatar = types.SimpleNamespace(url="https://cdn.discordapp.com/embed/avatars/0.png")
+        self.roles = []
+        self.guild_permissions = None
+        self.bot = False
+        self.views = []
+        self.modal = None
+
+    def __str__(self):
+        return self.name
+
+    def remember(self, view):
+        if view is not None:
+            self.views.append(view)
+            del self.views[:-5]
+
+    async def send(self, *args, view=None, **kwargs):
+        self.remember(view)
+        return FakeMessage(view=view)
+
+    async def create_dm(self):
+        return self
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    def _reply(self, content, view):
+        self.done = True
+        self.interaction.user.remember(view)
+        self.interaction.replies.append(content or "")
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    async def send_message(self, content=None, *, view=None, **kwargs):
+        self._reply(content, view)
+
+    async def edit_message(self, content=None, *, view=None, **kwargs):
+        self._reply(content, view)
+
+    async def send_modal(self, modal):
+        self.done = True
+        self.interaction.user.modal = modal
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, *, view=None, **kwargs):
+        self.interaction.user.remember(view)
+        self.interaction.replies.append(content or "")
+        return FakeMessage(view=view)
+
+
+class FakeInteraction:
+    def __init__(self, user, guild, interaction_type, data=None, namespace=None, message=None):
+        self.id = next(ids)
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = FakeChannel()
+        self.type = interaction_type
+        self.data = data or {}
+        self.namespace = types.SimpleNamespace(**(namespace or {}))
+        self.message = message
+        self.replies = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def original_response(self):
+        return FakeMessage(self.user)
+
+
+# --- Replay ---
+class Replayer:
+    def __init__(self, bot, speed):
+        self.bot = bot
+        self.speed = speed
+        self.guild = FakeGuild()
+        self.users = {}
+        self.latencies = defaultdict(list)
+        self.outcomes = Counter()
+        self.errors = Counter()
+        # Views that answer to fixed custom_ids no matter which message they're on
+        self.persistent_views = [bot.TicketPanelView(), bot.TicketView()] + [
+            bot.VariantSelectView(category_id, persistent=True) for category_id in bot.catalog.categories
+        ]
+
+    def user(self, pseudonym):
+        if pseudonym not in self.users:
+            self.users[pseudonym] = FakeUser(pseudonym)
+        return self.users[pseudonym]
+
+    def find_command(self, name):
+        command = None
+        for part in name.split():
+            command = (self.bot.bot.tree if command is None else command).get_command(part)
+            if command is None:
+                return None
+        return command
+
+    def command_arguments(self, command, options):
+        """Map recorded option values back onto the fake world."""
+        arguments = {}
+        for name, value in options.items():
+            if name in self.bot.TRACE_USER_OPTIONS:
+                arguments[name] = str(self.user(value).id)
+            elif value == '<redacted>':
+                arguments[name] = REDACTED_TEXT
+            else:
+                arguments[name] = value
+        return arguments
+
+    def find_component(self, user, event):
+        """The item the recorded click hit: same custom_id, else same label, else same kind in the latest view."""
+        views = list(reversed(user.views)) + self.persistent_views
+        for view in views:
+            for item in view.children:
+                if getattr(item, 'custom_id', None) == event.get('custom_id'):
+                    return view, item
+        for view in reversed(user.views):
+            for item in view.children:
+                if event.get('label') and getattr(item, 'label', None) == event['label']:
+                    return view, item
+        if user.views:
+            for item in user.views[-1].children:
+                if item.type.value == event.get('component_type'):
+                    return user.views[-1], item
+        return None, None
+
+    async def dispatch(self, event):
+        """Run one trace event through the bot. Returns 'ok', 'skipped' or 'unmatched'."""
+        discord = self.bot.discord
+        user = self.user(event['user'])
+        kind = event['event']
+
+        if kind in ('command', 'autocomplete'):
+            command = self.find_command(event['command'])
+            if command is None or command.checks or command.default_permissions:
+                return 'skipped'
+            arguments = self.command_arguments(command, event.get('options', {}))
+            interaction_type = (discord.InteractionType.application_command if kind == 'command'
+                                else discord.InteractionType.autocomplete)
+            interaction = FakeInteraction(user, self.guild, interaction_type, namespace=arguments)
+            if kind == 'autocomplete':
+                parameter = command._params.get(event.get('focused'))
+                if parameter is None or parameter.autocomplete is None:
+                    return 'skipped'
+                await parameter.autocomplete(interaction, str(arguments.get(event['focused'], "")))
+                return 'ok'
+            await command.callback(interaction, **arguments)
+            return interaction
+
+        if kind == 'component':
+            view, item = self.find_component(user, event)
+            if item is None:
+                return 'unmatched'
+            interaction = FakeInteraction(
+                user, self.guild, discord.InteractionType.component,
+                data={'custom_id': item.custom_id, 'component_type': item.type.value, 'values': event.get('values', [])},
+                message=FakeMessage(user, view)
+            )
+            if 'values' in event:
+                item._values = event['values']
+            if not await view.interaction_check(interaction):
+                return 'skipped'
+            await item.callback(interaction)
+            return interaction
+
+        if kind == 'modal':
+            modal, user.modal = user.modal, None
+            if modal is None:
+                return 'unmatched'
+            inputs = [child for child in modal.children if isinstance(child, discord.ui.TextInput)]
+            for text_input, value in zip(inputs, event.get('fields', [])):
+                text_input._value = REDACTED_TEXT if value == '<redacted>' else value
+            interaction = FakeInteraction(user, self.guild, discord.InteractionType.modal_submit,
+                                          data={'custom_id': modal.custom_id})
+            await modal.on_submit(interaction)
+            return interaction
+
+        return 'skipped'
+
+    async def run_event(self, event):
+        label = event['event'] + (f" /{event['command']}" if 'command' in event else "")
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.dispatch(event), EVENT_TIMEOUT)
+        except Exception as e:
+            self.outcomes['error'] += 1
+            self.errors[f"{label}: {type(e).__name__}: {e}"] += 1
+            return
+        elapsed = time.perf_counter() - started
+
+        if isinstance(result, str):
+            self.outcomes[result] += 1
+            if result != 'ok':
+                return
+        elif any(reply.startswith(self.bot.BUSY_MESSAGE) for reply in result.replies):
+            self.outcomes['shed'] += 1
+        elif any(reply.startswith("❌") for reply in result.replies):
+            self.outcomes['rejected'] += 1
+        else:
+            self.outcomes['ok'] += 1
+        self.latencies[label].append(elapsed)
+
+    async def run_user(self, events, started):
+        loop = asyncio.get_running_loop()
+        for event in events:
+            delay = started + event['t'] / self.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.run_event(event)
+
+    async def run(self, events):
+        by_user = defaultdict(list)
+        for event in events:
+            by_user[event['user']].append(event)
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(self.run_user(user_events, started) for user_events in by_user.values()))
+
+
+def seed(bot, replayer, events, credits, restock):
+    """Give every replayed user credits and every stocked product extra keys."""
+    for pseudonym in {event['user'] for event in events}:
+        user = replayer.user(pseudonym)
+        if credits:
+            user_data = bot.get_user_data(user.id)
+            bot.adjust_credits(user.id, user_data, credits, 'grant', reference='replay', actor='replay')
+    if restock:
+        for product_id in bot.catalog.products:
+            if not bot.is_generated_product(product_id):
+                bot.add_stock_keys(product_id, [f"REPLAY-{product_id}-{n}" for n in range(restock)])
+    bot.save_database(bot.database)
+
+
+def sold_keys(bot):
+    """How many times each stocked key has been sold."""
+    return Counter(
+        key_entry['key']
+        for user_data in bot.database['users'].values()
+        for key_entry in user_data.get('keys', [])
+        if not bot.is_generated_product(key_entry['product'])
+    )
+
+
+def check_invariants(bot, replayer, sold_before):
+    """Return (name, passed, detail) for each database invariant.
+
+    Problems already in the copied database are not blamed on the replay: a key
+    only counts as double-sold if the replay sold it again.
+    """
+    database = bot.partitions.default.data  # Replayed events skip the gateway, so they all run in the default partition
+    results = []
+
+    stock = {key for product_id in database['products'] for key in bot.stocked_keys(product_id)}
+    sold = sold_keys(bot)
+    both = stock & (set(sold) - set(sold_before))
+    results.append(("no key is both in stock and sold", not both, f"{len(both)} key(s)"))
+    duplicates = [key for key, count in sold.items() if count > 1 and count > sold_before.get(key, 0)]
+    results.append(("no stocked key was sold twice", not duplicates, f"{len(duplicates)} key(s)"))
+
+    negative = [user_id for user_id, user_data in database['users'].items() if user_data.get('credits', 0) < 0]
+    results.append(("no negative balances", not negative, f"{len(negative)} user(s)"))
+
+    mismatched = []
+    for user in replayer.users.values():
+        user_data = database['users'].get(str(user.id))
+        balance = bot.credit_ledger.reconstruct_balance(user.id)
+        if user_data and balance is not None and balance != user_data['credits']:
+            mismatched.append(user.id)
+    results.append(("credit ledger matches balances", not mismatched, f"{len(mismatched)} user(s)"))
+
+    orphaned = 0
+    for order in database.get('orders', {}).values():
+        owned = {key_entry['key'] for key_entry in database['users'].get(order['user_id'], {}).get('keys', [])}
+        orphaned += sum(1 for key in order['key'].split("\n") if key and key not in owned)
+    results.append(("every ordered key belongs to its buyer", not orphaned, f"{orphaned} key(s)"))
+
+    # Abandoned modals leave holds behind until they expire, but never more than the stock
+    overheld = [
+        product_id for product_id in database['products']
+        if not bot.is_generated_product(product_id)
+        and bot.reservations.reserved(product_id) > bot.stock_level(product_id)
+    ]
+    results.append(("holds never exceed stock", not overheld, f"{len(overheld)} product(s)"))
+
+    with open('database.json', 'r') as f:
+        on_disk = json.load(f)
+    results.append(("saved file matches memory", on_disk == json.loads(json.dumps(database)),
+                    "changes were never saved"))
+    return results
+
+
+def report(replayer, elapsed, events, invariants):
+    total = sum(replayer.outcomes.values())
+    print(f"Replayed {total} event(s) from {len(replayer.users)} user(s) in {elapsed:.1f}s "
+          f"({len(events) / max(elapsed, 1e-9):,.1f} events/s)")
+    print("Outcomes:   " + ", ".join(f"{name} {count}" for name, count in replayer.outcomes.most_common()))
+    handled = total - replayer.outcomes['skipped'] - replayer.outcomes['unmatched']
+    print(f"Error rate: {replayer.outcomes['error'] / max(handled, 1):.2%}")
+
+    everything = sorted(latency for latencies in replayer.latencies.values() for latency in latencies)
+    print(f"Latency:    p50 {percentile(everything, 0.50) * 1000:.1f} ms, "
+          f"p95 {percentile(everything, 0.95) * 1000:.1f} ms, p99 {percentile(everything, 0.99) * 1000:.1f} ms")
+    for label, latencies in sorted(replayer.latencies.items()):
+        latencies.sort()
+        print(f"  {label:<32} n={len(latencies):<6} p50 {percentile(latencies, 0.50) * 1000:7.1f} ms"
+              f"  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms")
+
+    if replayer.errors:
+        print("Errors:")
+        for error, count in replayer.errors.most_common(10):
+            print(f"  {count} × {error}")
+
+    print("Invariants:")
+    for name, passed, detail in invariants:
+        print(f"  ok   {name}" if passed else f"  FAIL {name} ({detail})")
+    return all(passed for _, passed, _ in invariants)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded interaction trace against a copy of the database.")
+    parser.add_argument('trace', help="JSONL trace recorded with TRACE_FILE")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier, e.g. 1, 10 or 100")
+    parser.add_argument('--database', default=os.path.join(REPO_DIR, 'database.json'))
+    parser.add_argument('--catalog', default=os.path.join(REPO_DIR, 'catalog.json'))
+    parser.add_argument('--credits', type=int, default=0, help="Credits to grant each replayed user first")
+    parser.add_argument('--restock', type=int, default=0, help="Fake keys to add to each stocked product first")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch directory for inspection")
+    args = parser.parse_args()
+
+    events = load_trace(args.trace)
+    scratch = tempfile.mkdtemp(prefix='replay-')
+    shutil.copy(args.database, os.path.join(scratch, 'database.json'))
+    shutil.copy(args.catalog, os.path.join(scratch, 'catalog.json'))
+    # Products kept in key files need their files next to the database copy
+    inventory = os.path.join(os.path.dirname(os.path.abspath(args.database)), 'inventory')
+    if os.path.isdir(inventory):
+        shutil.copytree(inventory, os.path.join(scratch, 'inventory'))
+
+    # The bot reads and writes its files relative to the working directory
+    os.chdir(scratch)
+    os.environ['TRACE_FILE'] = ''
+    sys.path.insert(0, REPO_DIR)
+    import bot
+
+    async def run():
+        replayer = Replayer(bot, args.speed)
+        seed(bot, replayer, events, args.credits, args.restock)
+        sold_before = sold_keys(bot)
+        started = time.perf_counter()
+        await replayer.run(events)
+        return replayer, time.perf_counter() - started, sold_before
+
+    try:
+        replayer, elapsed, sold_before = asyncio.run(run())
+        passed = report(replayer, elapsed, events, check_invariants(bot, replayer, sold_before))
+    finally:
+        os.chdir(REPO_DIR)
+        if args.keep:
+            print(f"Scratch copy kept in {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
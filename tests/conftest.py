@@ -0,0 +1,52 @@
+"""Shared test setup.
+
+bot.py reads database.json and catalog.json from the working directory when it is
+imported and writes its logs and journals next to them, so the tests import it from
+a scratch copy of those files instead of the repository's own.
+"""
+import atexit
+import copy
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='resellers-tests-')
+for name in ('database.json', 'catalog.json'):
+    shutil.copy(os.path.join(ROOT, name), WORKDIR)
+atexit.register(shutil.rmtree, WORKDIR, ignore_errors=True)
+os.chdir(WORKDIR)
+sys.path.insert(0, ROOT)
+
+import bot  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def database():
+    """The default partition's database, put back as it was after each test."""
+    saved = copy.deepcopy(bot.partitions.default.data)
+    yield bot.database
+    bot.partitions.default.data = saved
+
+
+class Clock:
+    """Stands in for time.monotonic so TTLs can expire without sleeping."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(bot.time, 'monotonic', clock)
+    return clock
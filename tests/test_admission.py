@@ -0,0 +1,124 @@
+import asyncio
+
+import bot
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_admits_up_to_the_limit_then_queues_and_sheds():
+    async def scenario():
+        limiter = bot.AdmissionLimiter('test', limit=2, max_queue=1)
+        assert await limiter.acquire()
+        assert await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        assert not await limiter.acquire()
+        limiter.release()
+        assert await queued
+        assert (limiter.active, limiter.admitted, limiter.queued, limiter.shed) == (2, 3, 1, 1)
+    run(scenario())
+
+
+def test_waiters_run_in_priority_order():
+    async def scenario():
+        limiter = bot.AdmissionLimiter('test', limit=1, max_queue=3)
+        await limiter.acquire()
+        order = []
+
+        async def waiter(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+            limiter.release()
+
+        tasks = [asyncio.ensure_future(waiter(name, priority)) for name, priority in (('low', 2), ('high', 0), ('mid', 1))]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ['high', 'mid', 'low']
+        assert limiter.active == 0
+    run(scenario())
+
+
+def test_waiter_is_shed_after_the_wait_limit(monkeypatch):
+    monkeypatch.setattr(bot, 'ADMISSION_WAIT_SECONDS', 0.01)
+
+    async def scenario():
+        limiter = bot.AdmissionLimiter('test', limit=1, max_queue=2)
+        await limiter.acquire()
+        assert not await limiter.acquire()
+        assert (limiter.waiting, limiter.shed) == (0, 1)
+        # The timed-out waiter must not swallow the slot when it is released
+        limiter.release()
+        assert limiter.active == 0
+        assert await limiter.acquire()
+    run(scenario())
+
+
+def test_cancelled_waiter_is_skipped():
+    async def scenario():
+        limiter = bot.AdmissionLimiter('test', limit=1, max_queue=2)
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        limiter.release()
+        assert await second
+        assert first.cancelled()
+        assert limiter.active == 1
+    run(scenario())
+
+
+def test_waiter_cancelled_as_it_is_admitted_never_loses_the_slot():
+    async def scenario():
+        limiter = bot.AdmissionLimiter('test', limit=1, max_queue=2)
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()  # Hands the slot to the first waiter...
+        first.cancel()     # ...which is cancelled before it runs
+        try:
+            # Depending on the Python version the waiter either keeps the slot or passes it on
+            admitted = await first
+        except asyncio.CancelledError:
+            admitted = False
+        if admitted:
+            limiter.release()
+        assert await second
+        assert limiter.active == 1
+    run(scenario())
+
+
+def test_admission_controlled_replies_busy_when_shed(monkeypatch):
+    replies = []
+
+    class Response:
+        def is_done(self):
+            return False
+
+        async def send_message(self, content, ephemeral=False):
+            replies.append(content)
+
+    class User:
+        id = 1
+        guild_permissions = None
+
+    class Interaction:
+        user = User()
+        response = Response()
+
+    monkeypatch.setattr(bot, 'admission_limiters', {'test': bot.AdmissionLimiter('test', limit=0, max_queue=0)})
+    calls = []
+
+    @bot.admission_controlled('test')
+    async def handler(interaction):
+        calls.append(interaction)
+
+    run(handler(Interaction()))
+    assert calls == []
+    assert replies == [bot.BUSY_MESSAGE]
@@ -0,0 +1,116 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import bot
+
+FILES = ['database.json', 'credit_ledger.jsonl']
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return bot.BackupStore(str(tmp_path / 'backups'))
+
+
+def write_database(data):
+    bot.write_json_atomic('database.json', data)
+
+
+def sample_database(users=2000):
+    return {
+        'users': {str(n): {'credits': n, 'discount': 0, 'keys': []} for n in range(users)},
+        'products': {'r6_day': {'keys': ['KEY-1', 'KEY-2']}},
+        'orders': {},
+        'ticket_category': None
+    }
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def all_chunks(manifest):
+    return {chunk for entry in manifest['files'].values() for chunk in entry['chunks']}
+
+
+def test_restore_is_byte_for_byte(store, tmp_path):
+    write_database(sample_database())
+    with open('credit_ledger.jsonl', 'w') as f:
+        f.write('{"seq": 1}\n{"seq": 2}\n')
+    manifest = store.snapshot(FILES)
+    assert manifest['files']['database.json']['kind'] == 'records'
+    assert manifest['files']['credit_ledger.jsonl']['kind'] == 'lines'
+    assert store.verify(manifest['id']) == []
+    target = tmp_path / 'restored'
+    assert store.restore(manifest['id'], str(target)) == FILES
+    for name in FILES:
+        assert read(target / name) == read(name)
+
+
+def test_database_in_another_format_restores_by_line(store, tmp_path):
+    with open('database.json', 'w') as f:
+        json.dump(sample_database(10), f)
+    manifest = store.snapshot(['database.json'])
+    assert manifest['files']['database.json']['kind'] == 'lines'
+    store.restore(manifest['id'], str(tmp_path / 'restored'))
+    assert read(tmp_path / 'restored' / 'database.json') == read('database.json')
+
+
+def test_unchanged_files_take_no_snapshot(store):
+    write_database(sample_database())
+    assert store.snapshot(FILES)
+    assert store.snapshot(FILES) is None
+    assert len(store.list_snapshots()) == 1
+
+
+def test_edited_record_only_rewrites_its_chunk(store):
+    data = sample_database()
+    write_database(data)
+    first = store.snapshot(FILES)
+    data['users']['1000']['credits'] += 5
+    write_database(data)
+    second = store.snapshot(FILES)
+    assert len(all_chunks(first)) > 10
+    assert len(all_chunks(second) - all_chunks(first)) == 1
+
+
+def test_corrupt_chunk_is_caught_before_restoring(store, tmp_path):
+    write_database(sample_database())
+    manifest = store.snapshot(FILES)
+    chunk = manifest['files']['database.json']['chunks'][0]
+    with open(store._chunk_path(chunk), 'wb') as f:
+        f.write(b'not gzip')
+    assert store.verify(manifest['id'])[0].startswith("database.json: chunk")
+    with pytest.raises(bot.BackupError):
+        store.restore(manifest['id'], str(tmp_path / 'restored'))
+    assert not os.path.exists(tmp_path / 'restored' / 'database.json')
+
+
+def test_resolve_picks_the_latest_snapshot_at_a_time(store):
+    write_database(sample_database(10))
+    first = store.snapshot(FILES)['id']
+    write_database(sample_database(20))
+    second = store.snapshot(FILES)['id']
+    assert store.resolve() == second
+    assert store.resolve(at=datetime.strptime(first, '%Y%m%dT%H%M%S%fZ')) == first
+    assert store.resolve(snapshot_id=first) == first
+    with pytest.raises(bot.BackupError):
+        store.resolve(at=datetime(2000, 1, 1))
+    with pytest.raises(bot.BackupError):
+        store.resolve(snapshot_id='missing')
+
+
+def test_prune_drops_old_snapshots_and_their_chunks(store):
+    write_database(sample_database(10))
+    store.snapshot(FILES)
+    write_database(sample_database(20))
+    latest = store.snapshot(FILES)
+    store.prune(keep=1)
+    assert store.list_snapshots() == [latest['id']]
+    stored = {name[:-3] for _, _, names in os.walk(store.chunk_dir) for name in names}
+    assert stored == all_chunks(latest)
+    assert store.verify(latest['id']) == []
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return bot.CreditLedger(str(tmp_path / 'credit_ledger.jsonl'))
+
+
+def reloaded(ledger):
+    journal = bot.CreditLedger(ledger.path)
+    journal.load()
+    return journal
+
+
+def test_existing_balance_gets_an_opening_entry(ledger):
+    ledger.record(1, 'grant', 50, 80)
+    entries, page_count = ledger.history(1)
+    assert [(entry['type'], entry['delta'], entry['balance']) for entry in entries] == [('grant', 50, 80), ('opening', 30, 30)]
+    assert page_count == 1
+    assert ledger.reconstruct_balance(1) == 80
+
+
+def test_entries_move_credits_between_accounts(ledger):
+    ledger.record(1, 'grant', 10, 10, actor=99)
+    ledger.record(1, 'purchase', -4, 6, reference='ORDER1')
+    purchase, grant = ledger.history(1)[0]
+    assert (grant['from'], grant['to'], grant['actor']) == ('treasury', 'user:1', '99')
+    assert (purchase['from'], purchase['to'], purchase['amount'], purchase['ref']) == ('user:1', 'sales', 4, 'ORDER1')
+
+
+def test_entries_wait_for_flush(ledger):
+    ledger.record(1, 'grant', 10, 10)
+    assert not os.path.exists(ledger.path)
+    assert ledger.reconstruct_balance(1) == 10
+    ledger.flush()
+    ledger.record(1, 'purchase', -3, 7)
+    assert reloaded(ledger).reconstruct_balance(1) == 10
+    ledger.flush()
+    assert reloaded(ledger).reconstruct_balance(1) == 7
+
+
+def test_checkpoints_bound_reconstruction(ledger):
+    balance = 0
+    for n in range(bot.LEDGER_CHECKPOINT_INTERVAL * 2 + 5):
+        balance += n
+        ledger.record(1, 'grant', n, balance)
+    ledger.flush()
+    journal = reloaded(ledger)
+    assert journal.reconstruct_balance(1) == balance
+    assert len(journal.offsets['1']) - journal.last_checkpoint['1'] - 1 < bot.LEDGER_CHECKPOINT_INTERVAL
+    assert journal.next_seq == ledger.next_seq
+    assert journal.size == ledger.size == os.path.getsize(ledger.path)
+
+
+def test_history_pages_are_newest_first(ledger):
+    for n in range(1, 26):
+        ledger.record(1, 'grant', 1, n)
+    ledger.record(2, 'grant', 5, 5)
+    ledger.flush()
+    first, page_count = ledger.history(1, page=1, page_size=10)
+    last, _ = ledger.history(1, page=3, page_size=10)
+    assert page_count == 3
+    assert [entry['balance'] for entry in first] == list(range(25, 15, -1))
+    assert [entry['balance'] for entry in last] == list(range(5, 0, -1))
+    assert ledger.history(1, page=4, page_size=10)[0] == []
+    assert ledger.reconstruct_balance(3) is None
+
+
+def test_save_database_flushes_the_ledger(database, ledger, monkeypatch):
+    monkeypatch.setattr(bot.partitions.default, 'own_credit_ledger', ledger)
+    user_data = bot.get_user_data(424242)
+    bot.adjust_credits(424242, user_data, 25, 'grant')
+    assert not os.path.exists(ledger.path)
+    bot.save_database(database)
+    assert reloaded(ledger).reconstruct_balance(424242) == user_data['credits'] == 25
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def cache(clock):
+    return bot.IdempotencyCache(ttl=60, max_entries=3)
+
+
+def interaction(interaction_id, message_id=None, user_id=7):
+    message = SimpleNamespace(id=message_id) if message_id else None
+    return SimpleNamespace(id=interaction_id, message=message, user=SimpleNamespace(id=user_id))
+
+
+def test_duplicate_waits_then_gets_the_original_result(cache):
+    assert cache.claim('a') == (True, None)
+    assert cache.claim('a') == (False, None)
+    cache.complete('a', "✅ Purchased")
+    assert cache.claim('a') == (False, "✅ Purchased")
+
+
+def test_result_is_kept_for_the_ttl_after_completion(cache, clock):
+    cache.claim('a')
+    clock.advance(50)
+    cache.complete('a', "done")
+    clock.advance(59)
+    assert cache.claim('a') == (False, "done")
+    clock.advance(1)
+    assert cache.claim('a') == (True, None)
+
+
+def test_discard_lets_a_retry_run(cache):
+    cache.claim('a')
+    cache.discard('a')
+    assert cache.claim('a') == (True, None)
+
+
+def test_oldest_entries_are_evicted_beyond_the_limit(cache):
+    for key in 'abcd':
+        cache.claim(key)
+    assert cache.claim('e') == (True, None)
+    assert cache.claim('a') == (True, None)
+    assert cache.claim('d') == (False, None)
+
+
+def test_key_follows_the_menu_message(database):
+    first = bot.purchase_idempotency_key(interaction(1, message_id=500), 'r6_day', 2)
+    resubmit = bot.purchase_idempotency_key(interaction(2, message_id=500), 'r6_day', 2)
+    other_user = bot.purchase_idempotency_key(interaction(3, message_id=500, user_id=8), 'r6_day', 2)
+    assert first == resubmit
+    assert first != other_user
+
+
+def test_persistent_panel_key_uses_the_interaction(database):
+    database.setdefault('panels', {})['500'] = {'type': 'gen', 'channel_id': '1', 'product': None}
+    first = bot.purchase_idempotency_key(interaction(1, message_id=500), 'r6_day', 2)
+    second = bot.purchase_idempotency_key(interaction(2, message_id=500), 'r6_day', 2)
+    assert first != second
+
+
+def test_modal_source_ties_resubmits_together(database):
+    database.setdefault('panels', {})['500'] = {'type': 'gen', 'channel_id': '1', 'product': None}
+    first = bot.purchase_idempotency_key(interaction(1, message_id=500), 'r6_day', 2, source='modal-1')
+    resubmit = bot.purchase_idempotency_key(interaction(2, message_id=500), 'r6_day', 2, source='modal-1')
+    reopened = bot.purchase_idempotency_key(interaction(3, message_id=500), 'r6_day', 2, source='modal-2')
+    assert first == resubmit != reopened
@@ -0,0 +1,126 @@
+import copy
+
+import pytest
+
+import bot
+
+PURCHASED = '2024-01-01 12:30:00'
+EXPIRES = '2024-01-02 12:30:00'
+
+
+@pytest.fixture(autouse=True)
+def ledger(tmp_path, monkeypatch):
+    """Repairs journal through the credit ledger; keep that out of the shared one."""
+    ledger = bot.CreditLedger(str(tmp_path / 'credit_ledger.jsonl'))
+    monkeypatch.setattr(bot.partitions.default, 'own_credit_ledger', ledger)
+    return ledger
+
+
+def key_entry(key, expires=EXPIRES, order_id='ORDER1'):
+    return {'key': key, 'product': 'r6_day', 'purchase_date': PURCHASED, 'expires': expires, 'order_id': order_id}
+
+
+def healthy():
+    return {
+        'users': {'1': {'credits': 10, 'discount': 0, 'keys': [key_entry('KEY-1')]}},
+        'products': {'r6_day': {'keys': ['KEY-2', 'KEY-3']}},
+        'orders': {'ORDER1': {
+            'user_id': '1', 'date': PURCHASED, 'product_name': 'R6 Full (1 Day)',
+            'items': [{'product_id': 'r6_day', 'product_name': 'R6 Full (1 Day)', 'keys': ['KEY-1'], 'expires': EXPIRES}]
+        }},
+        'tickets': {'100': {'creator_id': '1', 'created_at': PURCHASED, 'status': 'open'}}
+    }
+
+
+def messages(problems):
+    return [problem.message for problem in problems]
+
+
+def test_healthy_database_has_no_problems():
+    assert bot.check_database(healthy()) == []
+
+
+def test_report_only_leaves_the_data_alone():
+    data = healthy()
+    data['users']['1']['keys'][0]['key'] = 'KEY-1\nKEY-4'
+    data['users']['1']['credits'] = -5
+    before = copy.deepcopy(data)
+    problems = bot.check_database(data)
+    assert problems and not any(problem.repaired for problem in problems)
+    assert data == before
+
+
+def test_multi_line_key_is_split():
+    data = healthy()
+    data['users']['1']['keys'][0]['key'] = 'KEY-1\nKEY-4'
+    problems = bot.check_database(data, repair=True)
+    assert messages(problems) == ["2 keys were sold as one: 'KEY-1\\nKEY-4'"]
+    assert problems[0].repaired
+    assert [entry['key'] for entry in data['users']['1']['keys']] == ['KEY-1', 'KEY-4']
+
+
+def test_repeated_key_keeps_its_first_entry():
+    data = healthy()
+    data['users']['1']['keys'].append(key_entry('KEY-1', order_id='ORDER2'))
+    bot.check_database(data, repair=True)
+    assert data['users']['1']['keys'] == [key_entry('KEY-1')]
+
+
+def test_date_only_expiry_gets_the_purchase_time():
+    data = healthy()
+    data['users']['1']['keys'][0]['expires'] = '2024-01-02'
+    bot.check_database(data, repair=True)
+    assert data['users']['1']['keys'][0]['expires'] == EXPIRES
+
+
+def test_key_sold_to_two_users_is_only_reported():
+    data = healthy()
+    data['users']['2'] = {'credits': 0, 'keys': [key_entry('KEY-1', order_id='ORDER2')]}
+    problems = bot.check_database(data, repair=True)
+    assert [(problem.record, problem.repaired) for problem in problems] == [('1, 2', False)]
+    assert messages(problems) == ["key 'KEY-1' was sold to 2 different users"]
+
+
+def test_sold_and_repeated_keys_leave_stock():
+    data = healthy()
+    data['products']['r6_day']['keys'] = ['KEY-1', 'KEY-2', 'KEY-2', 'KEY-3\nKEY-5']
+    problems = bot.check_database(data, repair=True)
+    assert len(problems) == 3 and all(problem.repaired for problem in problems)
+    assert data['products']['r6_day']['keys'] == ['KEY-2', 'KEY-3', 'KEY-5']
+
+
+def test_delivered_key_missing_from_the_buyer_is_restored():
+    data = healthy()
+    data['users']['1']['keys'] = []
+    problems = bot.check_database(data, repair=True)
+    assert messages(problems) == ["key 'KEY-1' is missing from the buyer's keys"]
+    assert data['users']['1']['keys'] == [key_entry('KEY-1')]
+
+
+def test_legacy_order_keys_are_checked():
+    data = healthy()
+    data['orders']['ORDER1'] = {'user_id': '1', 'date': PURCHASED, 'product_id': 'r6_day', 'key': 'KEY-1\nKEY-6', 'expires': EXPIRES}
+    problems = bot.check_database(data)
+    assert messages(problems) == ["key 'KEY-6' is missing from the buyer's keys"]
+
+
+def test_balance_and_discount_are_brought_into_range(ledger):
+    data = healthy()
+    data['users']['1'].update(credits=-5, discount=150)
+    problems = bot.check_database(data, repair=True, actor='test')
+    assert len(problems) == 2 and all(problem.repaired for problem in problems)
+    assert (data['users']['1']['credits'], data['users']['1']['discount']) == (0, 100)
+    entry = ledger.history(1)[0][0]
+    assert (entry['type'], entry['delta'], entry['ref'], entry['actor']) == ('set', 5, 'fsck', 'test')
+
+
+def test_unknown_product_and_bad_tickets_are_reported():
+    data = healthy()
+    data['products']['retired'] = {'keys': []}
+    data['tickets']['100'].update(status='archived', created_at='yesterday')
+    del data['tickets']['100']['creator_id']
+    problems = bot.check_database(data, repair=True)
+    assert sorted((problem.section, problem.record) for problem in problems) == [
+        ('products', 'retired'), ('tickets', '100'), ('tickets', '100'), ('tickets', '100')
+    ]
+    assert not any(problem.repaired for problem in problems)
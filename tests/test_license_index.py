@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import bot
+
+
+def sale(key, product='r6_day', expires='2099-01-01 00:00:00', order_id=None):
+    entry = {'key': key, 'product': product, 'purchase_date': '2024-01-01 00:00:00', 'expires': expires}
+    if order_id:
+        entry['order_id'] = order_id
+    return entry
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = bot.BloomFilter(5000)
+    keys = [f"KEY-{n:06d}" for n in range(5000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+
+def test_bloom_filter_false_positive_rate_is_near_target():
+    bloom = bot.BloomFilter(5000, error_rate=0.01)
+    for n in range(5000):
+        bloom.add(f"KEY-{n:06d}")
+    false_positives = sum(f"OTHER-{n:06d}" in bloom for n in range(10000))
+    assert false_positives < 300
+
+
+def test_rebuild_indexes_every_database():
+    first = {'users': {'1': {'keys': [sale('AAA-1')]}}}
+    second = {'users': {'2': {'keys': [sale('BBB-1')]}}, 'orders': {'ORD2': {'key': 'BBB-1'}}}
+    index = bot.LicenseIndex()
+    index.rebuild(first, second)
+    assert index.lookup('AAA-1')[0].user_id == '1'
+    record = index.lookup('BBB-1')[0]
+    assert (record.user_id, record.order_id) == ('2', 'ORD2')
+    assert index.lookup('CCC-1') is None
+
+
+def test_key_sold_twice_keeps_both_records():
+    data = {'users': {'1': {'keys': [sale('AAA-1')]}, '2': {'keys': [sale('AAA-1')]}}}
+    index = bot.LicenseIndex()
+    index.rebuild(data)
+    assert [record.user_id for record in index.lookup('AAA-1')] == ['1', '2']
+    assert index.validate('AAA-1')['user_id'] == '2'
+
+
+def test_add_regrows_the_bloom_filter_when_full():
+    index = bot.LicenseIndex()
+    capacity = index.bloom.capacity
+    keys = [f"KEY-{n:06d}" for n in range(capacity + 10)]
+    for key in keys:
+        index.add(1, sale(key))
+    assert index.bloom.capacity > capacity
+    assert all(index.lookup(key) for key in keys)
+    assert index.sorted_keys == sorted(keys)
+
+
+def test_search_prefix_stops_at_the_first_mismatch():
+    index = bot.LicenseIndex()
+    for key in ('ABC-2', 'ABC-1', 'ABD-1', 'XYZ-1'):
+        index.add(1, sale(key))
+    assert index.search_prefix('ABC') == ['ABC-1', 'ABC-2']
+    assert index.search_prefix('AB', limit=2) == ['ABC-1', 'ABC-2']
+    assert index.search_prefix('Q') == []
+
+
+def test_validate_reports_expired_and_unknown_keys():
+    index = bot.LicenseIndex()
+    past = (datetime.utcnow() - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    index.add(1, sale('OLD-1', expires=past))
+    index.add(1, sale('NEW-1'))
+    expired = index.validate('OLD-1')
+    assert (expired['valid'], expired['reason'], expired['user_id']) == (False, 'expired', '1')
+    assert index.validate('NEW-1')['valid']
+    assert index.validate('NONE-1') == {'key': 'NONE-1', 'valid': False, 'reason': 'unknown'}
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+import bot
+
+SINKS = ['file:a.jsonl', 'file:b.jsonl']
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'outbox.jsonl'), str(tmp_path / 'outbox_cursors.json')
+
+
+@pytest.fixture
+def outbox(paths):
+    return bot.EventOutbox(SINKS, *paths)
+
+
+def reopened(paths):
+    return bot.EventOutbox(SINKS, *paths)
+
+
+def test_events_wait_for_the_save(outbox):
+    outbox.publish('order.created', order_id='A')
+    assert outbox.read_batch(0) == ([], 0)
+    outbox.flush()
+    events, offset = outbox.read_batch(0)
+    assert [(event['seq'], event['type'], event['order_id'], event['guild_id']) for event in events] == [(1, 'order.created', 'A', None)]
+    assert offset == os.path.getsize(outbox.path)
+
+
+def test_save_database_flushes_published_events(outbox, database, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'outbox', outbox)
+    monkeypatch.setattr(bot.partitions.default, 'own_credit_ledger', bot.CreditLedger(str(tmp_path / 'credit_ledger.jsonl')))
+    bot.publish_event('stock.added', product_id='r6_day', quantity=1)
+    assert outbox.pending
+    bot.save_database(database)
+    assert not outbox.pending
+    assert outbox.read_batch(0)[0][0]['type'] == 'stock.added'
+
+
+def test_partial_last_line_is_left_for_later(outbox):
+    outbox.publish('order.created', order_id='A')
+    outbox.flush()
+    with open(outbox.path, 'a') as f:
+        f.write('{"seq": 2, "type": "order.cre')
+    events, offset = outbox.read_batch(0)
+    assert [event['seq'] for event in events] == [1]
+    assert outbox.read_batch(offset) == ([], offset)
+
+
+def test_batches_are_bounded(outbox, monkeypatch):
+    monkeypatch.setattr(bot, 'OUTBOX_BATCH_SIZE', 2)
+    for n in range(5):
+        outbox.publish('credit.changed', delta=n)
+    outbox.flush()
+    offset, seqs = 0, []
+    while True:
+        events, offset = outbox.read_batch(offset)
+        if not events:
+            break
+        assert len(events) <= 2
+        seqs += [event['seq'] for event in events]
+    assert seqs == [1, 2, 3, 4, 5]
+
+
+def test_cursors_track_each_sinks_backlog(outbox, paths):
+    for n in range(3):
+        outbox.publish('credit.changed', delta=n)
+    outbox.flush()
+    events, offset = outbox.read_batch(0)
+    outbox.advance(SINKS[0], offset, events[-1]['seq'])
+    outbox.publish('credit.changed', delta=3)
+    assert outbox.backlog(SINKS[0]) == (0, 0)
+    assert outbox.backlog(SINKS[1]) == (3, offset)
+    assert reopened(paths).cursors[SINKS[0]] == {'offset': offset, 'seq': 3}
+
+
+def test_seqs_continue_after_a_restart(outbox, paths):
+    outbox.publish('order.created', order_id='A')
+    outbox.publish('order.created', order_id='B')
+    outbox.flush()
+    assert reopened(paths).next_seq == 3
+
+
+def test_outbox_is_compacted_once_every_sink_caught_up(outbox, paths, monkeypatch):
+    monkeypatch.setattr(bot, 'OUTBOX_COMPACT_BYTES', 1)
+    outbox.publish('order.created', order_id='A')
+    outbox.publish('order.created', order_id='B')
+    outbox.flush()
+    events, offset = outbox.read_batch(0)
+    outbox.advance(SINKS[0], offset, 2)
+    assert os.path.getsize(outbox.path) == offset
+    outbox.advance(SINKS[1], offset, 2)
+    assert os.path.getsize(outbox.path) == 0
+    assert all(cursor['offset'] == 0 for cursor in outbox.cursors.values())
+    # Seqs keep counting from the cursors, and a stale offset reads from the start again
+    restarted = reopened(paths)
+    assert restarted.next_seq == 3
+    restarted.publish('order.created', order_id='C')
+    restarted.flush()
+    assert [event['seq'] for event in restarted.read_batch(offset)[0]] == [3]
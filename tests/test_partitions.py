@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import bot
+
+GUILD_ID = 555
+
+
+@pytest.fixture
+def guilds(tmp_path, monkeypatch):
+    """An empty partition directory, with the partition store's registry put back afterwards."""
+    monkeypatch.setattr(bot, 'PARTITION_DIR', str(tmp_path / 'guilds'))
+    monkeypatch.setattr(bot, 'license_index', bot.LicenseIndex())
+    store = bot.partitions
+    saved = store.partitions, store.guild_ids
+    store.partitions, store.guild_ids = {}, set()
+    yield tmp_path / 'guilds'
+    store.partitions, store.guild_ids = saved
+
+
+def write_partition(guilds, guild_id, data):
+    directory = guilds / str(guild_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'database.json', 'w') as f:
+        json.dump({'products': {}, 'tickets': {}, **data}, f)
+    bot.partitions.scan()
+
+
+def sold(key):
+    return {'key': key, 'product': 'r6_day', 'purchase_date': '2024-01-01 00:00:00', 'expires': '2099-01-01 00:00:00'}
+
+
+def test_scan_only_finds_guild_directories_with_a_database(guilds):
+    write_partition(guilds, GUILD_ID, {'users': {}})
+    (guilds / 'notes').mkdir()
+    (guilds / '777').mkdir()
+    bot.partitions.scan()
+    assert bot.partitions.guild_ids == {GUILD_ID}
+
+
+def test_unknown_guilds_and_dms_use_the_default_partition(guilds):
+    assert asyncio.run(bot.partitions.get(None)) is bot.partitions.default
+    assert asyncio.run(bot.partitions.get(123)) is bot.partitions.default
+
+
+def test_concurrent_first_uses_share_one_load(guilds):
+    write_partition(guilds, GUILD_ID, {'users': {'9': {'credits': 3, 'keys': []}}})
+
+    async def scenario():
+        return await asyncio.gather(bot.partitions.get(GUILD_ID), bot.partitions.get(str(GUILD_ID)))
+
+    first, second = asyncio.run(scenario())
+    assert first is second is bot.partitions.partitions[GUILD_ID]
+    assert first.data['users']['9']['credits'] == 3
+    assert bot.partitions.loading == {}
+
+
+def test_use_partition_routes_database(guilds):
+    write_partition(guilds, GUILD_ID, {'users': {'9': {'credits': 3, 'keys': []}}})
+    partition = asyncio.run(bot.partitions.get(GUILD_ID))
+    with bot.use_partition(partition):
+        assert bot.database['users'] is partition.data['users']
+    assert bot.database['users'] is bot.partitions.default.data['users']
+
+
+def test_shared_credits_use_the_default_users_and_ledger(guilds):
+    write_partition(guilds, GUILD_ID, {'users': {'9': {'credits': 3}}, 'shared_credits': True})
+    partition = asyncio.run(bot.partitions.get(GUILD_ID))
+    assert partition.data['users'] is bot.partitions.default.data['users']
+    assert partition.credit_ledger is bot.partitions.default.credit_ledger
+
+
+def test_license_index_covers_every_partition(guilds, database):
+    # Keys sold in a guild's partition validate whether or not that guild has been loaded yet
+    database['users']['1'] = {'credits': 0, 'keys': [sold('DEFAULT-1')]}
+    write_partition(guilds, GUILD_ID, {'users': {'9': {'credits': 0, 'keys': [sold('GUILD-1')]}}})
+    write_partition(guilds, GUILD_ID + 1, {'users': {'8': {'credits': 0, 'keys': [sold('GUILD-2')]}}})
+    loaded = asyncio.run(bot.partitions.get(GUILD_ID + 1))
+    loaded.data['users']['8']['keys'].append(sold('GUILD-3'))  # Sold since the last save
+    bot.rebuild_license_index()
+    for key, owner in (('DEFAULT-1', '1'), ('GUILD-1', '9'), ('GUILD-2', '8'), ('GUILD-3', '8')):
+        assert bot.license_index.validate(key)['user_id'] == owner
+
+
+def test_check_all_reads_unloaded_partitions_without_loading_them(guilds):
+    write_partition(guilds, GUILD_ID, {'users': {'9': {'credits': -1, 'keys': []}}})
+    results = bot.partitions.check_all()
+    assert set(results) == {None, GUILD_ID}
+    assert [problem.message for problem in results[GUILD_ID]] == ["negative balance of -1 credits"]
+    assert bot.partitions.partitions == {}
+
+
+def test_create_gives_a_guild_an_empty_partition(guilds):
+    partition = asyncio.run(bot.partitions.create(GUILD_ID))
+    assert os.path.exists(partition.database_file)
+    assert partition.data['users'] == {}
+    assert bot.partitions.partitions[GUILD_ID] is partition
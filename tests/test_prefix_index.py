@@ -0,0 +1,49 @@
+import bot
+
+
+def test_search_is_case_insensitive_and_sorted():
+    index = bot.PrefixIndex([('Rainbow Six', 'r6'), ('rust', 'rust'), ('Roblox', 'roblox'), ('Apex', 'apex')])
+    assert index.search('R') == ['r6', 'roblox', 'rust']
+    assert index.search('ro') == ['roblox']
+    assert index.search('z') == []
+
+
+def test_value_filed_under_several_terms_is_returned_once():
+    index = bot.PrefixIndex((term, 'r6_day') for term in bot.name_terms('r6_day', 'R6 Full (1 Day)'))
+    assert index.search('') == ['r6_day']
+    assert index.search('full') == ['r6_day']
+    assert index.search('day') == ['r6_day']
+
+
+def test_limit_counts_distinct_values():
+    index = bot.PrefixIndex([('a1', 1), ('a2', 1), ('a3', 2), ('a4', 3)])
+    assert index.search('a', limit=2) == [1, 2]
+
+
+def test_add_and_discard_keep_the_index_sorted():
+    index = bot.PrefixIndex([('beta', 2)])
+    index.add('Alpha', 1)
+    index.add('gamma', 3)
+    assert index.search('') == [1, 2, 3]
+    index.discard('ALPHA', 1)
+    index.discard('missing', 9)
+    assert index.search('') == [2, 3]
+    assert len(index) == 2
+
+
+def test_name_terms_cover_each_later_word():
+    assert bot.name_terms('r6_day', 'R6 Full (1 Day)') == ['r6_day', 'R6 Full (1 Day)', 'Full 1 Day', '1 Day', 'Day']
+
+
+def test_order_index_keeps_customers_apart():
+    index = bot.OrderIndex()
+    index.rebuild({'orders': {
+        'AB12': {'user_id': '1', 'date': '2024-01-02'},
+        'AB34': {'user_id': '2', 'date': '2024-01-01'},
+        'CD56': {'user_id': '1', 'date': '2024-01-03'}
+    }})
+    index.add(1, 'AB78')
+    assert index.search('ab') == ['AB12', 'AB34', 'AB78']
+    assert index.search('ab', user_id=1) == ['AB12', 'AB78']
+    assert index.search('', user_id=1) == ['AB78', 'CD56', 'AB12']
+    assert index.search('', user_id=3) == []
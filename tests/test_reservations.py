@@ -0,0 +1,105 @@
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def product(database):
+    """A stocked product with ten keys."""
+    database['products']['test_product'] = {
+        'name': 'Test Product',
+        'credit_cost': 1,
+        'duration_days': 1,
+        'keys': [f"TEST-{n:04d}" for n in range(10)]
+    }
+    return 'test_product'
+
+
+@pytest.fixture
+def reservations(clock):
+    return bot.StockReservations(ttl=120)
+
+
+def test_hold_is_taken_from_other_users_stock(reservations, product):
+    assert reservations.reserve(1, product, 7)
+    assert reservations.available(product, user_id=2) == 3
+    assert reservations.available(product, user_id=1) == 10
+    assert reservations.reserve(2, product, 4) is None
+    assert reservations.reserve(2, product, 3)
+    assert reservations.reserved(product) == 10
+
+
+def test_repicking_replaces_the_same_flows_hold(reservations, product):
+    first = reservations.reserve(1, product, 3)
+    second = reservations.reserve(1, product, 5)
+    assert reservations.get(first) is None
+    assert reservations.get(second)['quantity'] == 5
+    assert reservations.reserved(product) == 5
+
+
+def test_purchase_hold_leaves_cart_hold_alone(reservations, product):
+    cart_hold = reservations.reserve(1, product, 4, source='cart')
+    purchase_hold = reservations.reserve(1, product, 3)
+    assert reservations.get(cart_hold)['quantity'] == 4
+    assert reservations.get(purchase_hold)['quantity'] == 3
+    # The purchase flow may spend its own hold but not the cart's
+    assert reservations.available(product, user_id=1, source='purchase') == 6
+    assert reservations.reserve(1, product, 7) is None
+    assert reservations.get(cart_hold)['quantity'] == 4
+
+
+def test_hold_expires_after_its_ttl(reservations, clock, product):
+    hold_id = reservations.reserve(1, product, 4)
+    clock.advance(119)
+    assert reservations.get(hold_id)
+    clock.advance(1)
+    assert reservations.get(hold_id) is None
+    assert reservations.available(product, user_id=2) == 10
+
+
+def test_hold_uses_its_own_ttl(reservations, clock, product):
+    hold_id = reservations.reserve(1, product, 2, source='cart', ttl=bot.CART_HOLD_TTL_SECONDS)
+    clock.advance(121)
+    assert reservations.get(hold_id)
+    clock.advance(bot.CART_HOLD_TTL_SECONDS)
+    assert reservations.get(hold_id) is None
+
+
+def test_resize_restarts_the_ttl(reservations, clock, product):
+    # The quantity modal resizes the variant pick's hold; it must last a full TTL from then
+    hold_id = reservations.reserve(1, product, 1)
+    clock.advance(100)
+    assert reservations.resize(hold_id, 3)
+    clock.advance(100)
+    hold = reservations.get(hold_id)
+    assert hold and hold['quantity'] == 3
+    assert reservations.reserved(product) == 3
+    clock.advance(20)
+    assert reservations.get(hold_id) is None
+    assert reservations.reserved(product) == 0
+
+
+def test_resize_beyond_stock_keeps_the_hold(reservations, product):
+    hold_id = reservations.reserve(1, product, 2)
+    reservations.reserve(2, product, 5)
+    assert not reservations.resize(hold_id, 6)
+    assert reservations.get(hold_id)['quantity'] == 2
+    assert reservations.resize(hold_id, 5)
+    assert reservations.reserved(product) == 10
+
+
+def test_expired_hold_cannot_be_resized_or_refreshed(reservations, clock, product):
+    hold_id = reservations.reserve(1, product, 2)
+    clock.advance(120)
+    assert not reservations.refresh(hold_id)
+    assert not reservations.resize(hold_id, 1)
+    assert reservations.reserved(product) == 0
+
+
+def test_commit_and_release_return_the_hold_once(reservations, product):
+    sold = reservations.reserve(1, product, 3)
+    dropped = reservations.reserve(2, product, 2)
+    assert reservations.commit(sold)['quantity'] == 3
+    assert reservations.release(dropped)['quantity'] == 2
+    assert reservations.release(dropped) is None
+    assert reservations.reserved(product) == 0